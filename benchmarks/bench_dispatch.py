@@ -0,0 +1,142 @@
+"""
+Benchmark: CSE machine dispatch speed, in machine steps (executed instructions)
+per second.
+
+Programs are compiled once; only CSEMachine.run is timed. The best of several
+runs is reported for Tests/towers, Tests/tiny and a synthetic arithmetic loop.
+Each program is also run on LadderMachine, which runs the same instructions
+through the if/elif ladder the machine used before its handler tables, so the
+table shows the dispatch cost before and after.
+
+    python benchmarks/bench_dispatch.py [repetitions]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.bytecode import (  # noqa: E402
+    LOAD_CONST, LOAD_VAR, MAKE_LAMBDA, APPLY, BINOP, UNOP, BUILD_TUPLE,
+    JUMP_IF_FALSE, JUMP, RETURN, TAIL_APPLY, MAKE_LETREC, CALL, LET, BIND,
+    SWITCH, SWITCH_TYPE, SKIP_ENVS)
+from src.compiler import Compiler  # noqa: E402
+from src.csemachine import CSEMachine, MachineHalt  # noqa: E402
+from src.standardizer import standardize  # noqa: E402
+
+TESTS_DIR = os.path.join(ROOT, "Tests")
+
+ARITHMETIC_LOOP = """
+let rec Loop N Acc = N eq 0 -> Acc | Loop (N - 1) (Acc + N * 2 - 1)
+in Print (Loop 20000 0)
+"""
+
+
+def read_test(name: str) -> str:
+    with open(os.path.join(TESTS_DIR, name)) as f:
+        return f.read()
+
+
+PROGRAMS = {
+    "towers": read_test("towers"),
+    "towers (10 discs)": read_test("towers").replace("'C' 4", "'C' 10"),
+    "tiny": read_test("tiny"),
+    "arithmetic loop": ARITHMETIC_LOOP,
+}
+
+
+class LadderMachine(CSEMachine):
+    """
+    The CSE machine with the dispatch it had before the handler tables: the
+    instructions keep their opcodes and every step compares the opcode with
+    each instruction in turn, in the order of the old loop. The instructions
+    themselves are the machine's own handlers.
+    """
+
+    def link(self, instructions):
+        linked = super().link(instructions)
+        return [(op, operand)
+                for (op, _), (_, operand) in zip(instructions, linked)]
+
+    def apply_rules(self, step_limit=None):
+        self.code = self.main.instructions
+        self.pc = 0
+        self.environment = self.primitive_environment
+        steps = 0
+        try:
+            while True:
+                op, operand = self.code[self.pc]
+                self.pc += 1
+                steps += 1
+                if op == LOAD_CONST:
+                    self.load_const(operand)
+                elif op == LOAD_VAR:
+                    self.load_var(operand)
+                elif op == MAKE_LAMBDA:
+                    self.make_lambda(operand)
+                elif op == APPLY:
+                    self.apply(operand)
+                elif op == TAIL_APPLY:
+                    self.tail_apply(operand)
+                elif op == RETURN:
+                    self.do_return(operand)
+                elif op == BINOP:
+                    self.binop(operand)
+                elif op == UNOP:
+                    self.unop(operand)
+                elif op == JUMP_IF_FALSE:
+                    self.jump_if_false(operand)
+                elif op == JUMP:
+                    self.jump(operand)
+                elif op == BUILD_TUPLE:
+                    self.build_tuple(operand)
+                elif op == MAKE_LETREC:
+                    self.make_letrec(operand)
+                elif op == CALL:
+                    self.call(operand)
+                elif op == LET:
+                    self.let(operand)
+                elif op == BIND:
+                    self.bind(operand)
+                elif op == SWITCH:
+                    self.switch(operand)
+                elif op == SWITCH_TYPE:
+                    self.switch_type(operand)
+                elif op == SKIP_ENVS:
+                    self.skip_envs(operand)
+        except MachineHalt:
+            pass
+        self.steps = steps
+        self.environment = self.primitive_environment
+
+
+def best_time(machine, source: str, repetitions: int) -> float:
+    best = float("inf")
+    for _ in range(repetitions):
+        blocks = Compiler().compile(standardize(source))
+        start = time.perf_counter()
+        machine.run(blocks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(repetitions: int) -> None:
+    print(f"{'program':<20}{'steps':>10}{'ladder ms':>11}{'table ms':>10}"
+          f"{'ladder steps/s':>16}{'table steps/s':>15}")
+    for name, source in PROGRAMS.items():
+        ladder, machine = LadderMachine(), CSEMachine()
+        # Interleaved, so both see the same machine load.
+        ladder_best = table_best = float("inf")
+        for _ in range(repetitions):
+            ladder_best = min(ladder_best, best_time(ladder, source, 1))
+            table_best = min(table_best, best_time(machine, source, 1))
+        steps = machine.statistics()["steps"]
+        assert ladder.statistics()["steps"] == steps
+        print(f"{name:<20}{steps:>10}{ladder_best * 1000:>11.2f}"
+              f"{table_best * 1000:>10.2f}{steps / ladder_best:>16,.0f}"
+              f"{steps / table_best:>15,.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
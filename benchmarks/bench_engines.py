@@ -0,0 +1,73 @@
+"""
+Benchmark: the CSE machine versus the closure-compiling engine and the Python translation.
+
+For every program in Tests/, plus a few larger workloads (a deep non-tail recursion, a
+long tail-recursive loop and towers of Hanoi on 12 discs), this runs each engine, checks
+that they print the same result, and reports the wall-clock time of each. The Python
+engine is timed once its module is cached, as for a program that is run many times.
+
+    python benchmarks/bench_engines.py [repetitions]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.csemachine import CSEMachine  # noqa: E402
+from src.closure_engine import ClosureEngine  # noqa: E402
+from src.transpiler import PythonEngine  # noqa: E402
+
+TESTS_DIR = os.path.join(ROOT, "Tests")
+
+WORKLOADS = {
+    "[sum 20000]": "let rec Sum N = N eq 0 -> 0 | N + Sum (N-1) in Print (Sum 20000)",
+    "[loop 100000]": "let rec L n a = n eq 0 -> a | L (n-1) (a+n) in Print (L 100000 0)",
+}
+
+
+def measure(engine, source: str, repetitions: int):
+    # Some programs print errors themselves (ItoS); keep them out of the table.
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine is PythonEngine:
+            try:
+                engine().load(source)
+            except Exception:
+                pass
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            try:
+                result = engine().evaluate(source)
+            except (Exception, SystemExit) as error:
+                result = type(error).__name__
+    return result, (time.perf_counter() - start) / repetitions * 1000
+
+
+def main(repetitions: int) -> None:
+    programs = {}
+    for name in sorted(os.listdir(TESTS_DIR)):
+        if os.path.isdir(os.path.join(TESTS_DIR, name)):
+            continue  # __rpalcache__ from --engine=python
+        with open(os.path.join(TESTS_DIR, name)) as f:
+            programs[name] = f.read()
+    programs["[towers 12]"] = programs["towers"].replace("'C' 4", "'C' 12")
+    programs.update(WORKLOADS)
+
+    print(f"{'program':<15}{'cse ms/run':>12}{'closure ms/run':>16}{'speedup':>10}"
+          f"{'python ms/run':>15}{'speedup':>10}")
+    for name, source in programs.items():
+        cse_result, cse_ms = measure(CSEMachine, source, repetitions)
+        closure_result, closure_ms = measure(ClosureEngine, source, repetitions)
+        python_result, python_ms = measure(PythonEngine, source, repetitions)
+        if not cse_result == closure_result == python_result:
+            print(f"{name:<15}different output")
+            continue
+        print(f"{name:<15}{cse_ms:>12.2f}{closure_ms:>16.2f}{cse_ms / closure_ms:>9.2f}x"
+              f"{python_ms:>15.2f}{cse_ms / python_ms:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
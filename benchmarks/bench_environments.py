@@ -0,0 +1,88 @@
+"""
+Benchmark: environment creation cost over the Tests/ corpus.
+
+For every program this reports the wall-clock time of an evaluation, the
+number of environments created and the peak number alive at once, the
+bindings actually stored in them (linked frames store only their own
+variables) and the bindings a copy-the-parent scheme would have had to store
+(every binding visible from each environment, a shadowed name once per
+scope). Environments are released as soon as nothing refers to them, so the
+peak follows recursion depth, not call count.
+
+    python benchmarks/bench_environments.py [repetitions]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import csemachine  # noqa: E402
+from src.csemachine import CSEMachine  # noqa: E402
+
+TESTS_DIR = os.path.join(ROOT, "Tests")
+
+
+class CountingEnvironment(csemachine.Environment):
+    """
+    An Environment that adds its bindings to `stored` and the bindings of its
+    whole scope chain to `copied` when it is created.
+    """
+
+    stored = 0
+    copied = 0
+
+    def __init__(self, tracker, parent, slots, numbers=1):
+        super().__init__(tracker, parent, slots, numbers)
+        visible = len(slots)
+        while parent is not None:
+            visible += len(parent.slots)
+            parent = parent.parent
+        CountingEnvironment.stored += len(slots)
+        CountingEnvironment.copied += visible
+
+
+def count_bindings(source: str):
+    # A separate run, so the counting does not affect the timings.
+    CountingEnvironment.stored = CountingEnvironment.copied = 0
+    csemachine.Environment = CountingEnvironment
+    try:
+        CSEMachine().evaluate(source)
+    finally:
+        csemachine.Environment = CountingEnvironment.__base__
+    return CountingEnvironment.stored, CountingEnvironment.copied
+
+
+def main(repetitions: int) -> None:
+    print(f"{'program':<15}{'ms/run':>10}{'created':>10}{'peak':>8}"
+          f"{'stored':>10}{'copied':>10}")
+    total_stored = total_copied = 0
+    for name in sorted(os.listdir(TESTS_DIR)):
+        if os.path.isdir(os.path.join(TESTS_DIR, name)):
+            continue  # __rpalcache__ from --engine=python
+        with open(os.path.join(TESTS_DIR, name)) as f:
+            source = f.read()
+        machine = CSEMachine()
+        start = time.perf_counter()
+        try:
+            for _ in range(repetitions):
+                machine.evaluate(source)
+        except (SystemExit, Exception) as error:
+            # Reported, not hidden: a failure here is a regression to look at.
+            print(f"{name:<15}  {type(error).__name__}: {error}")
+            continue
+        elapsed = (time.perf_counter() - start) / repetitions * 1000
+        stats = machine.statistics()
+        stored, copied = count_bindings(source)
+        total_stored += stored
+        total_copied += copied
+        print(f"{name:<15}{elapsed:>10.2f}"
+              f"{stats['environments_created']:>10}"
+              f"{stats['peak_environments']:>8}{stored:>10}{copied:>10}")
+    print(f"{'total':<15}{'':>10}{'':>10}{'':>8}"
+          f"{total_stored:>10}{total_copied:>10}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
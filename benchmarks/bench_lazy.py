@@ -0,0 +1,74 @@
+"""
+Benchmark: eager versus lazy (call-by-need) evaluation.
+
+Each workload defines much more than it uses: a table of expensive results of which one is
+read, a binding that only the branch not taken needs, and a record whose fields are
+computed by recursion. This runs each on the CSE machine, on the closure engine and on the
+lazy engine, checks that they print the same result, and reports the wall-clock time of
+each. The programs in Tests/, which use what they define, show the cost of the thunks.
+
+    python benchmarks/bench_lazy.py [repetitions]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.csemachine import CSEMachine  # noqa: E402
+from src.closure_engine import ClosureEngine  # noqa: E402
+from src.lazy_engine import LazyEngine  # noqa: E402
+
+TESTS_DIR = os.path.join(ROOT, "Tests")
+
+PRELUDE = ("let rec Sum N = N eq 0 -> 0 | N + Sum (N-1) "
+           "in let rec Fib N = N ls 2 -> N | Fib (N-1) + Fib (N-2) ")
+
+WORKLOADS = {
+    "[table]": PRELUDE + "in let Table = (Sum 20000, Fib 18, Sum 30000, 'small') "
+                         "in Print (Table 4)",
+    "[branch]": PRELUDE + "in let Big = Fib 20 and Small = Fib 5 "
+                          "in Print (Small gr 100 -> Big | Small)",
+    "[record]": PRELUDE + "in let Stats N = (Sum N, Fib (N / 1000), N) "
+                          "in let S = Stats 20000 in Print (S 3, S 1)",
+}
+
+
+def measure(engine, source: str, repetitions: int):
+    # Some programs print errors themselves (ItoS); keep them out of the table.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            try:
+                result = engine().evaluate(source)
+            except (Exception, SystemExit) as error:
+                result = type(error).__name__
+    return result, (time.perf_counter() - start) / repetitions * 1000
+
+
+def main(repetitions: int) -> None:
+    programs = dict(WORKLOADS)
+    for name in sorted(os.listdir(TESTS_DIR)):
+        if os.path.isdir(os.path.join(TESTS_DIR, name)):
+            continue  # __rpalcache__ from --engine=python
+        with open(os.path.join(TESTS_DIR, name)) as f:
+            programs[name] = f.read()
+
+    print(f"{'program':<15}{'cse ms/run':>12}{'closure ms/run':>16}{'lazy ms/run':>13}"
+          f"{'vs closure':>12}")
+    for name, source in programs.items():
+        cse_result, cse_ms = measure(CSEMachine, source, repetitions)
+        closure_result, closure_ms = measure(ClosureEngine, source, repetitions)
+        lazy_result, lazy_ms = measure(LazyEngine, source, repetitions)
+        if not cse_result == closure_result == lazy_result:
+            print(f"{name:<15}different output")
+            continue
+        print(f"{name:<15}{cse_ms:>12.2f}{closure_ms:>16.2f}{lazy_ms:>13.2f}"
+              f"{closure_ms / lazy_ms:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,51 @@
+"""
+Benchmark: recursive definitions through Y* versus letrec closures.
+
+For every program in Tests/ that uses 'rec', this runs the default Y* compilation and the
+letrec compilation, checks that both print the same result, and reports machine steps,
+environments created and wall-clock time for each.
+
+    python benchmarks/bench_letrec.py [repetitions]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.csemachine import CSEMachine  # noqa: E402
+
+TESTS_DIR = os.path.join(ROOT, "Tests")
+
+
+def measure(source: str, letrec: bool, repetitions: int):
+    machine = CSEMachine(letrec=letrec)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = machine.evaluate(source)
+    elapsed = (time.perf_counter() - start) / repetitions * 1000
+    stats = machine.statistics()
+    return result, stats["steps"], stats["environments_created"], elapsed
+
+
+def main(repetitions: int) -> None:
+    print(f"{'program':<15}{'steps':>16}{'environments':>16}{'ms/run':>16}")
+    for name in sorted(os.listdir(TESTS_DIR)):
+        if os.path.isdir(os.path.join(TESTS_DIR, name)):
+            continue  # __rpalcache__ from --engine=python
+        with open(os.path.join(TESTS_DIR, name)) as f:
+            source = f.read()
+        if "rec" not in source.split():
+            continue
+        y_result, y_steps, y_envs, y_ms = measure(source, False, repetitions)
+        l_result, l_steps, l_envs, l_ms = measure(source, True, repetitions)
+        if y_result != l_result:
+            print(f"{name:<15}different output")
+            continue
+        print(f"{name:<15}{y_steps:>7} -> {l_steps:<6}{y_envs:>7} -> {l_envs:<6}"
+              f"{y_ms:>7.2f} -> {l_ms:<6.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
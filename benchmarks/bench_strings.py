@@ -0,0 +1,44 @@
+"""
+Benchmark: character-at-a-time string processing on long strings.
+
+Each program builds an n-character string with Conc, then walks it with Stem and Stern.
+Conc builds rope nodes and Stern returns a view, so every program should scale linearly
+with n; copying the string on each step would make them quadratic.
+
+    python benchmarks/bench_strings.py [length ...]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.csemachine import CSEMachine  # noqa: E402
+
+BUILD = "let rec Build N S = N eq 0 -> S | Build (N-1) (Conc S 'ab') in "
+
+PROGRAMS = {
+    "build": BUILD + "Print (Order (Build {half} ''))",
+    "length": BUILD + ("let rec Length S N = S eq '' -> N | Length (Stern S) (N+1) "
+                       "in Print (Length (Build {half} '') 0)"),
+    "reverse": BUILD + ("let rec Reverse S R = S eq '' -> R | Reverse (Stern S) (Conc (Stem S) R) "
+                        "in Print (Stem (Reverse (Build {half} '') ''))"),
+    "count": BUILD + ("let rec Count S N = S eq '' -> N | Count (Stern S) (Stem S eq 'a' -> N+1 | N) "
+                      "in Print (Count (Build {half} '') 0)"),
+}
+
+
+def main(lengths) -> None:
+    print(f"{'program':<10}{'length':>10}{'seconds':>10}  result")
+    for name, template in PROGRAMS.items():
+        for length in lengths:
+            source = template.format(half=length // 2)
+            start = time.perf_counter()
+            result = CSEMachine().evaluate(source)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<10}{length:>10}{elapsed:>10.3f}  {result}")
+
+
+if __name__ == "__main__":
+    main([int(argument) for argument in sys.argv[1:]] or [25000, 50000, 100000])
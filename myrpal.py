@@ -1,21 +1,51 @@
+import os
 import sys
 from typing import List
 from src.parser import Parser
 from src.rpal_ast import preorder_traversal, ASTNode
 from src.standardizer import standardize, make_standardized_tree
-from src.csemachine import get_result
+from src.csemachine import CSEMachine, MEMO_SIZE
+from src.closure_engine import ClosureEngine
+from src.transpiler import PythonEngine, translate
+from src.lazy_engine import LazyEngine
+from src.compiler import Compiler
+from src.optimizer import optimize
+from src.bytecode import disassemble
 from src.lexer import Lexer
 from src.errors import RPALException
 
 USAGE = (
     "Usage:\n"
-    "  python main.py [-l] [-ast] [-st] filename\n\n"
+    "  python main.py [-l] [-ast] [-st] [-opt] [-bc] [--emit-python] [-stats] [-letrec] [-fold] [-memo[=N]]\n"
+    "                      [-coalesce] [-quicken] [--engine=cse|closure|python|lazy] filename\n\n"
     "  -l       : List the source file verbatim\n"
     "  -ast     : Print the Abstract Syntax Tree (AST)\n"
     "  -st      : Print the Standardized Tree (ST)\n"
+    "  -opt     : Print the ST after the optimizer (inlining, dead code, -fold, -coalesce)\n"
+    "  -bc      : Print the bytecode compiled from the ST\n"
+    "  --emit-python : Print the Python module the program translates to\n"
+    "  -stats   : Run the program, then print CSE machine statistics to stderr\n"
+    "  -letrec  : Compile 'rec' definitions to self-referencing closures instead of Y*\n"
+    "  -fold    : Pre-evaluate closed subexpressions (constant folding) before compiling\n"
+    "  -coalesce : Run chains of let bindings in one environment (closures print other\n"
+    "              environment numbers)\n"
+    "  -memo    : Cache the results of recursive functions that cannot print (CSE machine),\n"
+    "             keeping the N most recently used (default 10000)\n"
+    "  -quicken : Specialize operators and calls to the types they see at run time (CSE machine)\n"
+    "  --engine=closure : Run on the closure-compiling engine instead of the CSE machine\n"
+    "  --engine=python  : Run the program translated to Python, cached in __rpalcache__\n"
+    "  --engine=lazy    : Run on the closure engine, evaluating bindings and tuple components\n"
+    "                     only when needed (Print in an unused binding does not print)\n"
     "  filename : Path to the RPAL source file"
 )
 
+DUMP_SWITCHES = ("-l", "-ast", "-st", "-opt", "-bc", "--emit-python")
+RUN_SWITCHES = ("-stats", "-letrec", "-fold", "-coalesce", "-memo", "-quicken")
+ENGINES = {"--engine=cse": CSEMachine, "--engine=closure": ClosureEngine,
+           "--engine=python": PythonEngine, "--engine=lazy": LazyEngine}
+# PythonEngine keeps the modules it generates in this directory, next to the source file
+CACHE_DIRECTORY = "__rpalcache__"
+
 
 def read_file(path: str) -> str:
     try:
@@ -26,6 +56,26 @@ def read_file(path: str) -> str:
         sys.exit(1)
 
 
+def print_statistics(machine: CSEMachine) -> None:
+    for key, value in machine.statistics().items():
+        print(f"{key}: {value}", file=sys.stderr)
+
+
+def memo_size(switches: List[str]) -> int:
+    for flag in switches:
+        if flag == "-memo":
+            return MEMO_SIZE
+        if flag.startswith("-memo="):
+            return int(flag[len("-memo="):])
+    return 0
+
+
+def is_switch(flag: str) -> bool:
+    if flag.startswith("-memo="):
+        return flag[len("-memo="):].isdigit()
+    return flag in DUMP_SWITCHES + RUN_SWITCHES + tuple(ENGINES)
+
+
 def main(argv: List[str]) -> None:
     if len(argv) < 2:
         print(USAGE)
@@ -37,17 +87,32 @@ def main(argv: List[str]) -> None:
     source_code = read_file(filename)
 
     try:
-        if not switches:
-            # No flags → just run it
-            result = get_result(source_code)
+        if not all(is_switch(flag) for flag in switches):
+            print(USAGE)
+            sys.exit(1)
+
+        if not any(flag in DUMP_SWITCHES for flag in switches):
+            # No dump flags → just run it
+            engine = next((ENGINES[flag] for flag in switches if flag in ENGINES), CSEMachine)
+            if engine is CSEMachine:
+                machine = engine(letrec="-letrec" in switches, fold="-fold" in switches,
+                                 coalesce="-coalesce" in switches,
+                                 memo_size=memo_size(switches), quicken="-quicken" in switches)
+            elif memo_size(switches) or "-quicken" in switches:
+                print(USAGE)
+                sys.exit(1)
+            else:
+                machine = engine(letrec="-letrec" in switches, fold="-fold" in switches,
+                                 coalesce="-coalesce" in switches)
+            if engine is PythonEngine:
+                machine.cache_dir = os.path.join(os.path.dirname(filename), CACHE_DIRECTORY)
+            result = machine.evaluate(source_code)
             if result is not None:
                 print(result)
+            if "-stats" in switches:
+                print_statistics(machine)
             return
 
-        if any(flag not in ("-l", "-ast", "-st") for flag in switches):
-            print(USAGE)
-            sys.exit(1)
-
         # 1. -l : list source
         if "-l" in switches:
             print(source_code)
@@ -65,14 +130,34 @@ def main(argv: List[str]) -> None:
                 st_root = make_standardized_tree(ast_root)
                 preorder_traversal(st_root)
                 print()
-                return
 
         # 3. -st (alone)
         if "-st" in switches and "-ast" not in switches:
             st_root = standardize(source_code)
             preorder_traversal(st_root)
             print()
-            return
+
+        # 4. -opt : print the optimized ST
+        if "-opt" in switches:
+            counters = {"nodes_removed": 0}
+            preorder_traversal(optimize(standardize(source_code), fold="-fold" in switches,
+                                        coalesce="-coalesce" in switches,
+                                        statistics=counters))
+            print()
+            print(f"nodes_removed: {counters['nodes_removed']}", file=sys.stderr)
+
+        # 5. -bc : print the compiled bytecode
+        if "-bc" in switches:
+            st = optimize(standardize(source_code), fold="-fold" in switches,
+                          coalesce="-coalesce" in switches)
+            blocks = Compiler("-letrec" in switches).compile(st)
+            print(disassemble(blocks))
+            print()
+
+        # 6. --emit-python : print the generated Python module
+        if "--emit-python" in switches:
+            print(translate(source_code, "-letrec" in switches, "-fold" in switches,
+                            "-coalesce" in switches))
 
     except RPALException as e:
         print(e)
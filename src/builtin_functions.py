@@ -0,0 +1,184 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, FrozenSet, Tuple
+from src.values import Closure, RecClosure, RPALTuple, RPALString
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Builtin function values
+# ──────────────────────────────────────────────────────────────────────────────
+class Builtin:
+    """
+    A native function of the RPAL runtime.
+    Fields:
+      - name: the identifier that refers to it in RPAL programs
+      - arity: how many arguments it takes, one per application (builtins
+        are curried)
+      - function: called as function(machine, *arguments) once all arguments
+        are supplied; it returns the result of the application.
+    """
+
+    __slots__ = ("name", "arity", "function")
+
+    def __init__(self, name: str, arity: int,
+                 function: Callable[..., Any]) -> None:
+        self.name: str = name
+        self.arity: int = arity
+        self.function: Callable[..., Any] = function
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __repr__(self) -> str:
+        return f"<builtin {self.name}>"
+
+
+class PartialBuiltin:
+    """
+    A builtin applied to fewer arguments than its arity, waiting for the rest.
+    """
+
+    __slots__ = ("builtin", "arguments")
+
+    def __init__(self, builtin: Builtin, arguments: Tuple[Any, ...]) -> None:
+        self.builtin: Builtin = builtin
+        self.arguments: Tuple[Any, ...] = arguments
+
+    def __str__(self) -> str:
+        return self.builtin.name
+
+    def __repr__(self) -> str:
+        return (f"<builtin {self.builtin.name} applied to "
+                f"{len(self.arguments)}>")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# The registry
+# ──────────────────────────────────────────────────────────────────────────────
+BUILTINS: Dict[str, Builtin] = {}
+
+# The builtins of rpal.exe's machine. It finds them before looking in the
+# environment, so a program cannot rebind them; a binding of any other
+# builtin's name hides the builtin, as it hides any other name.
+RESERVED_BUILTINS: FrozenSet[str] = frozenset((
+    "Order", "Print", "print", "Conc", "Stern", "Stem", "Isinteger",
+    "Istruthvalue", "Isstring", "Istuple", "Isfunction", "ItoS",
+))
+
+# The types of the values each type predicate is true for, so that the
+# Compiler can turn a chain of such tests on one variable into a single
+# dispatch on its type.
+TYPE_PREDICATES: Dict[str, Tuple[type, ...]] = {
+    "Isinteger": (int,),
+    "Istruthvalue": (bool,),
+    "Isstring": (RPALString,),
+    "Istuple": (RPALTuple,),
+    "Isdummy": (type(None),),
+    # Y* is the only name that is a value (see CSEMachine.is_function).
+    "Isfunction": (Closure, RecClosure, Builtin, PartialBuiltin, str),
+}
+
+
+def builtin(*names: str, arity: int = 1
+            ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Registers a function as the builtin(s) with the given name(s). The compiler
+    resolves these names to the registered Builtin, so a new builtin needs
+    nothing else.
+    """
+    def register(function: Callable[..., Any]) -> Callable[..., Any]:
+        for name in names:
+            BUILTINS[name] = Builtin(name, arity, function)
+        return function
+    return register
+
+
+# The Order function returns the length of a tuple.
+@builtin("Order")
+def order(machine, argument):
+    return len(argument)
+
+
+# The Print function prints the output to the command prompt.
+@builtin("Print", "print")
+def print_(machine, argument):
+    # We should print the output only when the 'Print' function is called
+    # in the program.
+    machine.print_present = True
+
+    # If there are escape characters in the string, we need to format
+    # it properly.
+    if type(argument) is RPALString:
+        text = argument.value()
+        if "\\n" in text or "\\t" in text:
+            return RPALString(text.replace("\\n", "\n").replace("\\t", "\t"))
+    return argument
+
+
+# The Conc function concatenates two strings into a rope node.
+@builtin("Conc", arity=2)
+def conc(machine, left, right):
+    return left + right
+
+
+# The Stern function returns the string without the first letter, as a view.
+@builtin("Stern")
+def stern(machine, argument):
+    return argument.stern()
+
+
+# The Stem function returns the first letter of the given string.
+@builtin("Stem")
+def stem(machine, argument):
+    return argument.stem()
+
+
+# The Isinteger function checks if the given argument is an integer.
+@builtin("Isinteger")
+def is_integer(machine, argument):
+    return type(argument) is int
+
+
+# The Istruthvalue function checks if the given argument is a boolean value.
+@builtin("Istruthvalue")
+def is_truthvalue(machine, argument):
+    return type(argument) is bool
+
+
+# The Isstring function checks if the given argument is a string.
+@builtin("Isstring")
+def is_string(machine, argument):
+    return type(argument) is RPALString
+
+
+# The Istuple function checks if the given argument is a tuple.
+@builtin("Istuple")
+def is_tuple(machine, argument):
+    return type(argument) is RPALTuple
+
+
+# The Isfunction function checks if the given argument is a function: a
+# closure or a builtin.
+@builtin("Isfunction")
+def is_function(machine, argument):
+    return machine.is_function(argument)
+
+
+# The Null function checks if the given argument is nil (the empty tuple).
+@builtin("Null")
+def null(machine, argument):
+    return type(argument) is RPALTuple and len(argument) == 0
+
+
+# The Isdummy function checks if the given argument is dummy.
+@builtin("Isdummy")
+def is_dummy(machine, argument):
+    return argument is None
+
+
+# The ItoS function converts integers to strings.
+@builtin("ItoS")
+def itos(machine, argument):
+    if (type(argument) is int):
+        return RPALString(str(argument))
+    print("Error: ItoS function can only accept integers.", file=machine.out)
+    exit()
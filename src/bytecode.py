@@ -0,0 +1,159 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Opcodes
+# ──────────────────────────────────────────────────────────────────────────────
+LOAD_CONST = 0      # push a constant (int, str, bool, nil, builtin, Y*)
+LOAD_VAR = 1        # push the variable at a (depth, slot) lexical address
+MAKE_LAMBDA = 2     # Rule 2: push a closure over the current environment
+APPLY = 3           # Rule 4: apply the top of the stack to the value below it
+BINOP = 4           # Rule 6: apply a binary operator
+UNOP = 5            # Rule 7: apply a unary operator
+BUILD_TUPLE = 6     # Rule 9: pop n values into a tuple
+JUMP_IF_FALSE = 7   # Rule 8: pop a truth value, if false skip n instructions
+JUMP = 8            # skip the next n instructions
+RETURN = 9          # Rule 5: end of a code block, resume the caller's frame
+TAIL_APPLY = 10     # APPLY in tail position: the callee replaces the frame
+MAKE_LETREC = 11    # letrec: push a closure over a new environment binding it
+CALL = 12           # first APPLY of n: enter a curried body with n arguments
+LET = 13            # run a let* block in a new environment, a slot per name
+BIND = 14           # pop a value into the current environment's slot(s)
+SWITCH = 15         # pop a value, skip the instructions a table gives for it
+SWITCH_TYPE = 16    # SWITCH on the type of the value
+SKIP_ENVS = 17      # take n environment numbers for removed environments
+
+OPNAMES: Dict[int, str] = {
+    LOAD_CONST: "LOAD_CONST",
+    LOAD_VAR: "LOAD_VAR",
+    MAKE_LAMBDA: "MAKE_LAMBDA",
+    APPLY: "APPLY",
+    BINOP: "BINOP",
+    UNOP: "UNOP",
+    BUILD_TUPLE: "BUILD_TUPLE",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    JUMP: "JUMP",
+    RETURN: "RETURN",
+    TAIL_APPLY: "TAIL_APPLY",
+    MAKE_LETREC: "MAKE_LETREC",
+    CALL: "CALL",
+    LET: "LET",
+    BIND: "BIND",
+    SWITCH: "SWITCH",
+    SWITCH_TYPE: "SWITCH_TYPE",
+    SKIP_ENVS: "SKIP_ENVS",
+}
+
+Instruction = Tuple[int, Any]
+
+
+class CodeBlock:
+    """
+    The compiled body of the program or of one lambda.
+    Fields:
+      - number: the lambda number, matching the numbering of the control
+        structures
+      - parameters: names of the formal parameters (empty for the main program)
+      - instructions: (opcode, argument) pairs in execution order, ending with
+        RETURN. The list is never modified once sealed, so frames refer to it
+        instead of copying it.
+      - saturated: for the first lambda of a curried function 'fn a. fn b. ...
+        body', the block of its last lambda, or None
+      - chain: for the last lambda of such a function, the number of lambdas in
+        it: the body reads all their parameters from one environment. 0 for any
+        other block.
+      - kind: "lambda"; "let" for the block of a let* node, whose parameters
+        are the names it binds
+      - memoize: True for the code that applying a recursive function runs,
+        when the function cannot print and returns the same result for the same
+        argument (see Compiler._is_pure); the CSE machine may then cache its
+        results
+      - eta: for the function a letrec binds, the number and bound variable of
+        the lambda that Y* would have made recursive; its closures print as
+        that eta
+    """
+
+    def __init__(self, number: int, parameters: Tuple[str, ...],
+                 kind: str = "lambda") -> None:
+        self.number: int = number
+        self.parameters: Tuple[str, ...] = parameters
+        self.instructions: List[Instruction] = []
+        self.saturated: Optional[CodeBlock] = None
+        self.chain: int = 0
+        self.kind: str = kind
+        self.memoize: bool = False
+        self.eta: Optional[Tuple[int, str]] = None
+
+    @property
+    def bounded_variable(self) -> str:
+        return ",".join(self.parameters)
+
+    def seal(self, instructions: List[Instruction]) -> None:
+        self.instructions = instructions + [(RETURN, None)]
+
+    def __repr__(self) -> str:
+        return f"<code {self.number} ({self.bounded_variable})>"
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Disassembler
+# ──────────────────────────────────────────────────────────────────────────────
+def _format_argument(op: int, arg: Any, index: int) -> str:
+    if op in (JUMP, JUMP_IF_FALSE):
+        return f"{arg} (to {index + 1 + arg})"
+    if op in (MAKE_LAMBDA, MAKE_LETREC):
+        return f"code {arg.number} ({arg.bounded_variable})"
+    if op == CALL:
+        count, tail = arg
+        return f"{count}{' (tail)' if tail else ''}"
+    if op == LET:
+        block, tail = arg
+        return (f"code {block.number} ({block.bounded_variable})"
+                f"{' (tail)' if tail else ''}")
+    if op == BIND:
+        slot, count = arg
+        if count == 1:
+            return f"slot {slot}"
+        return f"slots {slot}-{slot + count - 1}"
+    if op in (SWITCH, SWITCH_TYPE):
+        table, default = arg
+        cases = []
+        for key, offset in table.items():
+            name = (key.__name__ if op == SWITCH_TYPE
+                    else _format_argument(LOAD_CONST, key, 0))
+            cases.append(f"{name} to {index + 1 + offset}")
+        return ", ".join(cases + [f"else to {index + 1 + default}"])
+    if op == LOAD_VAR:
+        depth, slot, name = arg
+        return f"{name} (depth {depth}, slot {slot})"
+    if op == LOAD_CONST:
+        if arg is True or arg is False:
+            return str(arg).lower()
+        if arg == ():
+            return "nil"
+        if arg is None:
+            return "dummy"
+        return repr(arg)
+    if arg is None:
+        return ""
+    return str(arg)
+
+
+def disassemble(blocks: List[CodeBlock]) -> str:
+    """
+    Returns a human-readable listing of every code block, one instruction per
+    line.
+    """
+    lines: List[str] = []
+    for block in blocks:
+        if block.number == 0:
+            title = "main"
+        else:
+            title = f"{block.kind} {block.bounded_variable}"
+        lines.append(f"code {block.number} ({title}):")
+        for index, (op, arg) in enumerate(block.instructions):
+            argument = _format_argument(op, arg, index)
+            lines.append(f"  {index:>4}  {OPNAMES[op]:<15}{argument}".rstrip())
+        lines.append("")
+    return "\n".join(lines).rstrip("\n")
@@ -0,0 +1,450 @@
+from __future__ import annotations
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.rpal_ast import ASTNode
+from src.standardizer import standardize
+from src.optimizer import optimize
+from src.compiler import (
+    Compiler, Scope, decode_literal, BINARY_OPERATORS, UNARY_OPERATORS)
+from src.bytecode import CodeBlock, LOAD_VAR
+from src.builtin_functions import Builtin, PartialBuiltin
+from src.values import Code, Closure, RecClosure, RPALTuple
+from src.csemachine import BINARY_OPERATIONS, UNARY_OPERATIONS, format_value
+
+# Non-tail calls nest Python calls, a few per RPAL call; evaluation runs on a
+# thread with a stack this large, under a recursion limit this high.
+RECURSION_LIMIT = 1_000_000
+STACK_SIZE = 512 * 1024 * 1024
+
+# An environment is a list: the enclosing environment, then one slot per name.
+Environment = List[Any]
+Evaluator = Callable[[Environment], Any]
+
+_thread_lock = threading.Lock()
+# The recursion limit is shared by every thread, so it is raised while any
+# evaluation runs and the caller's limit is restored when the last one ends.
+_limit_lock = threading.Lock()
+_deep_runs = 0
+_saved_limit = 0
+
+
+class TailCall:
+    """
+    An application in tail position, returned to the apply loop of the caller,
+    which runs it in place of the call that returned it, so tail calls take no
+    Python stack.
+    """
+
+    __slots__ = ("rator", "rand")
+
+    def __init__(self, rator: Any, rand: Any) -> None:
+        self.rator = rator
+        self.rand = rand
+
+
+def _run_deep(function: Callable[..., Any], *arguments: Any) -> Any:
+    """
+    Calls function on a thread with a STACK_SIZE stack and returns what it
+    returns, or raises what it raises (including SystemExit from ItoS).
+    """
+    outcome: Dict[str, Any] = {}
+
+    def target() -> None:
+        try:
+            outcome["value"] = function(*arguments)
+        except BaseException as error:
+            outcome["error"] = error
+
+    global _deep_runs, _saved_limit
+    with _limit_lock:
+        if _deep_runs == 0:
+            _saved_limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(_saved_limit, RECURSION_LIMIT))
+        _deep_runs += 1
+    try:
+        # The stack size applies to threads started after it is set, so set it
+        # around one start.
+        with _thread_lock:
+            previous = threading.stack_size(STACK_SIZE)
+            try:
+                thread = threading.Thread(target=target)
+                thread.start()
+            finally:
+                threading.stack_size(previous)
+        thread.join()
+    finally:
+        with _limit_lock:
+            _deep_runs -= 1
+            if _deep_runs == 0:
+                sys.setrecursionlimit(_saved_limit)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+def builtin_call(rator_node: ASTNode, rand_node: ASTNode,
+                 scope: Scope) -> Tuple[Optional[Builtin], List[ASTNode]]:
+    """
+    If the application rator_node rand_node calls a builtin with all of its
+    arguments (one, or two as in 'Conc a b'), returns the builtin and the
+    argument nodes in order.
+    """
+    arguments = [rand_node]
+    while True:
+        if rator_node.value[0] == "<":
+            _, constant = decode_literal(rator_node.value, scope)
+            if type(constant) is Builtin and constant.arity == len(arguments):
+                return constant, arguments
+            return None, []
+        if rator_node.value != "gamma" or len(arguments) == 2:
+            return None, []
+        rator_node, argument = rator_node.children
+        arguments.insert(0, argument)
+
+
+class ClosureEngine:
+    """
+    Evaluates RPAL programs by compiling each node of the optimized
+    standardized tree, once, into a Python closure that evaluates it:
+    evaluating the program is calling the closure of its root on the primitive
+    environment. There is no control, stack or dispatch loop; a conditional is
+    an 'if', an operator a Python call, a variable a list index at the (depth,
+    slot) address the Compiler would give it.
+
+    The values are the CSE machine's (Closure, RecClosure, RPALTuple,
+    RPALString, builtins), lambdas get the same numbers and the result is
+    formatted by the same function, so both engines print the same for every
+    program. Applications in tail position return a TailCall to the loop in
+    apply (a trampoline), so tail-recursive loops run in constant Python stack;
+    other calls nest Python calls, on a thread with a large stack.
+
+    As with CSEMachine, letrec=True binds 'rec' functions to themselves instead
+    of going through Y*, fold=True folds constants first and coalesce=True
+    merges let chains.
+    """
+
+    def __init__(self, letrec: bool = False, fold: bool = False,
+                 coalesce: bool = False) -> None:
+        self.letrec = letrec
+        self.fold = fold
+        self.coalesce = coalesce
+        self.count = 0                  # Lambda numbers given so far
+        self.lambda_bodies: set = set()  # Lambdas whose body is a lambda
+        self.print_present = False
+        self.nodes_removed = 0
+        self.out = None                 # Where error messages go (CSEMachine)
+
+    def evaluate(self, source_code: str) -> Optional[str]:
+        """
+        Runs a complete RPAL program and returns the text that should be
+        printed, or None when the program never calls Print, exactly as
+        CSEMachine.evaluate does.
+        """
+        counters = {"nodes_removed": 0}
+        st = optimize(standardize(source_code), fold=self.fold,
+                      coalesce=self.coalesce, statistics=counters)
+        self.nodes_removed = counters["nodes_removed"]
+        self.count = 0
+        self.lambda_bodies = set()
+        main = self.compile(st, Scope((), None), False)
+
+        self.print_present = False
+        value = format_value(_run_deep(self._run, main))
+        if self.print_present:
+            return str(value)
+        return None
+
+    def _run(self, main: Evaluator) -> Any:
+        return main([None])
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Returns counters describing the last evaluation.
+        """
+        return {"nodes_removed": self.nodes_removed}
+
+    def is_function(self, value: Any) -> bool:
+        return (type(value) in (Closure, RecClosure, Builtin, PartialBuiltin)
+                or type(value) is str)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Application (Rules 4, 10, 11, 12 and 13)
+    # ──────────────────────────────────────────────────────────────────────
+    def apply(self, rator: Any, rand: Any) -> Any:
+        while True:
+            kind = type(rator)
+            if kind is Closure:
+                code = rator.code
+                arity = code.arity
+                if arity == 1:
+                    result = code.instructions([rator.environment, rand])
+                else:
+                    result = code.instructions(
+                        [rator.environment] + [rand[i] for i in range(arity)])
+                if type(result) is not TailCall:
+                    return result
+                rator = result.rator
+                rand = result.rand
+            elif kind is RecClosure:
+                # Rule 13: apply the eta's closure to the eta, then the result
+                # to rand. When the closure's body is a lambda that result is
+                # always an equivalent closure, so it is made once.
+                unfolded = rator.unfolded
+                if unfolded is None:
+                    code = rator.code
+                    unfolded = self.apply(Closure(code, rator.environment),
+                                          rator)
+                    if code in self.lambda_bodies:
+                        rator.unfolded = unfolded
+                rator = unfolded
+            elif kind is Builtin:
+                if rator.arity == 1:
+                    return rator.function(self, rand)
+                return PartialBuiltin(rator, (rand,))
+            elif kind is PartialBuiltin:
+                arguments = rator.arguments + (rand,)
+                if len(arguments) == rator.builtin.arity:
+                    return rator.builtin.function(self, *arguments)
+                return PartialBuiltin(rator.builtin, arguments)
+            elif kind is RPALTuple:
+                return rator[rand - 1]
+            elif rator == "Y*":
+                return RecClosure(rand.code, rand.environment)
+            else:
+                raise TypeError(f"cannot apply {format_value(rator)!r}")
+
+    def tail_apply(self, rator: Any, rand: Any) -> Any:
+        """
+        Applies rator to rand from tail position: closures are returned as a
+        TailCall for the caller's apply loop to run, anything else is applied
+        at once.
+        """
+        kind = type(rator)
+        if kind is Closure or kind is RecClosure:
+            return TailCall(rator, rand)
+        return self.apply(rator, rand)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Compilation, one method per kind of node
+    # ──────────────────────────────────────────────────────────────────────
+    def compile(self, root: ASTNode, scope: Scope, tail: bool) -> Evaluator:
+        """
+        Returns the closure that evaluates root in an environment laid out like
+        scope. In tail position, the closure may return a TailCall instead of a
+        value.
+        """
+        value = root.value
+        if value == "lambda":
+            return self._compile_lambda(root, scope)
+        if value == "gamma":
+            if self.letrec and Compiler._is_letrec(root):
+                return self._compile_letrec(root, scope)
+            return self._compile_gamma(root, scope, tail)
+        if value == "->":
+            return self._compile_conditional(root, scope, tail)
+        if value == "let*":
+            return self._compile_let(root, scope, tail)
+        if value == "skip":
+            before, expression, after = root.children
+            self.count += int(before.value[5:-1])
+            evaluate = self.compile(expression, scope, tail)
+            self.count += int(after.value[5:-1])
+            return evaluate
+        if value == "envs":
+            # Environments are named by their depth, not numbered.
+            return self.compile(root.children[1], scope, tail)
+        if value == "tau":
+            return self._compile_tuple(root, scope)
+        if value in BINARY_OPERATORS:
+            return self._compile_binary(root, scope)
+        if value in UNARY_OPERATORS:
+            return self._compile_unary(root, scope)
+        return self._compile_leaf(value, scope)
+
+    def _compile_leaf(self, value: str, scope: Scope) -> Evaluator:
+        op, argument = decode_literal(value, scope)
+        if op != LOAD_VAR:
+            return lambda environment: argument
+        depth, slot, _ = argument
+        index = slot + 1
+        if depth == 0:
+            return lambda environment: environment[index]
+        if depth == 1:
+            return lambda environment: environment[0][index]
+        if depth == 2:
+            return lambda environment: environment[0][0][index]
+
+        def load_var(environment: Environment) -> Any:
+            for _ in range(depth):
+                environment = environment[0]
+            return environment[index]
+        return load_var
+
+    def _compile_lambda(self, root: ASTNode, scope: Scope,
+                        eta: Optional[Tuple[int, str]] = None) -> Evaluator:
+        # Rule 2. eta is set for the function a letrec binds (see CodeBlock).
+        self.count += 1
+        left_child, body = root.children
+        if left_child.value == ",":
+            parameters = tuple(child.value[4:-1]
+                               for child in left_child.children)
+        else:
+            parameters = (left_child.value[4:-1],)
+        code = Code(CodeBlock(self.count, parameters))
+        code.block.eta = eta
+        code.instructions = self.compile(body, Scope(parameters, scope), True)
+        if body.value == "lambda":
+            self.lambda_bodies.add(code)
+        return lambda environment: Closure(code, environment)
+
+    def _compile_letrec(self, root: ASTNode, scope: Scope) -> Evaluator:
+        # The environment holds the closure, which holds the environment.
+        self.count += 1
+        name_node, function = root.children[1].children
+        eta = (self.count, name_node.value[4:-1])
+        make_closure = self._compile_lambda(function, Scope(eta[1:], scope),
+                                            eta)
+
+        def make_letrec(environment: Environment) -> Closure:
+            inner = [environment, None]
+            closure = inner[1] = make_closure(inner)
+            return closure
+        return make_letrec
+
+    def _compile_gamma(self, root: ASTNode, scope: Scope,
+                       tail: bool) -> Evaluator:
+        # Rule 4. The operand is evaluated before the operator, as on the
+        # CSE machine.
+        rator_node, rand_node = root.children
+        builtin, arguments = builtin_call(rator_node, rand_node, scope)
+        if builtin is not None:
+            return self._compile_builtin_call(
+                builtin.function,
+                [self.compile(node, scope, False) for node in arguments])
+
+        rator = self.compile(rator_node, scope, False)
+        rand = self.compile(rand_node, scope, False)
+        apply = self.apply
+
+        if tail:
+            def tail_gamma(environment: Environment) -> Any:
+                argument = rand(environment)
+                function = rator(environment)
+                kind = type(function)
+                if kind is Closure or kind is RecClosure:
+                    return TailCall(function, argument)
+                return apply(function, argument)
+            return tail_gamma
+
+        def gamma(environment: Environment) -> Any:
+            argument = rand(environment)
+            return apply(rator(environment), argument)
+        return gamma
+
+    def _compile_builtin_call(self, function: Callable[..., Any],
+                              arguments: List[Evaluator]) -> Evaluator:
+        # Builtins are constants, so a call with all of a builtin's arguments
+        # is a Python call; 'Conc a b' evaluates b before a, as the curried
+        # application would.
+        if len(arguments) == 1:
+            argument = arguments[0]
+            return lambda environment: function(self, argument(environment))
+        first, second = arguments
+
+        def call(environment: Environment) -> Any:
+            rand_2 = second(environment)
+            return function(self, first(environment), rand_2)
+        return call
+
+    def _compile_conditional(self, root: ASTNode, scope: Scope,
+                             tail: bool) -> Evaluator:
+        # Rule 8, numbered like the Delta/beta pair it replaces
+        condition_node, then_node, else_node = root.children
+        self.count += 1
+        then_part = self.compile(then_node, scope, tail)
+        self.count += 1
+        else_part = self.compile(else_node, scope, tail)
+        condition = self.compile(condition_node, scope, False)
+        return lambda environment: (then_part(environment)
+                                    if condition(environment)
+                                    else else_part(environment))
+
+    def _compile_let(self, root: ASTNode, scope: Scope,
+                     tail: bool) -> Evaluator:
+        # One environment for all the bindings of a let* node (see
+        # optimizer.coalesce_lets), numbered and scoped as
+        # Compiler._compile_let does.
+        *bindings, body_node = root.children
+        names: List[Tuple[str, ...]] = []
+        for binding in bindings:
+            left_child = binding.children[0]
+            if left_child.value == ",":
+                names.append(tuple(child.value[4:-1]
+                                   for child in left_child.children))
+            else:
+                names.append((left_child.value[4:-1],))
+        slots = sum(names, ())
+
+        self.count += len(bindings)
+        body = self.compile(body_node, Scope(slots, scope), tail)
+        steps: List[Tuple[Evaluator, int, int]] = []
+        slot = len(slots)
+        for binding, bound in zip(reversed(bindings), reversed(names)):
+            slot -= len(bound)
+            value = self.compile(binding.children[1],
+                                 Scope(slots[:slot], scope), False)
+            steps.append((value, slot + 1, len(bound)))
+        steps.reverse()
+        empty = [None] * len(slots)
+
+        def let(environment: Environment) -> Any:
+            inner = [environment] + empty
+            for value, index, count in steps:
+                result = value(inner)
+                if count == 1:
+                    inner[index] = result
+                else:
+                    # Rule 11 for a tuple of names
+                    for i in range(count):
+                        inner[index + i] = result[i]
+            return body(inner)
+        return let
+
+    def _compile_tuple(self, root: ASTNode, scope: Scope) -> Evaluator:
+        # Rule 9: the elements are evaluated from the last to the first.
+        elements = [self.compile(child, scope, False)
+                    for child in root.children]
+        count = len(elements)
+        if count == 2:
+            first, second = elements
+
+            def pair(environment: Environment) -> RPALTuple:
+                value = second(environment)
+                return RPALTuple([first(environment), value], 2)
+            return pair
+
+        backwards = elements[::-1]
+
+        def tau(environment: Environment) -> RPALTuple:
+            items = [element(environment) for element in backwards]
+            items.reverse()
+            return RPALTuple(items, count)
+        return tau
+
+    def _compile_unary(self, root: ASTNode, scope: Scope) -> Evaluator:
+        # Rule 7
+        operation = UNARY_OPERATIONS[root.value]
+        operand = self.compile(root.children[0], scope, False)
+        return lambda environment: operation(operand(environment))
+
+    def _compile_binary(self, root: ASTNode, scope: Scope) -> Evaluator:
+        # Rule 6: the right operand is evaluated first.
+        operation = BINARY_OPERATIONS[root.value]
+        left = self.compile(root.children[0], scope, False)
+        right = self.compile(root.children[1], scope, False)
+
+        def binop(environment: Environment) -> Any:
+            rand_2 = right(environment)
+            return operation(left(environment), rand_2)
+        return binop
@@ -0,0 +1,481 @@
+from __future__ import annotations
+from typing import Any, FrozenSet, List, Optional, Tuple
+from src.rpal_ast import ASTNode
+from src.errors import UndeclaredIdentifierError
+from src.values import NIL, RPALString
+from src.builtin_functions import BUILTINS, RESERVED_BUILTINS, TYPE_PREDICATES
+from src.bytecode import (
+    CodeBlock, Instruction, LOAD_CONST, LOAD_VAR, MAKE_LAMBDA, APPLY, BINOP,
+    UNOP, BUILD_TUPLE, JUMP_IF_FALSE, JUMP, RETURN, TAIL_APPLY, MAKE_LETREC,
+    CALL, LET, BIND, SWITCH, SWITCH_TYPE, SKIP_ENVS,
+)
+
+BINARY_OPERATORS: Tuple[str, ...] = (
+    "+", "-", "*", "/", "**", "gr", "ge", "ls", "le", "eq", "ne", "or", "&",
+    "aug",
+)
+
+UNARY_OPERATORS: Tuple[str, ...] = ("neg", "not")
+
+# Builtins with an effect besides their result: a function that uses them is
+# never memoized.
+PRINTING_BUILTINS: Tuple[str, ...] = ("Print", "print")
+
+
+class Scope:
+    """
+    The names bound by one environment at compile time, linked to the enclosing
+    scope. A name's position in `names` is its slot in the runtime environment.
+    """
+
+    def __init__(self, names: Tuple[str, ...],
+                 parent: Optional[Scope]) -> None:
+        self.names: Tuple[str, ...] = names
+        self.parent: Optional[Scope] = parent
+
+    def resolve(self, name: str) -> Tuple[int, int, str]:
+        """
+        Returns the (depth, slot, name) address of a variable: the parent
+        links to follow from the current environment, and the slot to read.
+        """
+        scope: Optional[Scope] = self
+        depth = 0
+        while scope is not None:
+            names = scope.names
+            if name in names:
+                # With repeated names ('fn (x, x). ...') the last binding wins.
+                return (depth, len(names) - 1 - names[::-1].index(name), name)
+            scope = scope.parent
+            depth += 1
+        raise UndeclaredIdentifierError(name)
+
+    def binds(self, name: str) -> bool:
+        """
+        Returns whether this scope or an enclosing one binds a name.
+        """
+        scope: Optional[Scope] = self
+        while scope is not None:
+            if name in scope.names:
+                return True
+            scope = scope.parent
+        return False
+
+
+def is_builtin(name: str, scope: Optional[Scope]) -> bool:
+    """
+    Returns whether an identifier refers to a builtin in scope: a binding of
+    the name hides the builtin, unless it is one of the RESERVED_BUILTINS.
+    """
+    return name in BUILTINS and (name in RESERVED_BUILTINS or scope is None
+                                 or not scope.binds(name))
+
+
+def decode_literal(value: str, scope: Scope) -> Tuple[int, Any]:
+    """
+    Decodes a leaf of the standardized tree ('<INT:5>', '<ID:x>', '<true>',
+    ...) into the instruction that pushes its value. Identifiers are resolved
+    to lexical addresses.
+    """
+    name = value[1:-1]
+    data_type, separator, text = name.partition(":")
+
+    if separator:
+        if data_type == "INT":
+            return (LOAD_CONST, int(text))
+
+        # The rpal.exe program detects srings only when they begin with ' and
+        # end with '. Our code must emulate this behaviour.
+        if data_type == "STR":
+            return (LOAD_CONST, RPALString(text.strip("'")))
+
+        # Built-in functions are constants from the registry; only those
+        # rpal.exe did not have can be shadowed.
+        if is_builtin(text, scope):
+            return (LOAD_CONST, BUILTINS[text])
+        return (LOAD_VAR, scope.resolve(text))
+
+    if name == "Y*":
+        return (LOAD_CONST, "Y*")
+    if name == "nil":
+        return (LOAD_CONST, NIL)
+    if name == "true":
+        return (LOAD_CONST, True)
+    if name == "false":
+        return (LOAD_CONST, False)
+    return (LOAD_CONST, None)
+
+
+def _free_names(root: ASTNode) -> FrozenSet[str]:
+    """
+    Returns the identifiers root uses without binding them.
+    """
+    value = root.value
+    if value.startswith("<ID:"):
+        return frozenset((value[4:-1],))
+    if value == "lambda":
+        parameters = root.children[0]
+        bound = (parameters.children if parameters.value == ","
+                 else [parameters])
+        return (_free_names(root.children[1])
+                - {child.value[4:-1] for child in bound})
+    if value == "let*":
+        # Each value sees the names bound before it, the body sees all of them.
+        *bindings, body = root.children
+        names: FrozenSet[str] = frozenset()
+        free: FrozenSet[str] = frozenset()
+        for binding in bindings:
+            left_child, bound_value = binding.children
+            free |= _free_names(bound_value) - names
+            bound = (left_child.children if left_child.value == ","
+                     else [left_child])
+            names |= {child.value[4:-1] for child in bound}
+        return free | (_free_names(body) - names)
+    free = frozenset()
+    for child in root.children:
+        free |= _free_names(child)
+    return free
+
+
+class Compiler:
+    """
+    Compiles a standardized tree into CodeBlocks of (opcode, argument) pairs.
+
+    Lambdas and conditionals are numbered in the same pre-order as the original
+    control structures, so closures keep the numbers rpal.exe prints for them.
+    Conditionals compile to jumps instead of Delta/beta pairs. Identifiers are
+    resolved while compiling, so an undeclared identifier raises
+    UndeclaredIdentifierError before anything runs.
+
+    A gamma in tail position (the last thing a code block does) compiles to
+    TAIL_APPLY, and a conditional in tail position returns from its then-branch
+    instead of jumping over the else-branch, so tail-recursive loops run in
+    constant frame depth.
+
+    With letrec=True, the standardized form of 'rec f = fn ...', gamma(<Y*>,
+    lambda f. lambda), compiles to MAKE_LETREC: the inner lambda is closed over
+    an environment that binds f to the closure itself, so recursive calls are
+    ordinary calls instead of Rule 13 unfoldings. Other uses of Y*
+    (simultaneous definitions, non-function values) still go through Y*.
+
+    The body of a curried function 'fn a. fn b. ... body' is compiled once,
+    reading all the parameters from one environment: applying the last lambda
+    copies the earlier arguments out of the environments the other lambdas
+    created. An application of a variable to several arguments, 'f x y ...',
+    compiles to CALL followed by the usual APPLYs. When f turns out to be such
+    a function taking exactly those arguments, CALL enters the body in one step
+    and skips the APPLYs; otherwise it is a plain APPLY and the function is
+    curried as before.
+
+    A 'let*' node (see optimizer.coalesce_lets) compiles to a block that
+    evaluates each value and BINDs it to its slot in one environment, then runs
+    the body; the LET instruction enters that block as a call.
+    """
+
+    def __init__(self, letrec: bool = False) -> None:
+        self.count: int = 0
+        self.blocks: List[CodeBlock] = []
+        self.letrec: bool = letrec
+        # ids of lambdas inside a curried chain, after its first
+        self.links: set = set()
+        # ids of the last lambdas of curried chains -> (all their names, the
+        # scope of the chain, the first lambda's block)
+        self.chains: dict = {}
+        # ids of lambdas whose blocks get memoize=True
+        self.memoizable: set = set()
+
+    def compile(self, root: ASTNode) -> List[CodeBlock]:
+        """
+        Returns every code block of the program, the main program first.
+        """
+        main = CodeBlock(0, ())
+        self.blocks.append(main)
+        main.seal(self._compile(root, Scope((), None), True))
+        self.blocks.sort(key=lambda block: block.number)
+        return self.blocks
+
+    def _compile(self, root: ASTNode, scope: Scope,
+                 tail: bool = False) -> List[Instruction]:
+        value = root.value
+
+        if value == "lambda":
+            self.count += 1
+            left_child = root.children[0]
+            if left_child.value == ",":
+                parameters = tuple(child.value[4:-1]
+                                   for child in left_child.children)
+            else:
+                parameters = (left_child.value[4:-1],)
+
+            block = CodeBlock(self.count, parameters)
+            block.memoize = id(root) in self.memoizable
+            self.blocks.append(block)
+            chain = [] if id(root) in self.links else self._curried_chain(root)
+            for link in chain[1:]:
+                self.links.add(id(link))
+            if chain:
+                names = tuple(link.children[0].value[4:-1] for link in chain)
+                self.chains[id(chain[-1])] = (names, scope, block)
+
+            body_scope = Scope(parameters, scope)
+            if id(root) in self.chains:
+                names, chain_scope, first = self.chains.pop(id(root))
+                body_scope = Scope(names, chain_scope)
+                block.chain = len(names)
+                first.saturated = block
+            body: List[Instruction] = []
+            for child in root.children[1:]:
+                body = (self._compile(child, body_scope,
+                                      child is root.children[1])
+                        + body)
+            block.seal(body)
+            return [(MAKE_LAMBDA, block)]
+
+        if value == "gamma" and root.children[0].value == "gamma":
+            call = self._compile_call(root, scope, tail)
+            if call is not None:
+                return call
+
+        if (value == "gamma" and self._is_letrec(root)
+                and self._is_pure(root.children[1], scope)):
+            # Applying the eta, or with letrec the closure, runs the
+            # function's body.
+            eta_code = root.children[1]
+            self.memoizable.add(id(eta_code.children[1] if self.letrec
+                                   else eta_code))
+
+        if value == "gamma" and self.letrec and self._is_letrec(root):
+            self.count += 1
+            name_node, function = root.children[1].children
+            eta = (self.count, name_node.value[4:-1])
+            (instruction,) = self._compile(function, Scope(eta[1:], scope))
+            instruction[1].eta = eta
+            return [(MAKE_LETREC, instruction[1])]
+
+        # Moves the lambda numbers around an expression the optimizer rewrote
+        # (see optimizer._skip), so the other lambdas keep their numbers.
+        if value == "skip":
+            before, expression, after = root.children
+            self.count += int(before.value[5:-1])
+            instructions = self._compile(expression, scope, tail)
+            self.count += int(after.value[5:-1])
+            return instructions
+
+        # Moves the environment numbers on by the environments the optimizer
+        # removed (see optimizer._envs).
+        if value == "envs":
+            count, expression = root.children
+            return ([(SKIP_ENVS, int(count.value[5:-1]))]
+                    + self._compile(expression, scope, tail))
+
+        if value == "let*":
+            return self._compile_let(root, scope, tail)
+
+        if value == "->":
+            switch = self._compile_switch(root, scope, tail)
+            if switch is not None:
+                return switch
+            self.count += 1
+            then_part = self._compile(root.children[1], scope, tail)
+            self.count += 1
+            else_part = self._compile(root.children[2], scope, tail)
+            condition = self._compile(root.children[0], scope)
+            leave = (RETURN, None) if tail else (JUMP, len(else_part))
+            return (condition
+                    + [(JUMP_IF_FALSE, len(then_part) + 1)]
+                    + then_part
+                    + [leave]
+                    + else_part)
+
+        # The operands of every other node are evaluated right to left.
+        operands: List[Instruction] = []
+        for child in root.children:
+            operands = self._compile(child, scope) + operands
+
+        if value == "tau":
+            return operands + [(BUILD_TUPLE, len(root.children))]
+        if value == "gamma":
+            return operands + [(TAIL_APPLY if tail else APPLY, None)]
+        if value in BINARY_OPERATORS:
+            return operands + [(BINOP, value)]
+        if value in UNARY_OPERATORS:
+            return operands + [(UNOP, value)]
+        if value[0] == "<" and value[-1] == ">":
+            return operands + [decode_literal(value, scope)]
+        return operands
+
+    def _compile_let(self, root: ASTNode, scope: Scope,
+                     tail: bool) -> List[Instruction]:
+        *bindings, body_node = root.children
+        names: List[Tuple[str, ...]] = []
+        for binding in bindings:
+            left_child = binding.children[0]
+            if left_child.value == ",":
+                names.append(tuple(child.value[4:-1]
+                                   for child in left_child.children))
+            else:
+                names.append((left_child.value[4:-1],))
+        slots = sum(names, ())
+
+        # Number the block and its bodies in the pre-order of the nested
+        # lambdas it replaces: every lambda, then the body, then the values
+        # from the last to the first.
+        block = CodeBlock(self.count + 1, slots, "let")
+        self.count += len(bindings)
+        self.blocks.append(block)
+        instructions = self._compile(body_node, Scope(slots, scope), True)
+        slot = len(slots)
+        for binding, bound in zip(reversed(bindings), reversed(names)):
+            slot -= len(bound)
+            value_code = self._compile(binding.children[1],
+                                       Scope(slots[:slot], scope))
+            instructions = (value_code + [(BIND, (slot, len(bound)))]
+                            + instructions)
+        block.seal(instructions)
+        return [(LET, (block, tail))]
+
+    def _compile_call(self, root: ASTNode, scope: Scope,
+                      tail: bool) -> Optional[List[Instruction]]:
+        """
+        Compiles 'f x y ...' applied to a variable to CALL and APPLYs, or
+        returns None.
+        """
+        arguments: List[ASTNode] = []
+        rator = root
+        while rator.value == "gamma":
+            rator, argument = rator.children
+            arguments.append(argument)
+        if (not rator.value.startswith("<ID:")
+                or is_builtin(rator.value[4:-1], scope)):
+            return None
+
+        # Same order as nested gammas: the rator is compiled first, the last
+        # argument is evaluated first.
+        operands = self._compile(rator, scope)
+        for argument in reversed(arguments):
+            operands = self._compile(argument, scope) + operands
+        count = len(arguments)
+        return (operands
+                + [(CALL, (count, tail))]
+                + [(APPLY, None)] * (count - 2)
+                + [(TAIL_APPLY if tail else APPLY, None)])
+
+    def _compile_switch(self, root: ASTNode, scope: Scope,
+                        tail: bool) -> Optional[List[Instruction]]:
+        """
+        Compiles 'x eq A -> P | x eq B -> Q | ... | R', where A, B, ... are
+        literals, to one SWITCH on the value of x, and 'Isinteger x -> P |
+        Isstring x -> Q | ... | R' to one SWITCH_TYPE on its type. Returns None
+        unless the chain tests the same variable at least twice.
+        """
+        arms: List[Tuple[Tuple[Any, ...], ASTNode]] = []
+        node = root
+        subject = None
+        while node.value == "->":
+            test = self._switch_test(node.children[0], scope)
+            if test is None or (subject is not None and test[:2] != subject):
+                break
+            subject = test[:2]
+            arms.append((test[2], node.children[1]))
+            node = node.children[2]
+        if len(arms) < 2:
+            return None
+
+        # Number the branches as the nested conditionals would be numbered.
+        parts: List[List[Instruction]] = []
+        for _, then_node in arms:
+            self.count += 1
+            parts.append(self._compile(then_node, scope, tail))
+            self.count += 1
+        default = self._compile(node, scope, tail)
+
+        # The first arm that tests for a key wins, like the first true
+        # guard.
+        table: dict = {}
+        body: List[Instruction] = []
+        end = sum(len(part) + 1 for part in parts) + len(default)
+        for (keys, _), part in zip(arms, parts):
+            for key in keys:
+                table.setdefault(key, len(body))
+            body += part
+            body.append((RETURN, None) if tail
+                        else (JUMP, end - len(body) - 1))
+        body += default
+
+        kind, name = subject
+        return ([decode_literal(f"<ID:{name}>", scope)]
+                + [(SWITCH if kind == "value" else SWITCH_TYPE,
+                    (table, len(body) - len(default)))]
+                + body)
+
+    @staticmethod
+    def _switch_test(condition: ASTNode,
+                     scope: Scope
+                     ) -> Optional[Tuple[str, str, Tuple[Any, ...]]]:
+        """
+        Returns ("value", x, (A,)) for 'x eq A' or 'A eq x' with A a literal,
+        ("type", x, types) for a type predicate applied to x, or None for any
+        other condition.
+        """
+        def variable(node: ASTNode) -> bool:
+            return (node.value.startswith("<ID:")
+                    and not is_builtin(node.value[4:-1], scope))
+
+        def literal(node: ASTNode) -> bool:
+            return (node.value.startswith(("<INT:", "<STR:"))
+                    or node.value in ("<true>", "<false>"))
+
+        if condition.value == "eq":
+            left, right = condition.children
+            if literal(left):
+                left, right = right, left
+            if variable(left) and literal(right):
+                return ("value", left.value[4:-1],
+                        (decode_literal(right.value, None)[1],))
+        if condition.value == "gamma":
+            rator, rand = condition.children
+            name = rator.value[4:-1]
+            if (rator.value.startswith("<ID:") and name in TYPE_PREDICATES
+                    and is_builtin(name, scope) and variable(rand)):
+                return "type", rand.value[4:-1], TYPE_PREDICATES[name]
+        return None
+
+    @staticmethod
+    def _curried_chain(root: ASTNode) -> List[ASTNode]:
+        """
+        Returns the lambdas of 'fn a. fn b. ...' starting at root when there
+        are at least two and each binds a single name, or an empty list.
+        """
+        chain: List[ASTNode] = []
+        node = root
+        while (node.value == "lambda" and len(node.children) == 2
+               and node.children[0].value.startswith("<ID:")):
+            chain.append(node)
+            node = node.children[1]
+        return chain if len(chain) >= 2 else []
+
+    @staticmethod
+    def _is_pure(root: ASTNode, scope: Scope) -> bool:
+        """
+        Returns whether 'fn f. fn x. body', the function a 'rec f x = body'
+        definition passes to Y*, always returns the same result for the same
+        argument: its body is not another lambda (the result would be a
+        closure) and it uses no names but f, x, its own local names and
+        builtins other than Print.
+        """
+        name = root.children[0].value[4:-1]
+        function = root.children[1]
+        return (function.children[1].value != "lambda"
+                and all(free == name or (is_builtin(free, scope)
+                                         and free not in PRINTING_BUILTINS)
+                        for free in _free_names(function)))
+
+    @staticmethod
+    def _is_letrec(root: ASTNode) -> bool:
+        """
+        Returns whether a gamma is gamma(<Y*>, lambda <ID:f>. lambda ...).
+        """
+        rator, rand = root.children
+        return (rator.value == "<Y*>"
+                and rand.value == "lambda"
+                and rand.children[0].value.startswith("<ID:")
+                and rand.children[1].value == "lambda")
@@ -1,549 +1,1049 @@
 from __future__ import annotations
+import operator
+from collections import OrderedDict
 from src.standardizer import standardize
+from src.optimizer import optimize
+from src.compiler import Compiler
+from src.builtin_functions import Builtin, PartialBuiltin
+from src.values import RPALTuple, RPALString, Code, Closure, RecClosure
+from src.bytecode import (
+    LOAD_CONST, LOAD_VAR, MAKE_LAMBDA, APPLY, BINOP, UNOP, BUILD_TUPLE,
+    JUMP_IF_FALSE, JUMP, RETURN, TAIL_APPLY, MAKE_LETREC, CALL, LET, BIND,
+    SWITCH, SWITCH_TYPE, SKIP_ENVS,
+    OPNAMES,
+)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Stack implementation for the CSE machine
 # ──────────────────────────────────────────────────────────────────────────────
-class Stack:
+class Stack(list):
     """
-    A simple stack wrapper around a Python list, used as the operand stack in the CSE machine.
+    The operand stack of the CSE machine. Pushing and popping are the C-level
+    list operations; popping an empty stack raises IndexError, which the
+    machine reports through underflow().
     """
 
     def __init__(self, type):
+        super().__init__()
         self.type = type
-        self.stack = []
-
-     # Adds an element to the top of the stack
-
-    def push(self, item):
-        self.stack.append(item)
-
-    # Removes and returns the top element of the stack if it’s not empty
-    def pop(self):
-        if self.is_empty():
-            message = (
-                "Error: Attempted to pop from an empty CSE machine stack."
-                if self.type == "CSE"
-                else "Error: Attempted to pop from an empty AST construction stack."
-            )
-            print(message)
-            exit(1)
-        return self.stack.pop()
-
-    # Provides a string representation of the stack for easier inspection during debugging
-    def __repr__(self):
-        return str(self.stack)
 
-    # Checks whether the stack currently contains any elements
-    def is_empty(self):
-        return len(self.stack) == 0
+    # Adds an element to the top of the stack
+    push = list.append
 
-    # Allow index-based access to elements
-    def __getitem__(self, index):
-        return self.stack[index]
+    # Reports an attempt to pop from an empty stack and stops the interpreter
+    def underflow(self, out=None):
+        message = (
+            "Error: Attempted to pop from an empty CSE machine stack."
+            if self.type == "CSE"
+            else "Error: Attempted to pop from an empty AST construction "
+                 "stack."
+        )
+        print(message, file=out)
+        exit(1)
 
-    # Allow assignment to elements at specific indices
-    def __setitem__(self, index, value):
-        self.stack[index] = value
-
-    # Support reversed iteration through the stack
-    def __reversed__(self):
-        return reversed(self.stack)
+    # Checks whether the stack currently contains any elements
+    def is_empty(self):
+        return len(self) == 0
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Control-structure node classes (Lambda, Delta, Tau, Eta)
+# Environment class for the CSE machine
 # ──────────────────────────────────────────────────────────────────────────────
-class Lambda:
+class EnvironmentTracker:
     """
-    Represents a lambda instruction in the control structure.
-    Fields:
-      - number: unique index for this function
-      - bounded_variable: comma-separated string of formal parameter names
-      - environment: index of the environment in which this lambda was created
+    Counts the environments of one evaluation. Environments are only referenced
+    by closures, the stack and the control, so an environment is released as
+    soon as none of those refer to it; the tracker records how many were
+    created, how many are still alive and the peak.
+
+    It also numbers them. An environment that stands for several of the
+    rpal.exe machine's (one call of a curried function with all its
+    arguments) takes as many numbers, so the others keep theirs.
     """
 
-    def __init__(self, number: int) -> None:
-        self.number: int = number
-        self.bounded_variable: str = ""  # e.g. "x" or "x,y,z"
-        self.environment: int = 0        # environment index
+    def __init__(self) -> None:
+        self.created = 0
+        self.numbered = 0
+        self.live = 0
+        self.peak = 0
 
-    def __repr__(self) -> str:
-        return f"Λ({self.number}, vars={self.bounded_variable}, env=e_{self.environment})"
+    def register(self, numbers=1):
+        self.numbered += numbers
+        self.created += 1
+        self.live += 1
+        if self.live > self.peak:
+            self.peak = self.live
+        return self.numbered - 1
 
+    def release(self):
+        self.live -= 1
 
-class Delta:
+
+class Environment():
     """
-    Represents a delta (guard) instruction in the control structure.
+    Represents an environment in the CSE machine, which holds variables.
+    Environments are linked frames of slots: the compiler resolves every
+    identifier to a (depth, slot) address, so a variable read follows `depth`
+    parent links and indexes the slot list. Creating an environment never
+    copies the enclosing scope.
     Fields:
-      - number: unique index for this guard
+      - number: the order in which the environment was created in its run
+        (e_0, e_1, ...); the last of its numbers when it takes several
+      - slots: values of the variables bound by this environment, in
+        parameter order
+      - parent: reference to the parent environment
+      - tracker: the EnvironmentTracker notified when this environment is
+        released
     """
 
-    def __init__(self, number: int) -> None:
-        self.number: int = number
+    __slots__ = ("tracker", "number", "slots", "parent")
+
+    def __init__(self, tracker, parent, slots, numbers=1):
+        self.number = tracker.register(numbers)
+        self.tracker = tracker
+        self.slots = slots
+        self.parent = parent
 
-    def __repr__(self) -> str:
-        return f"Δ({self.number})"
+    def __del__(self):
+        self.tracker.release()
+
+    def __repr__(self):
+        return f"e_{self.number}"
 
 
-class Tau:
+# ──────────────────────────────────────────────────────────────────────────────
+# The main CSEMachine
+# ──────────────────────────────────────────────────────────────────────────────
+
+class MachineHalt(Exception):
     """
-    Represents a tuple-construction instruction in the control structure.
-    Fields:
-      - number: the arity of the tuple (how many elements to pop)
+    Raised by the final RETURN of the main program to leave the dispatch loop.
+    """
+
+
+class StepLimitExceeded(Exception):
+    """
+    Raised by CSEMachine.compute when a program runs for more steps than
+    it allows.
     """
 
-    def __init__(self, number: int) -> None:
-        self.number: int = number
 
-    def __repr__(self) -> str:
-        return f"τ({self.number})"
+def _aug(rand_1, rand_2):
+    if (type(rand_2) == RPALTuple):
+        return rand_1 + rand_2
+    # Appends in place when rand_1 is the longest view of its list:
+    # O(1) amortized.
+    if (type(rand_1) == RPALTuple):
+        return rand_1.aug(rand_2)
+    return rand_1 + (rand_2,)
 
 
-class Eta:
+def _gather(slots, environment, chain):
     """
-    Represents an Eta (fixed-point) instruction in the control structure,
-    used for Y*-recursion.
-    Fields:
-      - number: the index of the original lambda to re-create
-      - bounded_variable: copied from the original Lambda
-      - environment: copied from the original Lambda
+    Returns the slots and parent of the environment the last lambda of a
+    curried function runs its body in: the arguments of the chain's other
+    lambdas, read from the environments they created, then its own.
+    """
+    for _ in range(chain - 1):
+        slots.append(environment.slots[0])
+        environment = environment.parent
+    slots.reverse()
+    return slots, environment
+
+
+# Rule 6 and Rule 7 operators, linked into BINOP and UNOP instructions
+# by CSEMachine.link
+BINARY_OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.floordiv,
+    "**": operator.pow,
+    "gr": operator.gt,
+    "ge": operator.ge,
+    "ls": operator.lt,
+    "le": operator.le,
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "or": lambda rand_1, rand_2: rand_1 or rand_2,
+    "&": lambda rand_1, rand_2: rand_1 and rand_2,
+    "aug": _aug,
+}
+
+UNARY_OPERATIONS = {
+    "not": operator.not_,
+    "neg": operator.neg,
+}
+
+# Rule 13 applies the eta's closure to the eta, then the result to
+# the argument.
+ETA_UNFOLDING = [(TAIL_APPLY, None), (RETURN, None)]
+
+
+# Results kept by CSEMachine(memo_size=...) when myrpal.py is given
+# -memo without a size
+MEMO_SIZE = 10000
+
+
+def _memo_key(value):
+    """
+    Returns a hashable key that identifies an argument by value (ints, strings,
+    truth values and tuples of those), or None for any other argument.
+    """
+    kind = type(value)
+    if kind is int:
+        return value
+    if kind is RPALString:
+        return value.value()
+    if kind is bool:
+        # 1 eq true holds, but Isinteger tells 1 from true, so a function may
+        # return different results for them: they must not share a key.
+        return (bool, value)
+    if kind is RPALTuple:
+        keys = tuple(_memo_key(item) for item in value)
+        if any(key is None for key in keys):
+            return None
+        return (RPALTuple, keys)
+    return None
+
+
+# Quickening (CSEMachine(quicken=True)): an instruction is specialized after
+# WARMUP runs in a row with the same operand types. Each deoptimization doubles
+# the runs it must wait for, and a site that deoptimizes or changes types more
+# than GIVE_UP times stays generic.
+WARMUP = 8
+GIVE_UP = 4
+
+
+class _Site:
+    """
+    The adaptive state of one quickened BINOP, APPLY or TAIL_APPLY instruction.
     """
 
-    def __init__(self, number: int) -> None:
-        self.number: int = number
-        self.bounded_variable: str = ""
-        self.environment: int = 0
+    __slots__ = ("operation", "name", "key", "count", "warmup", "changes")
 
-    def __repr__(self) -> str:
-        return f"η({self.number}, vars={self.bounded_variable}, env=e_{self.environment})"
+    def __init__(self, operation, name):
+        self.operation = operation     # The generic operation (BINOP only)
+        self.name = name               # The operator, "apply" or "tail_apply"
+        self.key = None                # Operand types seen in the current run
+        self.count = 0                 # Length of the current run
+        self.warmup = WARMUP
+        self.changes = 0               # Deoptimizations and type changes
 
 
-# ──────────────────────────────────────────────────────────────────────────────
-# Environment class for the CSE machine
-# ──────────────────────────────────────────────────────────────────────────────
-class Environment():
+def format_value(value):
     """
-    Represents an environment in the CSE machine, which holds variables and child environments.
-    Fields:
-      - name: unique identifier for the environment (e.g., "e_0", "e_1", ...)
-      - variables: dictionary of variable names and their values
-      - children: list of child environments
-      - parent: reference to the parent environment
+    Returns a final value in the form the rpal.exe program prints it.
     """
+    # Strings and built-in functions print as Python strings.
+    if type(value) in (RPALString, Builtin, PartialBuiltin):
+        value = str(value)
+
+    if type(value) == RPALTuple:
+        value = tuple(str(element)
+                      if type(element) in (RPALString, Builtin, PartialBuiltin)
+                      else element for element in value)
+
+    # Lambda expression becomes a lambda closure when its environment
+    # is determined.
+    if type(value) == Closure and value.code.block.eta is None:
+        value = "[lambda closure: " + \
+            str(value.code.bounded_variable) + ": " + \
+            str(value.code.number) + "]"
+
+    if type(value) == tuple:
+        # The rpal.exe program prints the boolean values in lowercase. Our code
+        # must emulate this behaviour.
+        for i in range(len(value)):
+            if type(value[i]) == bool:
+                value = list(value)
+                value[i] = str(value[i]).lower()
+                value = tuple(value)
+
+        # The rpal.exe program does not print the comma when there is only one
+        # element in the tuple. Our code must emulate this behaviour.
+        if len(value) == 1:
+            value = "(" + str(value[0]) + ")"
+
+        # The rpal.exe program does not print inverted commas when an element
+        # in the tuple is a string. Our code must emulate this behaviour too.
+        else:
+            if any(type(element) == str for element in value):
+                temp = "("
+                for element in value:
+                    temp += str(element) + ", "
+                temp = temp[:-2] + ")"
+                value = temp
 
-    def __init__(self, number, parent):
-        self.name = "e_" + str(number)
-        self.variables = {}
-        self.children = []
-        self.parent = parent
-
-    # This function adds a child to the current environment.
-    def add_child(self, child):
-        self.children.append(child)
-        child.variables.update(self.variables)
+    # The rpal.exe program prints the boolean values in lowercase. Our code
+    # must emulate this behaviour.
+    if value == True or value == False:
+        value = str(value).lower()
+    return value
 
-    # This function adds a variable to the current environment.
-    def add_variable(self, key, value):
-        self.variables[key] = value
 
+class CSEMachine:
+    """
+    A self-contained CSE machine running the bytecode produced by the Compiler.
+    All evaluation state (code blocks, control, stack and environments) lives
+    on the instance, so several programs can be evaluated back to back, or
+    concurrently from different threads, each with its own machine.
+
+    Every opcode is dispatched through a table of handler methods:
+    CSEMachine.link turns each compiled instruction into a (handler, operand)
+    pair once, when the program is loaded. Rule 4 dispatches on the operator's
+    type through a second table of appliers.
+
+    The control is a stack of frames over immutable code: each frame is a
+    (code, pc, environment) triple. Calling a function or taking a branch only
+    moves a program counter or pushes one frame; it never copies a code block.
+    A TAIL_APPLY replaces the running frame instead of suspending it, so tail
+    calls run in constant frame depth.
+
+    With letrec=True, evaluate compiles recursive definitions to MAKE_LETREC
+    closures (see Compiler) instead of Y* applications. With fold=True, it
+    folds constants and pre-evaluates closed subexpressions first (see
+    optimizer.fold_constants). With coalesce=True, it runs chains of let
+    bindings in one environment (see optimizer.coalesce_lets), so closures
+    print other environment numbers than rpal.exe's. Error messages (a
+    failing ItoS, stack underflow) are printed to out, a file, or to
+    sys.stdout when it is None.
+
+    With quicken=True, BINOP, APPLY and TAIL_APPLY instructions adapt to the
+    values they see, in the manner of CPython's specializing interpreter: once
+    an instruction has run a few times in a row on the same types, it is
+    rewritten in place into a specialized instruction (integer arithmetic, a
+    call of a one-parameter closure, a tuple index, a builtin call) that checks
+    its guard and does the work inline. When the guard fails, the instruction
+    is rewritten back (a deoptimization) and adapts again. statistics()
+    counts both.
+
+    With memo_size > 0, the results of recursive functions whose code the
+    Compiler marked memoize (they cannot reach Print) are cached by function
+    and argument value, keeping the memo_size most recently used. A cached call
+    pushes its result in one step; any other call pushes a frame that stores
+    the result when the function returns, so those calls are never tail calls.
+    """
 
-# ──────────────────────────────────────────────────────────────────────────────
-# The main CSEMachine
-# ──────────────────────────────────────────────────────────────────────────────
-control_structures = []
-count = 0
-control = []
-stack = Stack("CSE")          # Stack for the CSE machine
-environments = [Environment(0, None)]
-current_environment = 0
-builtInFunctions = ["Order", "Print", "print", "Conc", "Stern", "Stem",
-                    "Isinteger", "Istruthvalue", "Isstring", "Istuple", "Isfunction", "ItoS"]
-print_present = False
-
-
-def generate_control_structure(root, i):
-    global count
-
-    while (len(control_structures) <= i):
-        control_structures.append([])
-
-    # When lambda is encountered, we have to generate a new control structure.
-    if (root.value == "lambda"):
-        count += 1
-        left_child = root.children[0]
-        if (left_child.value == ","):
-            temp = Lambda(count)
-
-            x = ""
-            for child in left_child.children:
-                x += child.value[4:-1] + ","
-            x = x[:-1]
-
-            temp.bounded_variable = x
-            control_structures[i].append(temp)
+    def __init__(self, letrec: bool = False, fold: bool = False,
+                 coalesce: bool = False, memo_size: int = 0,
+                 quicken: bool = False, out=None) -> None:
+        self.letrec = letrec
+        self.fold = fold
+        self.coalesce = coalesce
+        self.memo_size = memo_size
+        self.quicken = quicken
+        # Where error messages go; None for sys.stdout
+        self.out = out
+        self._reset()
+
+    def _reset(self) -> None:
+        self.codes = {}                    # Loaded code, by CodeBlock
+        self.main = None                   # Loaded code of the main program
+        self.closures = 0                  # Closures created
+        # Suspended caller frames: (code, pc, environment)
+        self.frames = []
+        self.peak_frames = 0
+        self.stack = Stack("CSE")          # Stack for the CSE machine
+        self.tracker = EnvironmentTracker()
+        self.primitive_environment = Environment(self.tracker, None, [])
+        self.print_present = False
+        self.steps = 0
+        # ST nodes the optimizer removed (see evaluate)
+        self.nodes_removed = 0
+        # (function, argument key) -> result, oldest first
+        self.memo = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.specializations = 0
+        self.deoptimizations = 0
+
+        # The running frame
+        self.code = None
+        self.pc = 0
+        self.environment = self.primitive_environment
+
+        # Dispatch tables: opcode -> handler, and operator type -> Rule 4
+        # applier.
+        self.handlers = [None] * len(OPNAMES)
+        self.handlers[LOAD_CONST] = self.load_const
+        self.handlers[LOAD_VAR] = self.load_var
+        self.handlers[MAKE_LAMBDA] = self.make_lambda
+        self.handlers[MAKE_LETREC] = self.make_letrec
+        self.handlers[APPLY] = self.apply
+        self.handlers[TAIL_APPLY] = self.tail_apply
+        self.handlers[CALL] = self.call
+        self.handlers[LET] = self.let
+        self.handlers[BIND] = self.bind
+        self.handlers[BINOP] = self.binop
+        self.handlers[UNOP] = self.unop
+        self.handlers[BUILD_TUPLE] = self.build_tuple
+        self.handlers[JUMP_IF_FALSE] = self.jump_if_false
+        self.handlers[JUMP] = self.jump
+        self.handlers[SWITCH] = self.switch
+        self.handlers[SWITCH_TYPE] = self.switch_type
+        self.handlers[SKIP_ENVS] = self.skip_envs
+        self.handlers[RETURN] = self.do_return
+
+        self.appliers = {
+            Closure: self.apply_lambda,
+            RPALTuple: self.apply_tuple,
+            RecClosure: self.apply_eta,
+            str: self.apply_name,
+            Builtin: self.apply_builtin,
+            PartialBuiltin: self.apply_partial_builtin,
+        }
+        self.eta_unfolding = self.link(ETA_UNFOLDING)
+        # Specialized instructions by (operator, operand types), see
+        # binop_adaptive and apply_adaptive. Closure calls are left to the
+        # appliers when they memoize.
+        self.specialized = {
+            ("+", (int, int)): self.binop_add_int,
+            ("-", (int, int)): self.binop_sub_int,
+            ("*", (int, int)): self.binop_mul_int,
+            ("eq", (int, int)): self.binop_eq_int,
+            ("ne", (int, int)): self.binop_ne_int,
+            ("ls", (int, int)): self.binop_ls_int,
+            ("le", (int, int)): self.binop_le_int,
+            ("gr", (int, int)): self.binop_gr_int,
+            ("ge", (int, int)): self.binop_ge_int,
+            ("apply", (RPALTuple, True)): self.apply_tuple_index,
+            ("tail_apply", (RPALTuple, True)): self.apply_tuple_index,
+            ("apply", (Builtin, True)): self.apply_builtin_call,
+            ("tail_apply", (Builtin, True)): self.apply_builtin_call,
+        }
+        if self.memo_size > 0:
+            self.appliers[Closure] = self.apply_lambda_memo
+            self.appliers[RecClosure] = self.apply_eta_memo
         else:
-            temp = Lambda(count)
-            temp.bounded_variable = left_child.value[4:-1]
-            control_structures[i].append(temp)
-
-        for child in root.children[1:]:
-            generate_control_structure(child, count)
-
-    elif (root.value == "->"):
-        count += 1
-        temp = Delta(count)
-        control_structures[i].append(temp)
-        generate_control_structure(root.children[1], count)
-        count += 1
-        temp = Delta(count)
-        control_structures[i].append(temp)
-        generate_control_structure(root.children[2], count)
-        control_structures[i].append("beta")
-        generate_control_structure(root.children[0], i)
-
-    elif (root.value == "tau"):
-        n = len(root.children)
-        temp = Tau(n)
-        control_structures[i].append(temp)
-        for child in root.children:
-            generate_control_structure(child, i)
-
-    else:
-        control_structures[i].append(root.value)
-        for child in root.children:
-            generate_control_structure(child, i)
-
-# This function is used for tokens that begin with '<' and end with '>'.
-
-
-def lookup(name):
-    name = name[1:-1]
-    info = name.split(":")
-
-    if (len(info) == 1):
-        value = info[0]
-    else:
-        data_type = info[0]
-        value = info[1]
-
-        if data_type == "INT":
-            return int(value)
-
-        # The rpal.exe program detects srings only when they begin with ' and end with '.
-        # Our code must emulate this behaviour.
-        elif data_type == "STR":
-            return value.strip("'")
-        elif data_type == "ID":
-            if (value in builtInFunctions):
-                return value
-            else:
-                try:
-                    value = environments[current_environment].variables[value]
-                except KeyError:
-                    print("Undeclared Identifier: " + value)
-                    exit(1)
-                else:
-                    return value
-
-    if value == "Y*":
-        return "Y*"
-    elif value == "nil":
-        return ()
-    elif value == "true":
-        return True
-    elif value == "false":
-        return False
-
-
-def built_in(function, argument):
-    global print_present
-
-    # The Order function returns the length of a tuple.
-    if (function == "Order"):
-        order = len(argument)
-        stack.push(order)
-
-    # The Print function prints the output to the command prompt.
-    elif (function == "Print" or function == "print"):
-        # We should print the output only when the 'Print' function is called in the program.
-        print_present = True
-
-        # If there are escape characters in the string, we need to format it properly.
-        if type(argument) == str:
-            if "\\n" in argument:
-                argument = argument.replace("\\n", "\n")
-            if "\\t" in argument:
-                argument = argument.replace("\\t", "\t")
-
-        stack.push(argument)
-
-    # The Conc function concatenates two strings.
-    elif (function == "Conc"):
-        stack_symbol = stack.pop()
-        control.pop()
-        temp = argument + stack_symbol
-        stack.push(temp)
-
-    # The Stern function returns the string without the first letter.
-    elif (function == "Stern"):
-        stack.push(argument[1:])
-
-    # The Stem function returns the first letter of the given string.
-    elif (function == "Stem"):
-        stack.push(argument[0])
-
-    # The Isinteger function checks if the given argument is an integer.
-    elif (function == "Isinteger"):
-        if (type(argument) == int):
-            stack.push(True)
+            self.specialized[("apply", (Closure, True))] = \
+                self.apply_closure_call
+            self.specialized[("tail_apply", (Closure, True))] = \
+                self.tail_apply_closure_call
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Instruction handlers, one per opcode
+    # ──────────────────────────────────────────────────────────────────────
+
+    # Rule 1
+    def load_const(self, value):
+        self.stack.push(value)
+
+    def load_var(self, address):
+        depth, slot, _ = address
+        environment = self.environment
+        while depth:
+            environment = environment.parent
+            depth -= 1
+        self.stack.push(environment.slots[slot])
+
+    # Rule 2
+    def make_lambda(self, code):
+        self.closures += 1
+        self.stack.push(Closure(code, self.environment))
+
+    # letrec: the environment holds the closure and the closure holds
+    # the environment. It stands for the eta Y* would have made, which
+    # creates no environment, so it takes no number.
+    def make_letrec(self, code):
+        environment = Environment(self.tracker, self.environment, [None], 0)
+        self.closures += 1
+        closure = Closure(code, environment)
+        environment.slots[0] = closure
+        self.stack.push(closure)
+
+    # Rule 4
+    def apply(self, _):
+        pop = self.stack.pop
+        rator = pop()
+        rand = pop()
+        applier = self.appliers.get(type(rator))
+        if applier is not None:
+            applier(rator, rand, True)
+
+    def tail_apply(self, _):
+        pop = self.stack.pop
+        rator = pop()
+        rand = pop()
+        applier = self.appliers.get(type(rator))
+        if applier is not None:
+            applier(rator, rand, False)
+
+    # A saturated call of a curried function: Rule 11 for all its
+    # parameters at once.
+    def call(self, operand):
+        count, tail = operand
+        stack = self.stack
+        rator = stack[-1]
+        kind = type(rator)
+        if kind is Closure or kind is RecClosure:
+            saturated = rator.code.saturated
+            # An eta's code also binds the eta itself, before the arguments.
+            slots = [rator] if kind is RecClosure else []
+            if saturated is not None and saturated.chain == count + len(slots):
+                stack.pop()
+                for _ in range(count):
+                    slots.append(stack.pop())
+                if not tail:
+                    # Resume after the APPLYs that would have curried the call.
+                    self.pc += count - 1
+                    frames = self.frames
+                    frames.append((self.code, self.pc, self.environment))
+                    if len(frames) > self.peak_frames:
+                        self.peak_frames = len(frames)
+                # One environment for the chain's, under their numbers
+                numbers = saturated.chain + rator.code.numbers - 1
+                self.environment = Environment(self.tracker,
+                                               rator.environment, slots,
+                                               numbers)
+                self.code = saturated.instructions
+                self.pc = 0
+                return
+        self.apply(None)
+
+    # A let* block: one environment for all its bindings, filled in by BIND.
+    def let(self, operand):
+        code, tail = operand
+        if not tail:
+            frames = self.frames
+            frames.append((self.code, self.pc, self.environment))
+            if len(frames) > self.peak_frames:
+                self.peak_frames = len(frames)
+        self.environment = Environment(self.tracker, self.environment,
+                                       [None] * code.arity)
+        self.code = code.instructions
+        self.pc = 0
+
+    def bind(self, operand):
+        slot, count = operand
+        value = self.stack.pop()
+        slots = self.environment.slots
+        if count == 1:
+            slots[slot] = value
         else:
-            stack.push(False)
-
-    # The Istruthvalue function checks if the given argument is a boolean value.
-    elif (function == "Istruthvalue"):
-        if (type(argument) == bool):
-            stack.push(True)
+            # Rule 11 for a tuple of names
+            for i in range(count):
+                slots[slot + i] = value[i]
+
+    # Rule 5
+    def do_return(self, _):
+        if not self.frames:
+            raise MachineHalt()
+        self.code, self.pc, self.environment = self.frames.pop()
+
+    # Rule 6
+    def binop(self, operation):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack.pop()
+        stack.append(operation(rand_1, rand_2))
+
+    # Rule 7
+    def unop(self, operation):
+        stack = self.stack
+        stack.append(operation(stack.pop()))
+
+    # Rule 8
+    def jump_if_false(self, offset):
+        if not self.stack.pop():
+            self.pc += offset
+
+    def jump(self, offset):
+        self.pc += offset
+
+    # Rule 8 for a whole chain of conditionals (see Compiler._compile_switch)
+    def switch(self, operand):
+        table, default = operand
+        self.pc += table.get(self.stack.pop(), default)
+
+    def switch_type(self, operand):
+        table, default = operand
+        self.pc += table.get(type(self.stack.pop()), default)
+
+    # The environments of applications the optimizer removed take their
+    # numbers, so the ones created after them print as in rpal.exe.
+    def skip_envs(self, count):
+        self.tracker.numbered += count
+
+    # Rule 9
+    def build_tuple(self, n):
+        stack = self.stack
+        tau_list = []
+        for i in range(n):
+            tau_list.append(stack.pop())
+        stack.push(RPALTuple(tau_list, n))
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Rule 4 appliers, one per type of operator on top of the stack.
+    # `suspend` is False for a tail call, which replaces the running frame.
+    # ──────────────────────────────────────────────────────────────────────
+    def _enter(self, code, environment, suspend):
+        if suspend:
+            frames = self.frames
+            frames.append((self.code, self.pc, self.environment))
+            if len(frames) > self.peak_frames:
+                self.peak_frames = len(frames)
+        self.code = code
+        self.pc = 0
+        self.environment = environment
+
+    def apply_lambda(self, rator, rand, suspend):
+        # Rule 11
+        code = rator.code
+        arity = code.arity
+
+        if (arity > 1):
+            slots = [rand[i] for i in range(arity)]
         else:
-            stack.push(False)
+            slots = [rand]
+        environment = rator.environment
+        if code.chain:
+            slots, environment = _gather(slots, environment, code.chain)
+
+        if suspend:
+            frames = self.frames
+            frames.append((self.code, self.pc, self.environment))
+            if len(frames) > self.peak_frames:
+                self.peak_frames = len(frames)
+        self.environment = Environment(self.tracker, environment, slots,
+                                       code.numbers)
+        self.code = code.instructions
+        self.pc = 0
+
+    # Rule 10
+    def apply_tuple(self, rator, rand, suspend):
+        self.stack.push(rator[rand - 1])
+
+    # Rule 13
+    def apply_eta(self, rator, rand, suspend):
+        self.stack.push(rand)
+        self._enter(self.eta_unfolding, self.environment, suspend)
+        # The eta's code and environment are those of its closure.
+        self.apply_lambda(rator, rator, True)
+
+    # Rules 11 and 13 for a memoized function: push a cached result, or a
+    # frame whose code caches the result the function returns, then apply
+    # it as usual.
+    def apply_lambda_memo(self, rator, rand, suspend):
+        if rator.code.block.memoize:
+            suspend = self._recall(rator, rand, suspend)
+            if suspend is None:
+                return
+        self.apply_lambda(rator, rand, suspend)
+
+    def apply_eta_memo(self, rator, rand, suspend):
+        if rator.code.block.memoize:
+            suspend = self._recall(rator, rand, suspend)
+            if suspend is None:
+                return
+        self.apply_eta(rator, rand, suspend)
+
+    def _recall(self, rator, rand, suspend):
+        """
+        Pushes the cached result of rator applied to rand and returns None, or
+        returns how the application should suspend the running frame.
+        """
+        key = _memo_key(rand)
+        if key is None:
+            return suspend
+        key = (rator, key)
+        memo = self.memo
+        if key in memo:
+            memo.move_to_end(key)
+            self.memo_hits += 1
+            self.stack.push(memo[key])
+            return None
+        self.memo_misses += 1
+        self._enter([(self.memo_store, key), (self.do_return, None)],
+                    self.environment, suspend)
+        return True
 
-    # The Isstring function checks if the given argument is a string.
-    elif (function == "Isstring"):
-        if (type(argument) == str):
-            stack.push(True)
+    def memo_store(self, key):
+        memo = self.memo
+        memo[key] = self.stack[-1]
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+
+    # Rule 12
+    def apply_name(self, rator, rand, suspend):
+        if (rator == "Y*"):
+            self.closures += 1
+            self.stack.push(RecClosure(rand.code, rand.environment))
+
+    # Built-in functions take one argument per application, like any
+    # curried function.
+    def apply_builtin(self, rator, rand, suspend):
+        if rator.arity == 1:
+            self.stack.push(rator.function(self, rand))
         else:
-            stack.push(False)
+            self.stack.push(PartialBuiltin(rator, (rand,)))
 
-    # The Istuple function checks if the given argument is a tuple.
-    elif (function == "Istuple"):
-        if (type(argument) == tuple):
-            stack.push(True)
+    def apply_partial_builtin(self, rator, rand, suspend):
+        builtin = rator.builtin
+        arguments = rator.arguments + (rand,)
+        if len(arguments) == builtin.arity:
+            self.stack.push(builtin.function(self, *arguments))
         else:
-            stack.push(False)
-
-    # The Isfunction function checks if the given argument is a built-in function.
-    elif (function == "Isfunction"):
-        if (argument in builtInFunctions):
-            return True
+            self.stack.push(PartialBuiltin(builtin, arguments))
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Quickening: adaptive instructions and the specialized instructions
+    # they become
+    # ──────────────────────────────────────────────────────────────────────
+    def _adapt(self, code, index, site, key, generic):
+        """
+        Records that the instruction at code[index] ran on operands of the
+        given key, and rewrites it once the run of that key is long enough.
+        """
+        if key != site.key:
+            site.key = key
+            site.count = 1
+            site.changes += 1
+            if site.changes > GIVE_UP:
+                code[index] = generic
+            return
+        site.count += 1
+        if site.count >= site.warmup:
+            handler = self.specialized.get((site.name, key))
+            if handler is None:
+                code[index] = generic
+            else:
+                code[index] = (handler, site)
+                self.specializations += 1
+
+    def _deoptimize(self, site):
+        """
+        Rewrites the running specialized instruction back into its
+        adaptive form.
+        """
+        self.deoptimizations += 1
+        site.key = None
+        site.warmup *= 2
+        site.changes += 1
+        adaptive = self.binop_adaptive if site.operation is not None else (
+            self.apply_adaptive if site.name == "apply"
+            else self.tail_apply_adaptive)
+        self.code[self.pc - 1] = (adaptive, site)
+
+    def binop_adaptive(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        stack[-1] = site.operation(rand_1, rand_2)
+        self._adapt(self.code, self.pc - 1, site, (type(rand_1), type(rand_2)),
+                    (self.binop, site.operation))
+
+    def _binop_deoptimized(self, site, rand_1, rand_2):
+        self._deoptimize(site)
+        return site.operation(rand_1, rand_2)
+
+    def binop_add_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 + rand_2
         else:
-            False
-
-    # The ItoS function converts integers to strings.
-    elif (function == "ItoS"):
-        if (type(argument) == int):
-            stack.push(str(argument))
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_sub_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 - rand_2
         else:
-            print("Error: ItoS function can only accept integers.")
-            exit()
-
-
-def apply_rules():
-    op = ["+", "-", "*", "/", "**", "gr", "ge",
-          "ls", "le", "eq", "ne", "or", "&", "aug"]
-    uop = ["neg", "not"]
-
-    global control
-    global current_environment
-
-    while (len(control) > 0):
-
-        symbol = control.pop()
-
-        # Rule 1
-        if type(symbol) == str and (symbol[0] == "<" and symbol[-1] == ">"):
-            stack.push(lookup(symbol))
-
-        # Rule 2
-        elif type(symbol) == Lambda:
-            temp = Lambda(symbol.number)
-            temp.bounded_variable = symbol.bounded_variable
-            temp.environment = current_environment
-            stack.push(temp)
-
-        # Rule 4
-        elif (symbol == "gamma"):
-            stack_symbol_1 = stack.pop()
-            stack_symbol_2 = stack.pop()
-
-            if (type(stack_symbol_1) == Lambda):
-                current_environment = len(environments)
-
-                lambda_number = stack_symbol_1.number
-                bounded_variable = stack_symbol_1.bounded_variable
-                parent_environment_number = stack_symbol_1.environment
-
-                parent = environments[parent_environment_number]
-                child = Environment(current_environment, parent)
-                parent.add_child(child)
-                environments.append(child)
-
-                # Rule 11
-                variable_list = bounded_variable.split(",")
-
-                if (len(variable_list) > 1):
-                    for i in range(len(variable_list)):
-                        child.add_variable(variable_list[i], stack_symbol_2[i])
-                else:
-                    child.add_variable(bounded_variable, stack_symbol_2)
-
-                stack.push(child.name)
-                control.append(child.name)
-                control += control_structures[lambda_number]
-
-            # Rule 10
-            elif (type(stack_symbol_1) == tuple):
-                stack.push(stack_symbol_1[stack_symbol_2 - 1])
-
-            # Rule 12
-            elif (stack_symbol_1 == "Y*"):
-                temp = Eta(stack_symbol_2.number)
-                temp.bounded_variable = stack_symbol_2.bounded_variable
-                temp.environment = stack_symbol_2.environment
-                stack.push(temp)
-
-            # Rule 13
-            elif (type(stack_symbol_1) == Eta):
-                temp = Lambda(stack_symbol_1.number)
-                temp.bounded_variable = stack_symbol_1.bounded_variable
-                temp.environment = stack_symbol_1.environment
-
-                control.append("gamma")
-                control.append("gamma")
-                stack.push(stack_symbol_2)
-                stack.push(stack_symbol_1)
-                stack.push(temp)
-
-            # Built-in functions
-            elif stack_symbol_1 in builtInFunctions:
-                built_in(stack_symbol_1, stack_symbol_2)
-
-        # Rule 5
-        elif type(symbol) == str and (symbol[0:2] == "e_"):
-            stack_symbol = stack.pop()
-            stack.pop()
-
-            if (current_environment != 0):
-                for element in reversed(stack):
-                    if (type(element) == str and element[0:2] == "e_"):
-                        current_environment = int(element[2:])
-                        break
-            stack.push(stack_symbol)
-
-        # Rule 6
-        elif (symbol in op):
-            rand_1 = stack.pop()
-            rand_2 = stack.pop()
-            if (symbol == "+"):
-                stack.push(rand_1 + rand_2)
-            elif (symbol == "-"):
-                stack.push(rand_1 - rand_2)
-            elif (symbol == "*"):
-                stack.push(rand_1 * rand_2)
-            elif (symbol == "/"):
-                stack.push(rand_1 // rand_2)
-            elif (symbol == "**"):
-                stack.push(rand_1 ** rand_2)
-            elif (symbol == "gr"):
-                stack.push(rand_1 > rand_2)
-            elif (symbol == "ge"):
-                stack.push(rand_1 >= rand_2)
-            elif (symbol == "ls"):
-                stack.push(rand_1 < rand_2)
-            elif (symbol == "le"):
-                stack.push(rand_1 <= rand_2)
-            elif (symbol == "eq"):
-                stack.push(rand_1 == rand_2)
-            elif (symbol == "ne"):
-                stack.push(rand_1 != rand_2)
-            elif (symbol == "or"):
-                stack.push(rand_1 or rand_2)
-            elif (symbol == "&"):
-                stack.push(rand_1 and rand_2)
-            elif (symbol == "aug"):
-                if (type(rand_2) == tuple):
-                    stack.push(rand_1 + rand_2)
-                else:
-                    stack.push(rand_1 + (rand_2,))
-
-        # Rule 7
-        elif (symbol in uop):
-            rand = stack.pop()
-            if (symbol == "not"):
-                stack.push(not rand)
-            elif (symbol == "neg"):
-                stack.push(-rand)
-
-        # Rule 8
-        elif (symbol == "beta"):
-            B = stack.pop()
-            else_part = control.pop()
-            then_part = control.pop()
-            if (B):
-                control += control_structures[then_part.number]
-            else:
-                control += control_structures[else_part.number]
-
-        # Rule 9
-        elif type(symbol) == Tau:
-            n = symbol.number
-            tau_list = []
-            for i in range(n):
-                tau_list.append(stack.pop())
-            tau_tuple = tuple(tau_list)
-            stack.push(tau_tuple)
-
-        elif (symbol == "Y*"):
-            stack.push(symbol)
-
-    # Lambda expression becomes a lambda closure when its environment is determined.
-    if type(stack[0]) == Lambda:
-        stack[0] = "[lambda closure: " + \
-            str(stack[0].bounded_variable) + ": " + str(stack[0].number) + "]"
-
-    if type(stack[0]) == tuple:
-        # The rpal.exe program prints the boolean values in lowercase. Our code must emulate this behaviour.
-        for i in range(len(stack[0])):
-            if type(stack[0][i]) == bool:
-                stack[0] = list(stack[0])
-                stack[0][i] = str(stack[0][i]).lower()
-                stack[0] = tuple(stack[0])
-
-        # The rpal.exe program does not print the comma when there is only one element in the tuple.
-        # Our code must emulate this behaviour.
-        if len(stack[0]) == 1:
-            stack[0] = "(" + str(stack[0][0]) + ")"
-
-        # The rpal.exe program does not print inverted commas when an element in the tuple is a string.
-        # Our code must emulate this behaviour too.
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_mul_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 * rand_2
         else:
-            if any(type(element) == str for element in stack[0]):
-                temp = "("
-                for element in stack[0]:
-                    temp += str(element) + ", "
-                temp = temp[:-2] + ")"
-                stack[0] = temp
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_eq_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 == rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_ne_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 != rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_ls_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 < rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_le_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 <= rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_gr_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 > rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    def binop_ge_int(self, site):
+        stack = self.stack
+        rand_1 = stack.pop()
+        rand_2 = stack[-1]
+        if type(rand_1) is int and type(rand_2) is int:
+            stack[-1] = rand_1 >= rand_2
+        else:
+            stack[-1] = self._binop_deoptimized(site, rand_1, rand_2)
+
+    @staticmethod
+    def _apply_key(rator):
+        # Closures and builtins are specialized for the one-argument case only,
+        # and closures that do not end a curried function.
+        kind = type(rator)
+        if kind is Closure:
+            code = rator.code
+            return (kind, code.arity == 1 and not code.chain)
+        if kind is Builtin:
+            return (kind, rator.arity == 1)
+        return (kind, True)
+
+    def apply_adaptive(self, site):
+        # The application may enter another code block, so note the site first.
+        code, index = self.code, self.pc - 1
+        rator = self.stack[-1]
+        self.apply(None)
+        self._adapt(code, index, site, self._apply_key(rator),
+                    (self.apply, None))
+
+    def tail_apply_adaptive(self, site):
+        code, index = self.code, self.pc - 1
+        rator = self.stack[-1]
+        self.tail_apply(None)
+        self._adapt(code, index, site, self._apply_key(rator),
+                    (self.tail_apply, None))
+
+    def _apply_deoptimized(self, site, rator, rand):
+        self._deoptimize(site)
+        applier = self.appliers.get(type(rator))
+        if applier is not None:
+            applier(rator, rand, site.name == "apply")
+
+    # Rule 11 for a closure of one parameter that does not end a curried
+    # function
+    def apply_closure_call(self, site):
+        stack = self.stack
+        rator = stack.pop()
+        rand = stack.pop()
+        if (type(rator) is Closure and rator.code.arity == 1
+                and not rator.code.chain):
+            frames = self.frames
+            frames.append((self.code, self.pc, self.environment))
+            if len(frames) > self.peak_frames:
+                self.peak_frames = len(frames)
+            self.environment = Environment(self.tracker, rator.environment,
+                                           [rand], rator.code.numbers)
+            self.code = rator.code.instructions
+            self.pc = 0
+        else:
+            self._apply_deoptimized(site, rator, rand)
+
+    def tail_apply_closure_call(self, site):
+        stack = self.stack
+        rator = stack.pop()
+        rand = stack.pop()
+        if (type(rator) is Closure and rator.code.arity == 1
+                and not rator.code.chain):
+            self.environment = Environment(self.tracker, rator.environment,
+                                           [rand], rator.code.numbers)
+            self.code = rator.code.instructions
+            self.pc = 0
+        else:
+            self._apply_deoptimized(site, rator, rand)
+
+    # Rule 10
+    def apply_tuple_index(self, site):
+        stack = self.stack
+        rator = stack.pop()
+        if type(rator) is RPALTuple:
+            stack[-1] = rator[stack[-1] - 1]
+        else:
+            self._apply_deoptimized(site, rator, stack.pop())
 
-    # The rpal.exe program prints the boolean values in lowercase. Our code must emulate this behaviour.
-    if stack[0] == True or stack[0] == False:
-        stack[0] = str(stack[0]).lower()
+    def apply_builtin_call(self, site):
+        stack = self.stack
+        rator = stack.pop()
+        if type(rator) is Builtin and rator.arity == 1:
+            stack[-1] = rator.function(self, stack[-1])
+        else:
+            self._apply_deoptimized(site, rator, stack.pop())
+
+    def is_function(self, value):
+        return type(value) in (Closure, RecClosure, Builtin,
+                               PartialBuiltin) or type(value) == str
+
+    # ──────────────────────────────────────────────────────────────────────
+    # The main loop
+    # ──────────────────────────────────────────────────────────────────────
+    def link(self, instructions):
+        """
+        Replaces each opcode by its handler, each operator name by the callable
+        that implements it and each lambda's code block by its loaded Code, so
+        the main loop dispatches without any comparisons.
+        """
+        handlers = self.handlers
+        linked = []
+        for op, arg in instructions:
+            name = arg
+            if op == BINOP:
+                arg = BINARY_OPERATIONS[arg]
+            elif op == UNOP:
+                arg = UNARY_OPERATIONS[arg]
+            elif op == MAKE_LAMBDA or op == MAKE_LETREC:
+                arg = self.codes[arg]
+            elif op == LET:
+                arg = (self.codes[arg[0]], arg[1])
+            if self.quicken and op == BINOP:
+                linked.append((self.binop_adaptive, _Site(arg, name)))
+            elif self.quicken and op in (APPLY, TAIL_APPLY):
+                name = "apply" if op == APPLY else "tail_apply"
+                adaptive = (self.apply_adaptive if op == APPLY
+                            else self.tail_apply_adaptive)
+                linked.append((adaptive, _Site(None, name)))
+            else:
+                linked.append((handlers[op], arg))
+        return linked
+
+    def apply_rules(self, step_limit=None):
+        self.code = self.main.instructions
+        self.pc = 0
+        self.environment = self.primitive_environment
+
+        steps = 0
+        try:
+            if step_limit is None:
+                while True:
+                    handler, operand = self.code[self.pc]
+                    self.pc += 1
+                    steps += 1
+                    handler(operand)
+            while steps < step_limit:
+                handler, operand = self.code[self.pc]
+                self.pc += 1
+                steps += 1
+                handler(operand)
+            raise StepLimitExceeded(step_limit)
+        except MachineHalt:
+            pass
+        except IndexError:
+            if not self.stack.is_empty():
+                raise
+            self.stack.underflow(self.out)
+        self.steps = steps
+        self.environment = self.primitive_environment
+
+    def format_result(self):
+        self.stack[0] = format_value(self.stack[0])
+
+    def load(self, blocks):
+        """
+        Installs compiled code blocks; apply_rules starts with the main
+        program (block 0).
+        """
+        self.codes = {block: Code(block) for block in blocks}
+        for block, code in self.codes.items():
+            code.instructions = self.link(block.instructions)
+            if block.saturated is not None:
+                code.saturated = self.codes[block.saturated]
+        self.main = self.codes[blocks[0]]
+
+    def statistics(self):
+        """
+        Returns counters describing the last evaluation.
+        """
+        return {
+            "environments_created": self.tracker.created,
+            "peak_environments": self.tracker.peak,
+            "closures_created": self.closures,
+            "peak_frames": self.peak_frames,
+            "steps": self.steps,
+            "nodes_removed": self.nodes_removed,
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+            "specializations": self.specializations,
+            "deoptimizations": self.deoptimizations,
+        }
+
+    def evaluate(self, source_code):
+        """
+        Runs a complete RPAL program on this machine and returns the text that
+        should be printed, or None when the program never calls Print. The
+        machine is reset first, so the same instance can be reused for any
+        number of programs.
+        """
+        st = standardize(source_code)
+        counters = {"nodes_removed": 0}
+        blocks = Compiler(self.letrec).compile(
+            optimize(st, fold=self.fold, coalesce=self.coalesce,
+                     statistics=counters))
+        try:
+            return self.run(blocks)
+        finally:
+            self.nodes_removed = counters["nodes_removed"]
+
+    def compute(self, blocks, step_limit):
+        """
+        Runs compiled code blocks for at most step_limit steps and returns the
+        value they leave on the stack, unformatted. Raises StepLimitExceeded if
+        they take longer.
+        """
+        self._reset()
+        self.load(blocks)
+        self.apply_rules(step_limit)
+        return self.stack[0]
+
+    def run(self, blocks):
+        """
+        Runs already compiled code blocks, as returned by Compiler.compile, and
+        returns the same result as evaluate.
+        """
+        self._reset()
+        self.load(blocks)
+
+        self.apply_rules()
+        self.format_result()
+
+        if self.print_present:
+            return str(self.stack[0])
+        return None
 
 # The following function is called from the myrpal.py file.
 
 
-def get_result(file_name):
-    global control
-
-    st = standardize(file_name)
-
-    generate_control_structure(st, 0)
-
-    control.append(environments[0].name)
-    control += control_structures[0]
-
-    stack.push(environments[0].name)
-
-    apply_rules()
-
-    if print_present:
-        print(stack[0])
+def get_result(source_code):
+    result = CSEMachine().evaluate(source_code)
+    if result is not None:
+        print(result)
@@ -18,3 +18,8 @@ class TokenizationError(RPALException):
     def __init__(self, content: str, line: int) -> None:
         super().__init__(
             f"[Tokenization Error on line {line}]: Invalid token '{content}'")
+
+
+class UndeclaredIdentifierError(RPALException):
+    def __init__(self, name: str) -> None:
+        super().__init__(f"Undeclared Identifier: {name}")
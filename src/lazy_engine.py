@@ -0,0 +1,264 @@
+from __future__ import annotations
+from typing import Any, Callable, List, Tuple
+from src.rpal_ast import ASTNode
+from src.compiler import Scope
+from src.builtin_functions import Builtin, PartialBuiltin
+from src.values import Closure, RecClosure, RPALTuple
+from src.csemachine import BINARY_OPERATIONS, UNARY_OPERATIONS, format_value
+from src.closure_engine import ClosureEngine, Environment, Evaluator, TailCall
+
+
+class Thunk:
+    """
+    A delayed value: the closure that evaluates an expression and the
+    environment to evaluate it in. Forcing it evaluates the expression once and
+    keeps the value (call-by-need); the environment is then dropped.
+    """
+
+    __slots__ = ("evaluate", "environment", "value")
+
+    def __init__(self, evaluate: Callable[[Any], Any],
+                 environment: Any) -> None:
+        self.evaluate = evaluate
+        self.environment = environment
+        self.value: Any = None
+
+    def force(self) -> Any:
+        evaluate = self.evaluate
+        if evaluate is not None:
+            self.value = force(evaluate(self.environment))
+            self.evaluate = None
+            self.environment = None
+        return self.value
+
+
+def force(value: Any) -> Any:
+    """
+    Returns the value a possibly delayed value stands for.
+    """
+    if type(value) is Thunk:
+        return value.force()
+    return value
+
+
+def force_all(value: Any) -> Any:
+    """
+    Forces a value and, for a tuple, every component at any depth. The
+    components are replaced by their values in place, which every view of the
+    tuple may see.
+    """
+    value = force(value)
+    if type(value) is RPALTuple:
+        items = value.items
+        for i in range(value.length):
+            items[i] = force_all(items[i])
+    return value
+
+
+def _component(thunk_and_index: Tuple[Thunk, int]) -> Any:
+    # Rule 11 for a delayed tuple: one component of it, forcing the tuple only
+    # when needed.
+    thunk, index = thunk_and_index
+    return force(thunk)[index]
+
+
+def _delayed(root: ASTNode) -> bool:
+    # Names, constants and lambdas are as cheap to evaluate as to delay.
+    return root.value[0] != "<" and root.value != "lambda"
+
+
+def _aug_lazy(operation: Callable[[Any, Any], Any], left: Evaluator,
+              right: Evaluator, environment: Environment) -> Any:
+    # aug appends a value but concatenates a tuple, so it needs both operands,
+    # though not the components of either.
+    rand_2 = force(right(environment))
+    return operation(force(left(environment)), rand_2)
+
+
+class LazyEngine(ClosureEngine):
+    """
+    The closure engine with call-by-need bindings and tuple components: the
+    value of a let/where binding (including each name of a simultaneous or
+    tuple binding) and each component of a tuple is a Thunk, evaluated the
+    first time something needs it and then remembered. Operators, conditionals,
+    builtins and the operator of an application need their operands, so they
+    force them; a closure's argument that is a thunk stays one. Function
+    arguments other than bindings are evaluated at the call, as in the other
+    engines.
+
+    Lambdas keep their numbers and the result is formatted as by the other
+    engines, so a program prints the same as on the CSE machine unless it
+    relies on a binding or tuple component that is never used: such an
+    expression is never evaluated, so its errors (1/0, a failing ItoS) do not
+    happen, and a Print inside it does not count as the program printing, so a
+    program whose only Print is never needed prints nothing.
+    """
+
+    def _run(self, main: Evaluator) -> Any:
+        return force_all(main([None]))
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Application
+    # ──────────────────────────────────────────────────────────────────────
+    def apply(self, rator: Any, rand: Any) -> Any:
+        while True:
+            kind = type(rator)
+            if kind is Closure:
+                code = rator.code
+                arity = code.arity
+                if arity == 1:
+                    result = code.instructions([rator.environment, rand])
+                elif type(rand) is Thunk:
+                    result = code.instructions(
+                        [rator.environment]
+                        + [Thunk(_component, (rand, i)) for i in range(arity)])
+                else:
+                    result = code.instructions(
+                        [rator.environment] + [rand[i] for i in range(arity)])
+                if type(result) is not TailCall:
+                    return result
+                rator = result.rator
+                rand = result.rand
+            elif kind is Thunk:
+                rator = rator.force()
+            elif kind is RecClosure:
+                unfolded = rator.unfolded
+                if unfolded is None:
+                    code = rator.code
+                    unfolded = force(
+                        self.apply(Closure(code, rator.environment), rator))
+                    if code in self.lambda_bodies:
+                        rator.unfolded = unfolded
+                rator = unfolded
+            elif kind is Builtin:
+                if rator.arity == 1:
+                    return rator.function(self, force(rand))
+                return PartialBuiltin(rator, (rand,))
+            elif kind is PartialBuiltin:
+                arguments = rator.arguments + (rand,)
+                if len(arguments) == rator.builtin.arity:
+                    return rator.builtin.function(self, *map(force, arguments))
+                return PartialBuiltin(rator.builtin, arguments)
+            elif kind is RPALTuple:
+                return rator[force(rand) - 1]
+            elif rator == "Y*":
+                rand = force(rand)
+                return RecClosure(rand.code, rand.environment)
+            else:
+                raise TypeError(f"cannot apply {format_value(rator)!r}")
+
+    def tail_apply(self, rator: Any, rand: Any) -> Any:
+        return super().tail_apply(force(rator), rand)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Compilation: delay bindings and components, force operands
+    # ──────────────────────────────────────────────────────────────────────
+    def _compile_gamma(self, root: ASTNode, scope: Scope,
+                       tail: bool) -> Evaluator:
+        rator_node, rand_node = root.children
+        if rator_node.value != "lambda" or not _delayed(rand_node):
+            return super()._compile_gamma(root, scope, tail)
+        # A single let/where binding: the value is delayed.
+        rator = self.compile(rator_node, scope, False)
+        rand = self.compile(rand_node, scope, False)
+        apply = self.apply
+        if tail:
+            tail_apply = self.tail_apply
+            return lambda environment: tail_apply(rator(environment),
+                                                  Thunk(rand, environment))
+        return lambda environment: apply(rator(environment),
+                                         Thunk(rand, environment))
+
+    def _compile_builtin_call(self, function: Callable[..., Any],
+                              arguments: List[Evaluator]) -> Evaluator:
+        return super()._compile_builtin_call(function, [
+            lambda environment, evaluate=argument: force(evaluate(environment))
+            for argument in arguments])
+
+    def _compile_conditional(self, root: ASTNode, scope: Scope,
+                             tail: bool) -> Evaluator:
+        condition_node, then_node, else_node = root.children
+        self.count += 1
+        then_part = self.compile(then_node, scope, tail)
+        self.count += 1
+        else_part = self.compile(else_node, scope, tail)
+        condition = self.compile(condition_node, scope, False)
+
+        def conditional(environment: Environment) -> Any:
+            value = condition(environment)
+            if type(value) is Thunk:
+                value = value.force()
+            return then_part(environment) if value else else_part(environment)
+        return conditional
+
+    def _compile_let(self, root: ASTNode, scope: Scope,
+                     tail: bool) -> Evaluator:
+        *bindings, body_node = root.children
+        names: List[Tuple[str, ...]] = []
+        for binding in bindings:
+            left_child = binding.children[0]
+            if left_child.value == ",":
+                names.append(tuple(child.value[4:-1]
+                                   for child in left_child.children))
+            else:
+                names.append((left_child.value[4:-1],))
+        slots = sum(names, ())
+
+        self.count += len(bindings)
+        body = self.compile(body_node, Scope(slots, scope), tail)
+        steps: List[Tuple[Evaluator, bool, int, int]] = []
+        slot = len(slots)
+        for binding, bound in zip(reversed(bindings), reversed(names)):
+            slot -= len(bound)
+            value_node = binding.children[1]
+            value = self.compile(value_node, Scope(slots[:slot], scope), False)
+            steps.append((value, _delayed(value_node), slot + 1, len(bound)))
+        steps.reverse()
+        empty = [None] * len(slots)
+
+        def let(environment: Environment) -> Any:
+            inner = [environment] + empty
+            for value, delayed, index, count in steps:
+                result = Thunk(value, inner) if delayed else value(inner)
+                if count == 1:
+                    inner[index] = result
+                else:
+                    for i in range(count):
+                        inner[index + i] = Thunk(_component, (result, i))
+            return body(inner)
+        return let
+
+    def _compile_tuple(self, root: ASTNode, scope: Scope) -> Evaluator:
+        elements = [(self.compile(child, scope, False), _delayed(child))
+                    for child in root.children]
+        count = len(elements)
+
+        def tau(environment: Environment) -> RPALTuple:
+            return RPALTuple([Thunk(element, environment) if delayed
+                              else element(environment)
+                              for element, delayed in elements], count)
+        return tau
+
+    def _compile_unary(self, root: ASTNode, scope: Scope) -> Evaluator:
+        operation = UNARY_OPERATIONS[root.value]
+        operand = self.compile(root.children[0], scope, False)
+        return lambda environment: operation(force(operand(environment)))
+
+    def _compile_binary(self, root: ASTNode, scope: Scope) -> Evaluator:
+        # Comparing tuples compares their components, so those are forced too.
+        operation = BINARY_OPERATIONS[root.value]
+        left = self.compile(root.children[0], scope, False)
+        right = self.compile(root.children[1], scope, False)
+        if root.value == "aug":
+            return lambda environment: _aug_lazy(operation, left, right,
+                                                 environment)
+
+        def binop(environment: Environment) -> Any:
+            rand_2 = right(environment)
+            if type(rand_2) is Thunk or type(rand_2) is RPALTuple:
+                rand_2 = force_all(rand_2)
+            rand_1 = left(environment)
+            if type(rand_1) is Thunk or type(rand_1) is RPALTuple:
+                rand_1 = force_all(rand_1)
+            return operation(rand_1, rand_2)
+        return binop
@@ -0,0 +1,648 @@
+from __future__ import annotations
+import io
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
+from src.rpal_ast import ASTNode
+from src.builtin_functions import BUILTINS, RESERVED_BUILTINS
+from src.values import RPALTuple, RPALString
+
+# Steps a closed subexpression may take when fold_constants pre-evaluates it,
+# and steps all pre-evaluations of one program may take together.
+STEP_BUDGET = 2000
+TOTAL_STEP_BUDGET = 50000
+
+# The largest tuple, in nodes, that fold_constants writes back into the tree.
+LARGEST_FOLDED_TUPLE = 64
+
+# The largest function body, in nodes, that inline_functions copies.
+LARGEST_INLINED_BODY = 12
+
+
+def optimize(root: ASTNode, fold: bool = False, coalesce: bool = False,
+             statistics: Optional[Dict[str, int]] = None) -> ASTNode:
+    """
+    Rewrites a standardized tree into an equivalent one that the Compiler turns
+    into cheaper code. The result is no longer a plain ST: it may contain
+    'let*', 'skip' and 'envs' nodes. Constant folding only runs when fold is
+    True, and let chains are only merged when coalesce is True. When statistics
+    is given, the passes add their counters to it.
+    """
+    root = inline_functions(root)
+    if fold:
+        root = fold_constants(root)
+    root = eliminate_dead_code(root, statistics)
+    if coalesce:
+        root = coalesce_lets(root)
+    return root
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Constant folding
+# ──────────────────────────────────────────────────────────────────────────────
+def _free_names(root: ASTNode,
+                free: Dict[int, FrozenSet[str]]) -> FrozenSet[str]:
+    """
+    Records, for every node under root, the identifiers it uses without binding
+    them.
+    """
+    value = root.value
+    if value.startswith("<ID:"):
+        names = frozenset((value[4:-1],))
+    else:
+        names = frozenset()
+        for child in root.children:
+            names |= _free_names(child, free)
+        if value == "lambda":
+            parameters = root.children[0]
+            bound = (parameters.children if parameters.value == ","
+                     else [parameters])
+            names -= {child.value[4:-1] for child in bound}
+    free[id(root)] = names
+    return names
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Lambda numbers
+# ──────────────────────────────────────────────────────────────────────────────
+def _numbers(root: ASTNode) -> int:
+    """
+    Returns how many lambda numbers the Compiler gives the nodes under root.
+    """
+    if root.value == "skip":
+        before, expression, after = root.children
+        return (int(before.value[5:-1]) + _numbers(expression)
+                + int(after.value[5:-1]))
+    own = 1 if root.value == "lambda" else 2 if root.value == "->" else 0
+    return own + sum(_numbers(child) for child in root.children)
+
+
+def _skip(before: int, expression: ASTNode, after: int) -> ASTNode:
+    """
+    Returns a 'skip' node: the Compiler compiles expression with the lambda
+    numbers moved on by before first and by after once it is done. Passes that
+    remove or copy lambdas and conditionals use it so that every other lambda
+    keeps the number it had in the ST, and so closures print the same.
+    """
+    if expression.value == "skip":
+        inner_before, expression, inner_after = expression.children
+        before += int(inner_before.value[5:-1])
+        after += int(inner_after.value[5:-1])
+    node = ASTNode("skip")
+    node.children = [ASTNode(f"<INT:{before}>"), expression,
+                     ASTNode(f"<INT:{after}>")]
+    return node
+
+
+def _envs(count: int, expression: ASTNode) -> ASTNode:
+    """
+    Returns an 'envs' node: the CSE machine moves its environment numbers on by
+    count before evaluating expression. Passes that remove applications use it
+    so that the environments created after them keep the numbers rpal.exe gives
+    them.
+    """
+    if expression.value == "envs":
+        inner_count, expression = expression.children
+        count += int(inner_count.value[5:-1])
+    node = ASTNode("envs")
+    node.children = [ASTNode(f"<INT:{count}>"), expression]
+    return node
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Inlining
+# ──────────────────────────────────────────────────────────────────────────────
+def _copy(root: ASTNode, values: Dict[str, ASTNode]) -> ASTNode:
+    """
+    Returns a copy of root with every identifier in values replaced by a copy
+    of its value.
+    """
+    if root.value.startswith("<ID:") and root.value[4:-1] in values:
+        return _copy(values[root.value[4:-1]], {})
+    node = ASTNode(root.value)
+    node.children = [_copy(child, values) for child in root.children]
+    return node
+
+
+def _uses(root: ASTNode, name: str) -> int:
+    value = f"<ID:{name}>"
+    return ((root.value == value)
+            + sum(_uses(child, name) for child in root.children))
+
+
+def _size(root: ASTNode) -> int:
+    return 1 + sum(_size(child) for child in root.children)
+
+
+def _walk(root: ASTNode) -> Iterator[ASTNode]:
+    yield root
+    for child in root.children:
+        yield from _walk(child)
+
+
+def _trivial(root: ASTNode) -> bool:
+    """
+    Returns whether evaluating a node can neither fail nor cost more than
+    reading it: identifiers, literals and tuples of those.
+    """
+    if root.value == "tau":
+        return all(_trivial(child) for child in root.children)
+    return root.value[0] == "<" and not root.children
+
+
+class _Inlinable:
+    """
+    A let-bound function 'fn x1. ... fn xn. B' whose calls can be replaced by
+    copies of B: B is small and has no lambdas, so a copy neither binds names
+    nor takes lambda numbers.
+    """
+
+    def __init__(self, name: str, parameters: List[str],
+                 body: ASTNode) -> None:
+        self.name = name
+        self.parameters = parameters
+        self.body = body
+        # Names that must mean at each call what they mean at the definition
+        self.fixed = (_free_names(body, {}) - set(parameters)) | {name}
+
+    @staticmethod
+    def of(name: str, function: ASTNode) -> Optional[_Inlinable]:
+        parameters: List[str] = []
+        node = function
+        while (node.value == "lambda" and len(node.children) == 2
+               and node.children[0].value.startswith("<ID:")):
+            parameters.append(node.children[0].value[4:-1])
+            node = node.children[1]
+        if (not parameters or _size(node) > LARGEST_INLINED_BODY
+                or any(child.value == "lambda" for child in _walk(node))
+                # In the body the name means an outer definition, hidden by
+                # the let.
+                or name in _free_names(node, {}) - set(parameters)
+                # Calls of these names run the builtin, whatever binds them.
+                or RESERVED_BUILTINS.intersection(parameters + [name])):
+            return None
+        return _Inlinable(name, parameters, node)
+
+    def inline(self, root: ASTNode) -> ASTNode:
+        """
+        Replaces the calls of the function under root that supply every
+        parameter a trivial argument, as long as nothing in between rebinds a
+        name the body uses.
+        """
+        if root.value == "lambda":
+            parameters = root.children[0]
+            bound = (parameters.children if parameters.value == ","
+                     else [parameters])
+            if any(child.value[4:-1] in self.fixed for child in bound):
+                return root
+
+        arguments: List[ASTNode] = []
+        rator = root
+        while rator.value == "gamma":
+            rator, argument = rator.children
+            arguments.append(argument)
+        arguments.reverse()
+        count = len(self.parameters)
+        if rator.value == f"<ID:{self.name}>" and len(arguments) >= count:
+            call = self._expand(arguments[:count])
+            if call is not None:
+                for argument in arguments[count:]:
+                    applied = ASTNode("gamma")
+                    applied.children = [call, self.inline(argument)]
+                    call = applied
+                return call
+
+        root.children = [self.inline(child) for child in root.children]
+        return root
+
+    def _expand(self, arguments: List[ASTNode]) -> Optional[ASTNode]:
+        values: Dict[str, ASTNode] = {}
+        for parameter, argument in zip(self.parameters, arguments):
+            # Copying a tuple is only free if the body reads it at most once.
+            if not _trivial(argument) or (
+                    argument.children and _uses(self.body, parameter) > 1):
+                return None
+            values[parameter] = argument
+        # Each parameter's application would have created an environment.
+        body = _envs(len(self.parameters), _copy(self.body, values))
+        numbers = _numbers(body)
+        # The copy's conditionals must not move the numbers of the lambdas
+        # after it.
+        return _skip(0, body, -numbers) if numbers else body
+
+
+def inline_functions(root: ASTNode) -> ASTNode:
+    """
+    Replaces calls of small, non-recursive let-bound functions by their bodies,
+    with the arguments substituted for the parameters. Then eliminate_dead_code
+    drops the bindings left unused:
+
+            gamma                             skip
+           /     \\                           /  |  \\
+       lambda    lambda          =>       1  gamma  1
+       /    \\    /    \\                     /   \\
+    Head  gamma  i   gamma                  T  <INT:1>
+          /   \\      /   \\
+       Head    T    i  <INT:1>
+
+    Only functions whose body has no lambdas and at most LARGEST_INLINED_BODY
+    nodes are inlined, and only at calls that supply all their parameters with
+    identifiers, literals or tuples of those, which cannot fail, so nothing is
+    evaluated earlier, later or more often than before. Substitution never
+    captures a name: a call is left alone when a lambda between the definition
+    and the call rebinds the function or a name its body uses. A 'skip' node
+    keeps the numbers of the conditionals that were copied.
+    """
+    root.children = [inline_functions(child) for child in root.children]
+    if (not _binding(root)
+            or not root.children[0].children[0].value.startswith("<ID:")):
+        return root
+
+    rator, function = root.children
+    inlinable = _Inlinable.of(rator.children[0].value[4:-1], function)
+    if inlinable is not None:
+        rator.children[1] = inlinable.inline(rator.children[1])
+    return root
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Dead code
+# ──────────────────────────────────────────────────────────────────────────────
+def _pure(root: ASTNode, scope: FrozenSet[str]) -> bool:
+    """
+    Returns whether evaluating a node always succeeds and has no effect:
+    lambdas, 'rec' definitions, literals, identifiers bound in scope or
+    builtins, and tuples of those. An undeclared identifier fails when it is
+    evaluated.
+    """
+    value = root.value
+    if value.startswith("<ID:"):
+        return value[4:-1] in scope or value[4:-1] in BUILTINS
+    if value == "lambda" or (value[0] == "<" and not root.children):
+        return True
+    if value == "tau":
+        return all(_pure(child, scope) for child in root.children)
+    if value in ("skip", "envs"):
+        return _pure(root.children[1], scope)
+    return (value == "gamma" and root.children[0].value == "<Y*>"
+            and root.children[1].value == "lambda")
+
+
+def _captures(root: ASTNode) -> bool:
+    """
+    Returns whether evaluating a node makes a closure over the environment it
+    runs in: a lambda other than the one a binding applies at once, or a 'rec'
+    definition.
+    """
+    if root.value == "lambda":
+        return True
+    if _binding(root):
+        return _captures(root.children[1])
+    return any(_captures(child) for child in root.children)
+
+
+class _Eliminator:
+    """
+    Removes unused bindings and unreachable branches, counting the nodes it
+    removes.
+    """
+
+    def __init__(self) -> None:
+        self.removed = 0
+
+    def eliminate(self, root: ASTNode,
+                  scope: FrozenSet[str] = frozenset()
+                  ) -> Tuple[ASTNode, FrozenSet[str]]:
+        """
+        Returns the node that replaces root and the identifiers it uses without
+        binding them. scope holds the names bound around root.
+        """
+        value = root.value
+        if value.startswith("<ID:"):
+            return root, frozenset((value[4:-1],))
+        if value == "->" and root.children[0].value in ("<true>", "<false>"):
+            return self.eliminate(self._branch(root), scope)
+        if _binding(root):
+            return self._binding(root, scope)
+
+        bound_names: FrozenSet[str] = frozenset()
+        if value == "lambda":
+            parameters = root.children[0]
+            bound = (parameters.children if parameters.value == ","
+                     else [parameters])
+            bound_names = frozenset(child.value[4:-1] for child in bound)
+        names: FrozenSet[str] = frozenset()
+        for index, child in enumerate(root.children):
+            root.children[index], used = self.eliminate(child,
+                                                        scope | bound_names)
+            names |= used
+        return root, names - bound_names
+
+    def _branch(self, root: ASTNode) -> ASTNode:
+        condition, then_part, else_part = root.children
+        if condition.value == "<true>":
+            self.removed += 1 + _size(condition) + _size(else_part)
+            return _skip(1, then_part, 1 + _numbers(else_part))
+        self.removed += 1 + _size(condition) + _size(then_part)
+        return _skip(2 + _numbers(then_part), else_part, 0)
+
+    def _binding(self, root: ASTNode,
+                 scope: FrozenSet[str]) -> Tuple[ASTNode, FrozenSet[str]]:
+        rator, value = root.children
+        parameters, body = rator.children
+        if parameters.value == ",":
+            bound = parameters.children
+        else:
+            bound = [parameters]
+        names = [child.value[4:-1] for child in bound]
+        body, body_names = self.eliminate(body, scope | frozenset(names))
+        value, value_names = self.eliminate(value, scope)
+        rator.children[1] = body
+        root.children[1] = value
+
+        if parameters.value == ",":
+            values = value.children if value.value == "tau" else None
+        else:
+            values = [value]
+        used = (body_names - set(names)) | value_names
+        if values is None or len(values) != len(bound):
+            return root, used
+
+        kept: List[Tuple[ASTNode, ASTNode]] = []
+        # Lambda numbers of the values dropped since the last one kept
+        skipped = 0
+        for name, child, bound_value in zip(names, bound, values):
+            if name in body_names or not _pure(bound_value, scope):
+                if skipped:
+                    bound_value = _skip(skipped, bound_value, 0)
+                kept.append((child, bound_value))
+                skipped = 0
+            else:
+                skipped += _numbers(bound_value)
+        if len(kept) == len(bound):
+            return root, used
+
+        if not kept:
+            if _captures(body):
+                # Closures made in the body print the environment the binding
+                # creates, so it stays, with one unused name bound to a dummy.
+                self.removed += _size(parameters) - 1 + _size(value) - 1
+                rator.children[0] = bound[0]
+                dummy = ASTNode("<dummy>")
+                root.children[1] = (_skip(skipped, dummy, 0) if skipped
+                                    else dummy)
+                return root, body_names
+            # gamma, lambda, the names and the value(s); the environment
+            # the binding would have created keeps its number.
+            self.removed += 2 + _size(parameters) + _size(value)
+            return _skip(1, _envs(1, body), skipped), body_names
+        self.removed += sum(1 + _size(bound_value)
+                            for name, bound_value in zip(names, values)
+                            if name not in body_names
+                            and _pure(bound_value, scope))
+        if len(kept) == 1:
+            # The ',' and the 'tau' go too: the one name left is bound to
+            # its value.
+            self.removed += 2
+            (child, bound_value), = kept
+            rator.children[0] = child
+            root.children[1] = bound_value
+        else:
+            parameters.children = [child for child, _ in kept]
+            value.children = [bound_value for _, bound_value in kept]
+        return (_skip(0, root, skipped) if skipped else root), used
+
+
+def eliminate_dead_code(root: ASTNode,
+                        statistics: Optional[Dict[str, int]] = None
+                        ) -> ASTNode:
+    """
+    Removes the bindings of 'let', 'where' and 'and' definitions that nothing
+    uses, and the branches of conditionals whose guard is true or false.
+
+            gamma
+           /     \\
+       lambda     lambda    =>    skip (1, envs (1, P), numbers of the lambda)
+       /    \\    /    \\
+      f      P   x     E          (f unused in P)
+
+    A binding is only removed if evaluating its value cannot fail or print: a
+    lambda, a 'rec' definition, a declared identifier, a literal or a tuple of
+    those. A definition that is only used by definitions that are themselves
+    unused goes too. When P makes closures over the binding's environment,
+    which print its number, only the value goes and the binding is kept with a
+    dummy. 'skip' nodes keep the numbers of the removed lambdas and
+    conditionals, and 'envs' nodes those of the environments of removed
+    bindings. When statistics is given, the number of ST nodes removed is added
+    to statistics["nodes_removed"].
+    """
+    eliminator = _Eliminator()
+    root, _ = eliminator.eliminate(root)
+    if statistics is not None:
+        statistics["nodes_removed"] = (statistics.get("nodes_removed", 0)
+                                       + eliminator.removed)
+    return root
+
+
+def _literal(value, size: List[int]) -> Optional[ASTNode]:
+    """
+    Returns a leaf (or a tau of leaves) that evaluates to value, or None if
+    there is none.
+    """
+    size[0] += 1
+    if size[0] > LARGEST_FOLDED_TUPLE:
+        return None
+    if type(value) is bool:
+        return ASTNode("<true>" if value else "<false>")
+    if type(value) is int:
+        return ASTNode(f"<INT:{value}>")
+    if value is None:
+        return ASTNode("<dummy>")
+    if type(value) is RPALString:
+        # String leaves lose their leading and trailing quotes when decoded.
+        text = value.value()
+        if text.startswith("'") or text.endswith("'"):
+            return None
+        return ASTNode(f"<STR:'{text}'>")
+    if type(value) is RPALTuple:
+        if not len(value):
+            return ASTNode("<nil>")
+        node = ASTNode("tau")
+        for element in value:
+            child = _literal(element, size)
+            if child is None:
+                return None
+            node.children.append(child)
+        return node
+    return None
+
+
+class _Folder:
+    """
+    Replaces closed subexpressions of a standardized tree by the values they
+    evaluate to.
+    """
+
+    def __init__(self, free: Dict[int, FrozenSet[str]]) -> None:
+        self.free = free
+        self.budget = TOTAL_STEP_BUDGET
+
+    def fold(self, root: ASTNode,
+             bound: FrozenSet[str] = frozenset()) -> ASTNode:
+        """
+        Returns the node that replaces root. bound holds the names bound
+        around root, which hide the builtins of the same name.
+        """
+        if self._worth_evaluating(root, bound):
+            replacement = self._evaluate(root)
+            if replacement is not None:
+                return replacement
+        if root.value == "lambda":
+            parameters = root.children[0]
+            names = (parameters.children if parameters.value == ","
+                     else [parameters])
+            bound |= {child.value[4:-1] for child in names}
+        root.children = [self.fold(child, bound) for child in root.children]
+        return root
+
+    def _worth_evaluating(self, root: ASTNode,
+                          bound: FrozenSet[str]) -> bool:
+        # Leaves are already values and so are lambdas; a subexpression that
+        # uses Print must print when the program runs, and one that uses a
+        # variable is not closed.
+        return (root.value[0] != "<"
+                and root.value not in ("lambda", ",", "=")
+                and self.budget > 0
+                and all(name in BUILTINS and name not in ("Print", "print")
+                        and (name in RESERVED_BUILTINS or name not in bound)
+                        for name in self.free[id(root)]))
+
+    def _evaluate(self, root: ASTNode) -> Optional[ASTNode]:
+        # The machine imports this module, so it is imported here.
+        from src.compiler import Compiler
+        from src.csemachine import CSEMachine, StepLimitExceeded
+
+        # Errors (division by zero, a failing ItoS, ...) are left to happen at
+        # run time, so nothing they print may escape now. The machine has its
+        # own output, so machines running on other threads still print.
+        machine = CSEMachine(out=io.StringIO())
+        try:
+            blocks = Compiler().compile(root)
+            value = machine.compute(blocks, min(STEP_BUDGET, self.budget))
+        except StepLimitExceeded as exceeded:
+            self.budget -= exceeded.args[0]
+            return None
+        # Builtins such as ItoS report a bad argument by calling exit, so
+        # SystemExit is caught along with every other error.
+        except (Exception, SystemExit):
+            self.budget -= machine.steps
+            return None
+        self.budget -= machine.steps
+
+        literal = _literal(value, [0])
+        if literal is None:
+            return None
+        # The environments the expression created, besides the primitive one
+        environments = machine.tracker.numbered - 1
+        if environments:
+            literal = _envs(environments, literal)
+        numbers = _numbers(root)
+        if not numbers:
+            return literal
+        return _skip(numbers, literal, 0)
+
+
+def fold_constants(root: ASTNode) -> ASTNode:
+    """
+    Evaluates every closed subexpression of a standardized tree, one that uses
+    no variables, no Print and only pure builtins, on a separate CSE machine,
+    and replaces it by its value when that value can be written as literals.
+    This covers operators over literals, tuples of constants, conditionals with
+    constant guards and calls of closed functions.
+
+             +                          <INT:7>
+            / \\         =>
+       <INT:3> <INT:4>
+
+    Each evaluation may take STEP_BUDGET steps, and all of them
+    TOTAL_STEP_BUDGET steps. A subexpression that fails (division by zero, a
+    type error, ...) or runs out of steps is left in place, so it fails, or
+    loops, when the program runs, as it would have without folding. A 'skip'
+    node keeps the numbers of the lambdas and conditionals folded away, and an
+    'envs' node those of the environments the expression created.
+    """
+    free: Dict[int, FrozenSet[str]] = {}
+    _free_names(root, free)
+    return _Folder(free).fold(root)
+
+
+def _binding(node: ASTNode) -> bool:
+    """
+    Returns whether a node is a standardized 'let' (or 'where'): gamma(lambda
+    X. P, E).
+    """
+    if node.value != "gamma":
+        return False
+    rator = node.children[0]
+    return (rator.value == "lambda"
+            and len(rator.children) == 2
+            and (rator.children[0].value == ","
+                 or rator.children[0].value.startswith("<ID:")))
+
+
+def coalesce_lets(root: ASTNode) -> ASTNode:
+    """
+    Merges chains of nested bindings into one 'let*' node, which the Compiler
+    runs in a single environment with one slot per name.
+
+             gamma                        let*
+            /     \\                    /  |  \\
+        lambda     E1                 =    =    P
+        /    \\           =>          / \\  / \\
+       X1    gamma                  X1 E1 X2 E2
+             /    \\
+         lambda    E2
+         /    \\
+        X2     P
+
+    Each Ei is evaluated after X1 ... Xi-1 are bound and sees only those,
+    exactly as in the nested form, so scoping is unchanged. Single bindings are
+    left as they are. Closures do print other environments: each Ei now runs in
+    the merged environment, which also stands for all the ones the nested form
+    creates.
+
+    The chain runs through the 'skip' nodes left by dropped bindings: what they
+    skip before moves to P and what they skip after moves to the value bound
+    just outside them, so every lambda keeps its number. Their 'envs' nodes are
+    dropped, as the environment numbers change anyway.
+    """
+    chain: List[ASTNode] = []
+    node = root
+    while _binding(node) or (node.value in ("skip", "envs") and chain):
+        chain.append(node)
+        node = (node.children[0].children[1] if node.value == "gamma"
+                else node.children[1])
+
+    if sum(link.value == "gamma" for link in chain) >= 2:
+        bindings: List[ASTNode] = []
+        skipped = 0
+        for link in chain:
+            if link.value == "envs":
+                continue
+            if link.value == "skip":
+                before, _, after = link.children
+                skipped += int(before.value[5:-1])
+                value = bindings[-1].children[1]
+                bindings[-1].children[1] = _skip(int(after.value[5:-1]),
+                                                 value, 0)
+                continue
+            rator, value = link.children
+            binding = ASTNode("=")
+            binding.children = [rator.children[0], value]
+            bindings.append(binding)
+
+        root.value = "let*"
+        root.children = bindings + [_skip(skipped, node, 0) if skipped
+                                    else node]
+
+    for child in root.children:
+        coalesce_lets(child)
+    return root
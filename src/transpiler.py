@@ -0,0 +1,477 @@
+from __future__ import annotations
+import hashlib
+import importlib.machinery
+import importlib.util
+import os
+import py_compile
+import sys
+import threading
+import types
+from typing import Dict, List, Optional, Tuple
+from src.rpal_ast import ASTNode
+from src.standardizer import standardize
+from src.optimizer import optimize
+from src.compiler import (
+    Compiler, Scope, decode_literal, BINARY_OPERATORS, UNARY_OPERATORS)
+from src.bytecode import LOAD_VAR
+from src.builtin_functions import BUILTINS, Builtin
+from src.values import NIL, RPALString
+from src.csemachine import format_value
+from src.closure_engine import ClosureEngine, _run_deep, builtin_call
+
+# Part of the cache key: change it whenever the generated code changes.
+FORMAT_VERSION = 2
+
+# The modules whose code decides what a program translates to, and those the
+# generated module runs on (folding also runs programs on the CSE machine).
+# Their source is part of the cache key too, so editing any of them makes
+# cached modules stale.
+TRANSLATOR_MODULES = ("rpal_token", "lexer", "screener", "rpal_ast", "parser",
+                      "standardizer", "optimizer", "compiler", "bytecode",
+                      "values", "builtin_functions", "errors", "csemachine",
+                      "closure_engine", "transpiler")
+
+# The generated code spells these operators; the rest call runtime functions.
+PYTHON_OPERATORS = {
+    "+": "+", "-": "-", "*": "*", "/": "//", "**": "**",
+    "gr": ">", "ge": ">=", "ls": "<", "le": "<=", "eq": "==", "ne": "!=",
+    "or": "or", "&": "and",
+}
+
+HEADER = '''\
+"""
+Generated by myrpal.py from an RPAL program; do not edit. program(rt) returns
+the function that runs the program in the primitive environment, on the engine
+rt (see PythonEngine).
+"""
+from src.builtin_functions import BUILTINS
+from src.bytecode import CodeBlock
+from src.csemachine import _aug
+from src.values import NIL, Code, Closure, RPALString, RPALTuple
+'''
+
+# Modules loaded by this process, by cache key
+_modules: Dict[str, types.ModuleType] = {}
+_modules_lock = threading.Lock()
+
+
+class Transpiler:
+    """
+    Translates an optimized standardized tree into a Python module's source.
+
+    The module mirrors what ClosureEngine builds at run time: each lambda
+    becomes a Python function of one environment list ([enclosing environment,
+    slot, ...]) wrapped in a Code, lambdas get the same numbers, and the values
+    are the CSE machine's. Subexpressions are evaluated into temporaries in the
+    CSE machine's order (operands before operators, right before left),
+    conditionals become if/elif/else, and applications in tail position return
+    through rt.tail_apply, so the engine's trampoline runs them.
+    """
+
+    def __init__(self, letrec: bool = False) -> None:
+        self.letrec = letrec
+        self.count = 0                      # Lambda numbers given so far
+        self.names = 0                      # Python names made so far
+        self.constants: Dict[Tuple[str, str], str] = {}
+        self.constant_lines: List[str] = []
+        # Lines of the lambda functions, at program level
+        self.functions: List[str] = []
+
+    def translate(self, root: ASTNode, nodes_removed: int = 0) -> str:
+        """
+        Returns the module source for the program whose optimized ST is root.
+        """
+        lines, result = self._expression(root, Scope((), None), ("e",))
+        main = ["def main(e):"] + _indent(lines + [f"return {result}"])
+        body = ["apply = rt.apply", "tail_apply = rt.tail_apply",
+                "lambda_bodies = rt.lambda_bodies", ""]
+        body += self.functions + main + ["return main"]
+        return "\n".join([HEADER] + self.constant_lines +
+                         [f"NODES_REMOVED = {nodes_removed}", "", "",
+                          "def program(rt):"] + _indent(body)) + "\n"
+
+    def _name(self, prefix: str) -> str:
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def _constant(self, kind: str, text: str, source: str) -> str:
+        name = self.constants.get((kind, text))
+        if name is None:
+            name = self.constants[(kind, text)] = self._name("k")
+            self.constant_lines.append(f"{name} = {source}")
+        return name
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Expressions: (statements to run first, Python expression for the value)
+    # ──────────────────────────────────────────────────────────────────────
+    def _expression(self, root: ASTNode, scope: Scope,
+                    envs: Tuple[str, ...]) -> Tuple[List[str], str]:
+        """
+        Returns the statements that evaluate root and an expression for its
+        value. The expression only reads variables or constants (or makes a
+        closure), so it can be evaluated later without changing the order in
+        which anything happens.
+        """
+        value = root.value
+        if value == "lambda":
+            return [], f"Closure({self._lambda(root, scope)}, {envs[0]})"
+        if value == "gamma":
+            if self.letrec and Compiler._is_letrec(root):
+                return self._letrec(root, scope, envs)
+            return self._gamma(root, scope, envs, False)
+        if value == "->":
+            result = self._name("t")
+            return self._conditional(root, scope, envs, result), result
+        if value == "let*":
+            return self._let(root, scope, envs, False)
+        if value == "skip":
+            before, expression, after = root.children
+            self.count += int(before.value[5:-1])
+            lines, result = self._expression(expression, scope, envs)
+            self.count += int(after.value[5:-1])
+            return lines, result
+        if value == "envs":
+            # Environments are named by their depth, not numbered.
+            return self._expression(root.children[1], scope, envs)
+        if value == "tau":
+            # Rule 9: the elements are evaluated from the last to the first.
+            parts = [self._expression(child, scope, envs)
+                     for child in root.children]
+            lines = [line for part, _ in reversed(parts) for line in part]
+            items = ", ".join(result for _, result in parts)
+            return self._store(lines, f"RPALTuple([{items}], {len(parts)})")
+        if value in BINARY_OPERATORS:
+            # Rule 6: the right operand is evaluated first.
+            left_lines, left = self._expression(root.children[0], scope, envs)
+            right_lines, right = self._expression(root.children[1], scope,
+                                                  envs)
+            if value == "aug":
+                expression = f"_aug({left}, {right})"
+            else:
+                expression = f"({left} {PYTHON_OPERATORS[value]} {right})"
+            return self._store(right_lines + left_lines, expression)
+        if value in UNARY_OPERATORS:
+            lines, operand = self._expression(root.children[0], scope, envs)
+            return self._store(lines, f"(not {operand})" if value == "not"
+                               else f"(-{operand})")
+        return [], self._leaf(value, scope, envs)
+
+    def _store(self, lines: List[str],
+               expression: str) -> Tuple[List[str], str]:
+        result = self._name("t")
+        return lines + [f"{result} = {expression}"], result
+
+    def _leaf(self, value: str, scope: Scope, envs: Tuple[str, ...]) -> str:
+        op, argument = decode_literal(value, scope)
+        if op == LOAD_VAR:
+            depth, slot, _ = argument
+            if depth < len(envs):
+                return f"{envs[depth]}[{slot + 1}]"
+            return envs[-1] + "[0]" * (depth - len(envs) + 1) + f"[{slot + 1}]"
+        if type(argument) is Builtin:
+            text = value[1:-1].partition(":")[2]
+            return self._constant("builtin", text, f"BUILTINS[{text!r}]")
+        if type(argument) is RPALString:
+            text = argument.value()
+            return self._constant("string", text, f"RPALString({text!r})")
+        if argument is NIL:
+            return "NIL"
+        return repr(argument)
+
+    def _lambda(self, root: ASTNode, scope: Scope) -> str:
+        # Rule 2: the lambda's function and Code are made once, at program
+        # level.
+        self.count += 1
+        left_child, body = root.children
+        if left_child.value == ",":
+            parameters = tuple(child.value[4:-1]
+                               for child in left_child.children)
+        else:
+            parameters = (left_child.value[4:-1],)
+        function = self._name("f")
+        code = self._name("c")
+        number = self.count
+        lines = self._tail(body, Scope(parameters, scope), ("e",))
+        self.functions += [f"def {function}(e):"] + _indent(lines)
+        self.functions += [
+            f"{code} = Code(CodeBlock({number}, {parameters!r}))",
+            f"{code}.instructions = {function}"]
+        if body.value == "lambda":
+            self.functions.append(f"lambda_bodies.add({code})")
+        self.functions.append("")
+        return code
+
+    def _letrec(self, root: ASTNode, scope: Scope,
+                envs: Tuple[str, ...]) -> Tuple[List[str], str]:
+        # The environment holds the closure and the closure holds the
+        # environment.
+        self.count += 1
+        name_node, function = root.children[1].children
+        eta = (self.count, name_node.value[4:-1])
+        code = self._lambda(function, Scope(eta[1:], scope))
+        self.functions.insert(-1, f"{code}.block.eta = {eta!r}")
+        inner = self._name("e")
+        return [f"{inner} = [{envs[0]}, None]",
+                f"{inner}[1] = Closure({code}, {inner})"], f"{inner}[1]"
+
+    def _gamma(self, root: ASTNode, scope: Scope, envs: Tuple[str, ...],
+               tail: bool) -> Tuple[List[str], str]:
+        # Rule 4. The operand is evaluated before the operator. Builtins are
+        # constants, so a call with all of a builtin's arguments is a Python
+        # call, as in ClosureEngine.
+        rator_node, rand_node = root.children
+        builtin, arguments = builtin_call(rator_node, rand_node, scope)
+        if builtin is not None:
+            parts = [self._expression(node, scope, envs) for node in arguments]
+            lines = [line for part, _ in reversed(parts) for line in part]
+            function = self._constant("function", builtin.name,
+                                      f"BUILTINS[{builtin.name!r}].function")
+            values = "".join(f", {result}" for _, result in parts)
+            return self._store(lines, f"{function}(rt{values})")
+
+        rator_lines, rator = self._expression(rator_node, scope, envs)
+        rand_lines, rand = self._expression(rand_node, scope, envs)
+        if tail:
+            return rand_lines + rator_lines, f"tail_apply({rator}, {rand})"
+        return self._store(rand_lines + rator_lines, f"apply({rator}, {rand})")
+
+    def _let(self, root: ASTNode, scope: Scope, envs: Tuple[str, ...],
+             tail: bool) -> Tuple[List[str], str]:
+        # One environment for all the bindings (see optimizer.coalesce_lets),
+        # numbered and scoped as Compiler._compile_let does. In tail position
+        # the lines end in a return.
+        *bindings, body_node = root.children
+        names: List[Tuple[str, ...]] = []
+        for binding in bindings:
+            left_child = binding.children[0]
+            if left_child.value == ",":
+                names.append(tuple(child.value[4:-1]
+                                   for child in left_child.children))
+            else:
+                names.append((left_child.value[4:-1],))
+        slots = sum(names, ())
+        inner = self._name("e")
+        inner_envs = (inner,) + envs
+
+        self.count += len(bindings)
+        if tail:
+            body_lines = self._tail(body_node, Scope(slots, scope),
+                                    inner_envs)
+            result = ""
+        else:
+            body_lines, result = self._expression(
+                body_node, Scope(slots, scope), inner_envs)
+        steps: List[List[str]] = []
+        slot = len(slots)
+        for binding, bound in zip(reversed(bindings), reversed(names)):
+            slot -= len(bound)
+            lines, value = self._expression(
+                binding.children[1], Scope(slots[:slot], scope), inner_envs)
+            if len(bound) == 1:
+                lines.append(f"{inner}[{slot + 1}] = {value}")
+            else:
+                # Rule 11 for a tuple of names
+                lines.append(f"{inner}[{slot + 1}:{slot + 1 + len(bound)}] = "
+                             f"[{value}[i] for i in range({len(bound)})]")
+            steps.append(lines)
+        lines = [f"{inner} = [{envs[0]}{', None' * len(slots)}]"]
+        for step in reversed(steps):
+            lines += step
+        return lines + body_lines, result
+
+    # ──────────────────────────────────────────────────────────────────────
+    # Statements
+    # ──────────────────────────────────────────────────────────────────────
+    def _tail(self, root: ASTNode, scope: Scope,
+              envs: Tuple[str, ...]) -> List[str]:
+        """
+        Returns the statements that evaluate root in tail position and return
+        its value.
+        """
+        value = root.value
+        if value == "->":
+            return self._conditional(root, scope, envs, None)
+        if value == "let*":
+            return self._let(root, scope, envs, True)[0]
+        if value == "skip":
+            before, expression, after = root.children
+            self.count += int(before.value[5:-1])
+            lines = self._tail(expression, scope, envs)
+            self.count += int(after.value[5:-1])
+            return lines
+        if value == "envs":
+            return self._tail(root.children[1], scope, envs)
+        if value == "gamma" and not (self.letrec
+                                     and Compiler._is_letrec(root)):
+            lines, result = self._gamma(root, scope, envs, True)
+        else:
+            lines, result = self._expression(root, scope, envs)
+        return lines + [f"return {result}"]
+
+    def _conditional(self, root: ASTNode, scope: Scope, envs: Tuple[str, ...],
+                     result: Optional[str]) -> List[str]:
+        # Rule 8, numbered like the Delta/beta pair it replaces. Each branch
+        # returns its value, or stores it in result outside tail position.
+        condition_node, then_node, else_node = root.children
+        self.count += 1
+        then_lines = self._branch(then_node, scope, envs, result)
+        self.count += 1
+        else_lines = self._branch(else_node, scope, envs, result)
+        lines, condition = self._expression(condition_node, scope, envs)
+        lines += [f"if {condition}:"] + _indent(then_lines)
+        # An else branch that is a single if statement becomes an elif.
+        if else_lines[0].startswith("if ") and all(
+                line.startswith(("    ", "elif ", "else:"))
+                for line in else_lines[1:]):
+            return lines + ["el" + else_lines[0]] + else_lines[1:]
+        return lines + ["else:"] + _indent(else_lines)
+
+    def _branch(self, root: ASTNode, scope: Scope, envs: Tuple[str, ...],
+                result: Optional[str]) -> List[str]:
+        if result is None:
+            return self._tail(root, scope, envs)
+        if root.value == "->":
+            return self._conditional(root, scope, envs, result)
+        lines, value = self._expression(root, scope, envs)
+        return lines + [f"{result} = {value}"]
+
+
+def _indent(lines: List[str]) -> List[str]:
+    return ["    " + line if line else line for line in lines]
+
+
+_translator_digest: Optional[str] = None
+
+
+def translator_digest() -> str:
+    """
+    Returns a hash of the source of the TRANSLATOR_MODULES, computed once per
+    process.
+    """
+    global _translator_digest
+    if _translator_digest is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in TRANSLATOR_MODULES:
+            with open(os.path.join(directory, name + ".py"), "rb") as f:
+                digest.update(f.read())
+        _translator_digest = digest.hexdigest()
+    return _translator_digest
+
+
+def cache_key(source_code: str, letrec: bool, fold: bool,
+              coalesce: bool = False) -> str:
+    """
+    Returns the key of a program's generated module: a hash of the source, the
+    options, the builtins it may refer to, the format of the generated code and
+    the code of the translator itself.
+    """
+    text = "\0".join([str(FORMAT_VERSION), translator_digest(), str(letrec),
+                      str(fold), str(coalesce), " ".join(sorted(BUILTINS)),
+                      source_code])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def translate(source_code: str, letrec: bool = False, fold: bool = False,
+              coalesce: bool = False) -> str:
+    """
+    Returns the Python module that PythonEngine runs for source_code.
+    """
+    counters = {"nodes_removed": 0}
+    st = optimize(standardize(source_code), fold=fold, coalesce=coalesce,
+                  statistics=counters)
+    return Transpiler(letrec).translate(st, counters["nodes_removed"])
+
+
+class PythonEngine(ClosureEngine):
+    """
+    Runs RPAL programs translated to Python modules (see Transpiler), which
+    CPython compiles to its own bytecode. The values, numbering, output and
+    trampoline are ClosureEngine's.
+
+    Modules are kept by cache key for the life of the process. With a
+    cache_dir, the module and its .pyc are also written there as <key>.py and
+    <key>.<python tag>.pyc, so a later run of the same program (with the same
+    options) loads the .pyc and skips lexing, parsing, standardizing,
+    optimizing and code generation.
+    """
+
+    def __init__(self, letrec: bool = False, fold: bool = False,
+                 coalesce: bool = False,
+                 cache_dir: Optional[str] = None) -> None:
+        super().__init__(letrec, fold, coalesce)
+        self.cache_dir = cache_dir
+
+    def evaluate(self, source_code: str) -> Optional[str]:
+        """
+        Runs a complete RPAL program and returns the text that should be
+        printed, or None when the program never calls Print, exactly as
+        CSEMachine.evaluate does.
+        """
+        module = self.load(source_code)
+        self.nodes_removed = module.NODES_REMOVED
+        self.lambda_bodies = set()
+        main = module.program(self)
+
+        self.print_present = False
+        value = format_value(_run_deep(main, [None]))
+        if self.print_present:
+            return str(value)
+        return None
+
+    def load(self, source_code: str) -> types.ModuleType:
+        """
+        Returns the generated module for source_code, from this process, from
+        the cache directory, or by translating and compiling it.
+        """
+        key = cache_key(source_code, self.letrec, self.fold, self.coalesce)
+        with _modules_lock:
+            module = _modules.get(key)
+        if module is not None:
+            return module
+        name = f"rpal_{key}"
+        module = self._load_cached(name, key)
+        if module is None:
+            text = translate(source_code, self.letrec, self.fold,
+                             self.coalesce)
+            if self.cache_dir is not None:
+                module = self._write_cached(name, key, text)
+            else:
+                module = types.ModuleType(name)
+                exec(compile(text, f"<{name}>", "exec"), module.__dict__)
+        with _modules_lock:
+            _modules[key] = module
+        return module
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        tag = sys.implementation.cache_tag
+        return (os.path.join(self.cache_dir, f"{key}.py"),
+                os.path.join(self.cache_dir, f"{key}.{tag}.pyc"))
+
+    def _load_cached(self, name: str, key: str) -> Optional[types.ModuleType]:
+        if self.cache_dir is None:
+            return None
+        _, compiled = self._paths(key)
+        if not os.path.exists(compiled):
+            return None
+        loader = importlib.machinery.SourcelessFileLoader(name, compiled)
+        spec = importlib.util.spec_from_loader(name, loader)
+        module = importlib.util.module_from_spec(spec)
+        try:
+            loader.exec_module(module)
+        except (ImportError, EOFError, ValueError):
+            # A .pyc from another Python or a truncated write: translate the
+            # program again.
+            return None
+        return module
+
+    def _write_cached(self, name: str, key: str,
+                      text: str) -> types.ModuleType:
+        source, compiled = self._paths(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = f"{source}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary, source)
+        py_compile.compile(source, cfile=compiled, doraise=True)
+        return self._load_cached(name, key)
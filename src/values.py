@@ -0,0 +1,336 @@
+from __future__ import annotations
+from itertools import islice
+from typing import Any, Iterator, List, Optional
+from src.bytecode import CodeBlock
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Functions
+# ──────────────────────────────────────────────────────────────────────────────
+class Code:
+    """
+    A code block as loaded into one machine. Closures share it; nothing in it
+    changes once the program is loaded.
+    Fields:
+      - block: the compiled CodeBlock (number and parameter names)
+      - arity: the number of parameters; a lambda with several takes one tuple
+      - instructions: the block's instructions linked to the machine's
+        handlers, or in the closure engine the Python function that evaluates
+        the body
+      - saturated: the loaded last lambda of a curried function (see
+        CodeBlock), or None
+      - chain: the block's chain (see CodeBlock)
+      - numbers: how many of the CSE machine's environment numbers a call
+        takes; 2 for a letrec function, whose call stands for Rule 13 binding
+        the eta and then the argument
+    """
+
+    __slots__ = ("block", "arity", "instructions", "saturated", "chain",
+                 "numbers")
+
+    def __init__(self, block: CodeBlock) -> None:
+        self.block: CodeBlock = block
+        self.arity: int = len(block.parameters)
+        self.instructions: List[Any] = []
+        self.saturated: Optional[Code] = None
+        self.chain: int = block.chain
+        self.numbers: int = 1 if block.eta is None else 2
+
+    @property
+    def number(self) -> int:
+        return self.block.number
+
+    @property
+    def bounded_variable(self) -> str:
+        return self.block.bounded_variable
+
+    def __repr__(self) -> str:
+        return repr(self.block)
+
+
+def environment_name(environment: Any) -> str:
+    """
+    Returns the name a closure prints for its environment. The CSE machine
+    numbers its environments in the order it creates them; the closure
+    engines' environments are lists [parent, slots...] with no number, so
+    they are named by their depth.
+    """
+    if type(environment) is not list:
+        return repr(environment)
+    depth = 0
+    while environment[0] is not None:
+        environment = environment[0]
+        depth += 1
+    return f"e_{depth}"
+
+
+class Closure:
+    """
+    A lambda closure (Rule 2): the code of a lambda and the environment it was
+    created in.
+    """
+
+    __slots__ = ("code", "environment")
+
+    def __init__(self, code: Code, environment: Any) -> None:
+        self.code: Code = code
+        self.environment: Any = environment
+
+    def __repr__(self) -> str:
+        eta = self.code.block.eta
+        if eta is not None:
+            # A letrec closure stands for the eta over the environment
+            # around its own.
+            environment = self.environment
+            parent = (environment[0] if type(environment) is list
+                      else environment.parent)
+            return (f"η({eta[0]}, vars={eta[1]}, "
+                    f"env={environment_name(parent)})")
+        return (f"Λ({self.code.number}, vars={self.code.bounded_variable}, "
+                f"env={environment_name(self.environment)})")
+
+
+class RecClosure:
+    """
+    The fixed point of a closure (Rule 12), written η in the CSE rules. It has
+    the same fields as the closure it was made from, so applying it (Rule 13)
+    runs that closure's code with the RecClosure itself as the argument,
+    without copying the closure. The closure engine keeps the closure that
+    unfolding it once returns in `unfolded`.
+    """
+
+    __slots__ = ("code", "environment", "unfolded")
+
+    def __init__(self, code: Code, environment: Any) -> None:
+        self.code: Code = code
+        self.environment: Any = environment
+        self.unfolded: Optional[Closure] = None
+
+    def __repr__(self) -> str:
+        return (f"η({self.code.number}, vars={self.code.bounded_variable}, "
+                f"env={environment_name(self.environment)})")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Tuples
+# ──────────────────────────────────────────────────────────────────────────────
+class RPALTuple:
+    """
+    An immutable RPAL tuple backed by a shared, append-only Python list.
+
+    A tuple is a view of the first `length` items of its list. `aug` appends in
+    place when the tuple is the longest view of its list, so building an
+    n-element tuple with repeated `aug` is O(n) overall; augmenting an older,
+    shorter view copies its items first, so no view ever sees another view's
+    elements. Indexing and Order are O(1).
+
+    Tuples print, compare and hash exactly like Python tuples of their items.
+    """
+
+    __slots__ = ("items", "length")
+
+    def __init__(self, items: List[Any], length: int) -> None:
+        self.items: List[Any] = items
+        self.length: int = length
+
+    def aug(self, value: Any) -> RPALTuple:
+        items = self.items
+        length = self.length
+        # The empty tuple is shared by every 'nil', so it never lends out
+        # its list.
+        if length and len(items) == length:
+            items.append(value)
+            return RPALTuple(items, length + 1)
+        items = items[:length]
+        items.append(value)
+        return RPALTuple(items, length + 1)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> Any:
+        length = self.length
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("tuple index out of range")
+        return self.items[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        return islice(self.items, self.length)
+
+    def to_tuple(self) -> tuple:
+        return tuple(islice(self.items, self.length))
+
+    def __add__(self, other: Any) -> RPALTuple:
+        if isinstance(other, RPALTuple):
+            return RPALTuple(self.items[:self.length]
+                             + other.items[:other.length],
+                             self.length + other.length)
+        if isinstance(other, tuple):
+            return RPALTuple(self.items[:self.length] + list(other),
+                             self.length + len(other))
+        return NotImplemented
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, RPALTuple):
+            return (self.length == other.length
+                    and self.to_tuple() == other.to_tuple())
+        if isinstance(other, tuple):
+            return self.to_tuple() == other
+        return NotImplemented
+
+    def __lt__(self, other: Any) -> bool:
+        return self.to_tuple() < _as_tuple(other)
+
+    def __le__(self, other: Any) -> bool:
+        return self.to_tuple() <= _as_tuple(other)
+
+    def __gt__(self, other: Any) -> bool:
+        return self.to_tuple() > _as_tuple(other)
+
+    def __ge__(self, other: Any) -> bool:
+        return self.to_tuple() >= _as_tuple(other)
+
+    def __hash__(self) -> int:
+        return hash(self.to_tuple())
+
+    def __repr__(self) -> str:
+        return repr(self.to_tuple())
+
+
+def _as_tuple(value: Any) -> Any:
+    return value.to_tuple() if isinstance(value, RPALTuple) else value
+
+
+NIL = RPALTuple([], 0)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Strings
+# ──────────────────────────────────────────────────────────────────────────────
+class RPALString:
+    """
+    An immutable RPAL string: either a view of `length` characters of a Python
+    string starting at `start`, or a rope node concatenating two RPAL strings.
+
+    Stern and Stem are O(1) on a view, and Conc builds a rope node in O(1), so
+    walking or building an n-character string one character at a time is O(n).
+    A rope is flattened into a view the first time its characters are needed
+    (Stern, Stem, Print, ItoS, equality); the flat text replaces the node's
+    children, so it is flattened only once. Comparing strings of different
+    lengths never flattens them.
+
+    Strings print, compare and hash exactly like the Python strings they spell.
+    """
+
+    __slots__ = ("text", "start", "length", "left", "right")
+
+    def __init__(self, text: str, start: int = 0,
+                 length: Optional[int] = None) -> None:
+        self.text: Optional[str] = text
+        self.start: int = start
+        self.length: int = len(text) - start if length is None else length
+        self.left: Optional[RPALString] = None
+        self.right: Optional[RPALString] = None
+
+    @staticmethod
+    def concat(left: RPALString, right: RPALString) -> RPALString:
+        if not left.length:
+            return right
+        if not right.length:
+            return left
+        node = RPALString.__new__(RPALString)
+        node.text = None
+        node.start = 0
+        node.length = left.length + right.length
+        node.left = left
+        node.right = right
+        return node
+
+    def value(self) -> str:
+        """
+        Returns the characters of the string as a Python string.
+        """
+        if self.text is None:
+            self._flatten()
+        text = self.text
+        start = self.start
+        if start == 0 and self.length == len(text):
+            return text
+        return text[start:start + self.length]
+
+    def _flatten(self) -> None:
+        # Ropes built by recursion are as deep as the string is long, so walk
+        # them with an explicit stack instead of recursing.
+        pieces: List[str] = []
+        pending: List[RPALString] = [self]
+        while pending:
+            node = pending.pop()
+            if node.text is None:
+                pending.append(node.right)
+                pending.append(node.left)
+            else:
+                pieces.append(node.text[node.start:node.start + node.length])
+        self.text = "".join(pieces)
+        self.start = 0
+        self.left = None
+        self.right = None
+
+    def stem(self) -> RPALString:
+        if not self.length:
+            raise IndexError("string index out of range")
+        if self.text is None:
+            self._flatten()
+        return RPALString(self.text[self.start])
+
+    def stern(self) -> RPALString:
+        if not self.length:
+            return self
+        if self.text is None:
+            self._flatten()
+        return RPALString(self.text, self.start + 1, self.length - 1)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> RPALString:
+        return RPALString(self.value()[index])
+
+    def __add__(self, other: Any) -> RPALString:
+        if isinstance(other, RPALString):
+            return RPALString.concat(self, other)
+        return NotImplemented
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, RPALString):
+            return (self.length == other.length
+                    and self.value() == other.value())
+        if isinstance(other, str):
+            return self.length == len(other) and self.value() == other
+        return NotImplemented
+
+    def __lt__(self, other: Any) -> bool:
+        return self.value() < _as_str(other)
+
+    def __le__(self, other: Any) -> bool:
+        return self.value() <= _as_str(other)
+
+    def __gt__(self, other: Any) -> bool:
+        return self.value() > _as_str(other)
+
+    def __ge__(self, other: Any) -> bool:
+        return self.value() >= _as_str(other)
+
+    def __hash__(self) -> int:
+        return hash(self.value())
+
+    def __str__(self) -> str:
+        return self.value()
+
+    def __repr__(self) -> str:
+        return repr(self.value())
+
+
+def _as_str(value: Any) -> Any:
+    return value.value() if isinstance(value, RPALString) else value
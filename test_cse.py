@@ -0,0 +1,719 @@
+import os
+import sys
+import threading
+import tracemalloc
+import pytest
+from src.csemachine import CSEMachine
+from src.closure_engine import ClosureEngine
+from src import transpiler
+from src.transpiler import PythonEngine
+from src.lazy_engine import LazyEngine
+from src.compiler import Compiler
+from src.bytecode import disassemble
+from src.standardizer import standardize
+from src.optimizer import optimize
+from src.errors import UndeclaredIdentifierError
+from src.builtin_functions import BUILTINS, builtin
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Tests")
+
+# Tests/ programs the engines and machine options are compared on
+COMPARED_PROGRAMS = ["Innerproduct1", "Treepicture", "reverse", "test",
+                     "tiny", "towers", "unique"]
+# (letrec, fold) pairs the engines are compared under
+ENGINE_OPTIONS = [(False, False), (True, False), (False, True)]
+
+
+def _source(name: str) -> str:
+    with open(os.path.join(TESTS_DIR, name)) as f:
+        return f.read()
+
+
+def _evaluate(name: str) -> str:
+    return CSEMachine().evaluate(_source(name))
+
+
+def test_add():
+    assert _evaluate("add") == "15"
+
+
+def test_Innerproduct1():
+    expected = "(0, 32, Args of unequal length, Args not both tuples)"
+    assert _evaluate("Innerproduct1") == expected
+
+
+def test_func1():
+    assert _evaluate("func1") == "[lambda closure: x: 2]"
+
+
+def test_closures_print_the_number_of_their_environment():
+    source = "let rec f n = n eq 0 -> 0 | f (n-1) in Print (f, (fn x. x, 1))"
+    expected = "(η(3, vars=f, env=e_0), Λ(2, vars=x, env=e_1))"
+    machine = CSEMachine()
+    assert machine.evaluate(source) == expected
+    assert machine.evaluate(source) == expected
+    assert ClosureEngine().evaluate(source) == expected
+
+
+def test_reverse():
+    assert _evaluate("reverse") == "(cba, daba le arroz al a zorra elabad)"
+
+
+def test_tiny():
+    assert _evaluate("tiny") == "(3)"
+
+
+def test_no_print():
+    assert _evaluate("sample") is None
+
+
+def test_machine_reuse_does_not_leak_state():
+    machine = CSEMachine()
+    names = ("add", "tiny", "sample", "vectorsum")
+    first = [machine.evaluate(_source(name)) for name in names]
+    second = [machine.evaluate(_source(name)) for name in names]
+    assert first == second == ["15", "(3)", None, "(5, 7, 9)"]
+
+
+def test_machine_reuse_starts_from_a_clean_state():
+    fresh = CSEMachine()
+    fresh.evaluate(_source("towers"))
+    reused = CSEMachine()
+    reused.evaluate(_source("tiny"))
+    reused.evaluate(_source("towers"))
+    assert reused.statistics() == fresh.statistics()
+    assert list(reused.stack) == list(fresh.stack)
+
+
+def test_machines_run_concurrently():
+    names = ["add", "tiny", "towers", "reverse", "Innerproduct2",
+             "vectorsum"] * 4
+    expected = {name: _evaluate(name) for name in set(names)}
+    results = {}
+
+    def worker(index: int, name: str) -> None:
+        results[index] = (name, CSEMachine().evaluate(_source(name)))
+
+    threads = [threading.Thread(target=worker, args=(i, name))
+               for i, name in enumerate(names)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == len(names)
+    for name, result in results.values():
+        assert result == expected[name]
+
+
+def _towers(discs: int) -> str:
+    return _source("towers").replace("'C' 4", "'C' " + str(discs))
+
+
+def test_environments_are_reclaimed_on_deep_recursion():
+    small, large = CSEMachine(), CSEMachine()
+    small.evaluate(_towers(4))
+    large.evaluate(_towers(10))
+    small_statistics, large_statistics = small.statistics(), large.statistics()
+    assert (large_statistics["environments_created"]
+            > 20 * small_statistics["environments_created"])
+    # Peak live environments follow the recursion depth, not the number of
+    # calls.
+    assert (large_statistics["peak_environments"]
+            < 3 * small_statistics["peak_environments"])
+    assert large.tracker.live == 1
+
+
+def test_deep_non_tail_recursion_restores_environments():
+    source = ("let rec Sum N = N eq 0 -> 0 | N + Sum (N-1) "
+              "in Print (Sum 3000, Sum 10)")
+    assert CSEMachine().evaluate(source) == "(4501500, 55)"
+
+
+def test_bytecode_disassembly():
+    expected = """code 0 (main):
+     0  MAKE_LAMBDA    code 2 (x)
+     1  MAKE_LAMBDA    code 1 (f)
+     2  APPLY
+     3  LOAD_CONST     <builtin Print>
+     4  TAIL_APPLY
+     5  RETURN
+
+code 1 (lambda f):
+     0  LOAD_CONST     2
+     1  LOAD_VAR       f (depth 0, slot 0)
+     2  TAIL_APPLY
+     3  RETURN
+
+code 2 (lambda x):
+     0  LOAD_CONST     1
+     1  LOAD_VAR       x (depth 0, slot 0)
+     2  BINOP          eq
+     3  JUMP_IF_FALSE  2 (to 6)
+     4  LOAD_CONST     1
+     5  RETURN
+     6  LOAD_CONST     2
+     7  LOAD_VAR       x (depth 0, slot 0)
+     8  BINOP          +
+     9  RETURN"""
+    blocks = Compiler().compile(standardize(_source("fn1")))
+    assert disassemble(blocks) == expected
+
+
+def test_lexical_addresses_reach_enclosing_environments():
+    source = ("let a = 1 in let f (x, y) = fn z. a + x * y + z "
+              "in Print (f (2, 3) 4)")
+    assert CSEMachine().evaluate(source) == "11"
+
+
+def test_undeclared_identifier_is_reported_before_execution():
+    source = "let f x = x eq 0 -> Missing | x in Print (f 1)"
+    with pytest.raises(UndeclaredIdentifierError,
+                       match="Undeclared Identifier: Missing"):
+        CSEMachine().evaluate(source)
+
+
+def test_tail_calls_run_in_constant_space():
+    source = ("let rec Loop N Acc = N eq 0 -> Acc | Loop (N-1) (Acc + N) "
+              "in Print (Loop 30000 0)")
+    machine = CSEMachine()
+    assert machine.evaluate(source) == "450015000"
+    statistics = machine.statistics()
+    assert statistics["peak_frames"] <= 4
+    assert statistics["peak_environments"] <= 10
+
+
+def test_aug_builds_long_tuples_in_linear_time():
+    source = ("let rec Build N T = N eq 0 -> T | Build (N-1) (T aug N) "
+              "in let T = Build 50000 nil in Print (Order T, T 1, T 50000)")
+    assert CSEMachine().evaluate(source) == "(50000, 50000, 1)"
+
+
+def test_aug_never_changes_an_existing_tuple():
+    source = ("let A = nil aug 1 aug 2 in let B = A aug 3 in let C = A aug 4 "
+              "in Print (A, B, C, Order A, B eq (1, 2, 3))")
+    expected = "((1, 2), (1, 2, 3), (1, 2, 4), 2, true)"
+    assert CSEMachine().evaluate(source) == expected
+
+
+def test_long_strings_are_walked_in_linear_time():
+    source = ("let rec Build N S = N eq 0 -> S | Build (N-1) (Conc S 'ab') "
+              "in let rec Length S N = S eq '' -> N | Length (Stern S) (N+1) "
+              "in let S = Build 50000 '' "
+              "in Print (Length S 0, Stem (Stern S))")
+    assert CSEMachine().evaluate(source) == "(100000, b)"
+
+
+def test_ropes_and_views_behave_like_strings():
+    source = ("Print (Isstring (Conc 'a' 'b'), Conc 'ab' 'cd' eq 'abcd', "
+              "Stern (Conc 'ab' 'c'), ItoS 42, ((Conc 'a' 'b', 1), 2))")
+    expected = "(true, true, bc, 42, (('ab', 1), 2))"
+    assert CSEMachine().evaluate(source) == expected
+
+
+def test_conc_is_curried_like_any_function():
+    assert _evaluate("conc2") == "(CIS104B, CIS104B, CIS104B)"
+
+
+def test_builtins_are_first_class_values():
+    source = ("let Twice f x = f (f x) "
+              "in Print (Twice Stern 'abcd', Isfunction Stern, Isfunction 3)")
+    assert CSEMachine().evaluate(source) == "(cd, true, false)"
+
+
+def test_new_builtins_only_need_registering():
+    @builtin("Double")
+    def double(machine, argument):
+        return 2 * argument
+    try:
+        assert CSEMachine().evaluate("Print (Double 21)") == "42"
+    finally:
+        del BUILTINS["Double"]
+
+
+@pytest.mark.parametrize("engine", [CSEMachine, ClosureEngine, PythonEngine,
+                                    LazyEngine])
+@pytest.mark.parametrize("fold", [False, True])
+def test_bindings_hide_builtins_rpal_exe_did_not_have(engine, fold):
+    source = ("let Null x = x + 1 in let Isdummy y = true "
+              "in let f x = Isdummy x -> 1 | Isinteger x -> 2 | 3 "
+              "in Print (Null 2, f 'a', (fn Null. Null 2) (fn z. z), Null 4)")
+    assert engine(fold=fold).evaluate(source) == "(3, 1, 2, 5)"
+    # rpal.exe's own builtins cannot be rebound.
+    source = "let Order x = 5 in Print (Order (1, 2), Null nil)"
+    assert engine(fold=fold).evaluate(source) == "(2, true)"
+
+
+def test_recursive_calls_allocate_little_memory():
+    # Probe stops the towers recursion at its deepest point and reports the
+    # traced memory.
+    class Deepest(Exception):
+        pass
+
+    @builtin("Probe")
+    def probe(machine, argument):
+        raise Deepest(tracemalloc.get_traced_memory()[0])
+
+    def memory_at_depth(depth):
+        source = _towers(depth).replace("T c b a (N-1) | ''",
+                                        "T c b a (N-1) | Probe ''")
+        tracemalloc.start()
+        try:
+            CSEMachine().evaluate(source)
+        except Deepest as deepest:
+            return deepest.args[0]
+        finally:
+            tracemalloc.stop()
+
+    try:
+        bytes_per_call = (memory_at_depth(600) - memory_at_depth(100)) / 500
+    finally:
+        del BUILTINS["Probe"]
+    # Each level of towers is four curried calls plus one unfolding of its eta.
+    assert bytes_per_call < 900
+
+
+@pytest.mark.parametrize("name", COMPARED_PROGRAMS)
+def test_letrec_matches_the_y_star_path(name):
+    y_star, letrec = CSEMachine(), CSEMachine(letrec=True)
+    assert letrec.evaluate(_source(name)) == y_star.evaluate(_source(name))
+    assert letrec.statistics()["steps"] < y_star.statistics()["steps"]
+
+
+@pytest.mark.parametrize("engine", [CSEMachine, ClosureEngine, PythonEngine,
+                                    LazyEngine])
+@pytest.mark.parametrize("letrec", [False, True])
+def test_recursive_functions_print_as_their_eta(engine, letrec):
+    source = "let rec f n = n eq 0 -> 0 | f (n-1) in Print {}"
+    machine = engine(letrec=letrec)
+    assert machine.evaluate(source.format("f")) == "η(2, vars=f, env=e_0)"
+    expected = "(0, η(2, vars=f, env=e_0))"
+    assert machine.evaluate(source.format("(f 3, f)")) == expected
+
+
+@pytest.mark.parametrize("quicken", [False, True])
+def test_letrec_closures_print_the_y_star_numbers(quicken):
+    source = ("let rec f n = n eq 0 -> (fn x. x + n) | f (n-1) "
+              "in let rec g a b = a eq 0 -> (fn y. y + b) | g (a-1) b "
+              "in Print (f 2, g 2 5, g 1, (g 1) 3)")
+    # rpal.exe prints these for the Y* path.
+    expected = ("(Λ(12, vars=x, env=e_25), Λ(7, vars=y, env=e_19), "
+                "Λ(5, vars=b, env=e_10), Λ(7, vars=y, env=e_8))")
+    for letrec in (False, True):
+        machine = CSEMachine(letrec=letrec, quicken=quicken)
+        assert machine.evaluate(source) == expected
+
+
+def test_letrec_recursion_is_an_ordinary_call():
+    source = ("let rec Count N = N eq 0 -> 0 | 1 + Count (N-1) "
+              "in Print (Count 1000)")
+    y_star, letrec = CSEMachine(), CSEMachine(letrec=True)
+    assert letrec.evaluate(source) == y_star.evaluate(source) == "1000"
+    # Rule 13 costs each recursive call three extra steps and one extra
+    # environment.
+    y_star_statistics, letrec_statistics = (y_star.statistics(),
+                                            letrec.statistics())
+    assert (y_star_statistics["steps"] - letrec_statistics["steps"]
+            >= 3 * 1000)
+    assert (y_star_statistics["environments_created"]
+            - letrec_statistics["environments_created"] >= 1000)
+
+
+def test_saturated_calls_bind_all_arguments_in_one_environment():
+    machine = CSEMachine()
+    assert machine.evaluate(_source("tiny")) == "(3)"
+    statistics = machine.statistics()
+    # Currying every call of tiny creates 93 environments and 75 closures.
+    assert statistics["environments_created"] <= 66
+    assert statistics["closures_created"] <= 48
+
+
+def test_curried_bodies_are_compiled_once():
+    def nested(depth):
+        source = "a + b"
+        for i in range(depth):
+            source = f"let f{i} a b = ({source}) in f{i} a b"
+        return f"let a = 1 and b = 2 in Print ({source})"
+
+    def size(depth):
+        st = optimize(standardize(nested(depth)))
+        return sum(len(block.instructions)
+                   for block in Compiler().compile(st))
+
+    # Each level adds the same code, however deep it is nested.
+    assert size(16) - size(12) == size(12) - size(8)
+    assert CSEMachine().evaluate(nested(16)) == "3"
+
+
+def test_partial_and_extra_arguments_fall_back_to_currying():
+    source = ("let Add x y z = x + y + z "
+              "in let K x y = fn (a, b). a + b + x + y "
+              "in let P = Add 1 "
+              "in Print (P 2 3, Add 1 2 3, (Add 1 2) 3, K 1 2 (3, 4))")
+    assert CSEMachine().evaluate(source) == "(6, 6, 6, 10)"
+
+
+def test_let_chains_share_one_environment():
+    machine = CSEMachine(coalesce=True)
+    source = ("let a = 1 in let b = a + 1 in let c = b + 1 in let d = c + 1 "
+              "in Print (a, d)")
+    assert machine.evaluate(source) == "(1, 4)"
+    # The primitive environment and one environment for the four bindings
+    assert machine.statistics()["environments_created"] == 2
+
+
+def test_coalesced_lets_keep_their_scoping():
+    source = ("let x = 1 in let f y = x + y in let x = 10 "
+              "in let a = x and b = f 2 "
+              "in let g = fn z. z + x + a in Print (x, a, b, g 5, f 0)")
+    assert CSEMachine().evaluate(source) == "(10, 10, 3, 25, 1)"
+    assert CSEMachine(coalesce=True).evaluate(source) == "(10, 10, 3, 25, 1)"
+
+
+def test_let_chains_keep_their_environments_by_default():
+    source = ("let a = 1 in let b = a + 1 in let f = fn x. x + b "
+              "in Print (f, f a)")
+    assert CSEMachine().evaluate(source) == "(Λ(4, vars=x, env=e_2), 3)"
+
+
+@pytest.mark.parametrize("name", ["Innerproduct1", "fn3", "func1", "string",
+                                  "tiny", "towers"])
+def test_folding_matches_the_unfolded_program(name):
+    assert CSEMachine(fold=True).evaluate(_source(name)) == _evaluate(name)
+
+
+def test_closed_subexpressions_are_folded():
+    source = ("let x = 3 + 4 * 2 in let f = fn z. z "
+              "in Print (x, (1 ls 2 -> 'a' | 1/0), (fn y. y) 5, f 6)")
+    unfolded, folded = CSEMachine(), CSEMachine(fold=True)
+    assert folded.evaluate(source) == unfolded.evaluate(source)
+    assert folded.statistics()["steps"] < unfolded.statistics()["steps"]
+    st = optimize(standardize(source), fold=True)
+    assert "LOAD_CONST     11" in disassemble(Compiler().compile(st))
+
+
+def test_folding_leaves_failures_and_printing_to_run_time():
+    with pytest.raises(ZeroDivisionError):
+        CSEMachine(fold=True).evaluate("let x = 1/0 in Print 1")
+    source = "Print (true -> 1 | 1/0, Print 2)"
+    assert CSEMachine(fold=True).evaluate(source) == "(1, 2)"
+    # A loop is given up on once it runs out of steps.
+    source = "let rec L n = L n in Print (false -> L 0 | 7)"
+    assert CSEMachine(fold=True).evaluate(source) == "7"
+
+
+def test_folding_keeps_error_messages_off_the_shared_stdout(capsys):
+    outputs = []
+
+    @builtin("Probe")
+    def probe(machine, argument):
+        outputs.append((machine.out, sys.stdout))
+        return argument
+    try:
+        # Probe 1 runs while folding, on a machine with its own output.
+        assert CSEMachine(fold=True).evaluate("Print (Probe 1, 2)") == "(1, 2)"
+        ((out, stdout),) = outputs
+        assert out is not None and stdout is sys.stdout
+        # A failing ItoS is left to run time, which prints its message once.
+        with pytest.raises(SystemExit):
+            CSEMachine(fold=True).evaluate("let x = ItoS true in Print 1")
+        expected = "Error: ItoS function can only accept integers.\n"
+        assert capsys.readouterr().out == expected
+    finally:
+        del BUILTINS["Probe"]
+
+
+def test_small_functions_are_inlined():
+    source = ("let Head i = i 1 in let Pair a b = (a, b) in let T = (5, 6) "
+              "in Print (Pair T 1, Head T)")
+    machine = CSEMachine()
+    assert machine.evaluate(source) == "(((5, 6), 1), 5)"
+    # Head and Pair are gone; only T is left to bind.
+    assert machine.statistics()["environments_created"] == 2
+    assert machine.statistics()["closures_created"] == 1
+
+
+def test_inlining_never_captures_names():
+    source = ("let y = 1 in let f x = x + y in let y = 10 in let g y = f y "
+              "in Print (f y, g 2)")
+    assert CSEMachine().evaluate(source) == "(11, 3)"
+
+
+def test_inlining_keeps_closure_numbers():
+    source = ("let Id x = x in let g = fn z. z in let Pick x = x -> g | Id g "
+              "in Print (Pick true)")
+    assert CSEMachine().evaluate(source) == "[lambda closure: z: 7]"
+
+
+# Programs whose closures print the environments they were made in, with
+# what rpal.exe prints for them
+PRINTED_CLOSURES = [
+    ("let rec f n = n eq 0 -> 0 | f (n-1) in let g x = x + 1 "
+     "in let h = fn y. y in Print (f, g, h, g 2, f 3)",
+     "(η(6, vars=f, env=e_0), Λ(5, vars=x, env=e_1), Λ(4, vars=y, env=e_2), "
+     "3, 0)"),
+    ("(fn f. Print (f 1 2 3, f 1 2, (f 1) 2 3, f 1 2 3 4)) "
+     "(fn a. fn b. fn c. fn x. a + b + c + x)",
+     "(Λ(5, vars=x, env=e_13), Λ(4, vars=c, env=e_10), "
+     "Λ(5, vars=x, env=e_8), 10)"),
+    ("let Add a b c = fn x. a + b + c + x in let P = Add 1 "
+     "in Print (Add 1 2 3, P 2, (Add 1 2) 3, Add 1 2 3 4)",
+     "(Λ(6, vars=x, env=e_14), Λ(5, vars=c, env=e_11), "
+     "Λ(6, vars=x, env=e_10), 10)"),
+    ("let Head i = i 1 in let Pair a b = (a, b) in let T = (5, (fn q. q)) "
+     "in let u = 3 and v = fn w. w "
+     "in Print (Pair T 1, Head T, v, (fn z. z + k) where k = Head T)",
+     "(((5, Λ(8, vars=q, env=e_2)), 1), 5, Λ(7, vars=w, env=e_3), "
+     "Λ(6, vars=z, env=e_6))"),
+    ("let a = 1 and b = fn x. x and c = 5 and d = fn y. y "
+     "in let Unused p = p + a in let g = fn z. z in let h = fn q. q "
+     "in Print (false -> d | (g, h))",
+     "(Λ(8, vars=z, env=e_2), Λ(7, vars=q, env=e_3))"),
+    ("let Inc x = x + 1 in let Unused y = y in let h = fn z. Inc z "
+     "in let rec L n = n eq 0 -> h | L (n - 1) "
+     "in Print (Inc 1, L 2, h, (Inc 2, (fn w. w)))",
+     "(2, Λ(10, vars=z, env=e_2), Λ(10, vars=z, env=e_2), "
+     "(3, Λ(5, vars=w, env=e_4)))"),
+]
+
+
+@pytest.mark.parametrize("source, expected", PRINTED_CLOSURES)
+@pytest.mark.parametrize("options", [{}, {"letrec": True}, {"fold": True},
+                                     {"quicken": True}])
+def test_closures_print_the_environments_of_rpal_exe(source, expected,
+                                                      options):
+    # Inlining, dead code elimination and saturated calls remove
+    # environments, but not their numbers.
+    assert CSEMachine(**options).evaluate(source) == expected
+
+
+def test_unused_bindings_and_dead_branches_are_removed():
+    source = ("let a = 1 and b = fn x. x and c = 5 and d = fn y. y "
+              "in let Unused p = p + a "
+              "in let g = fn z. z in Print (true -> d | g)")
+    machine = CSEMachine()
+    assert machine.evaluate(source) == "[lambda closure: y: 9]"
+    statistics = machine.statistics()
+    assert statistics["nodes_removed"] > 0
+    # Only d is left to bind.
+    assert statistics["environments_created"] == 2
+
+
+def test_bindings_that_can_fail_are_kept():
+    with pytest.raises(ZeroDivisionError):
+        CSEMachine().evaluate("let x = 1/0 and y = 2 in Print y")
+    for source in ("let x = undefinedName in Print 1",
+                   "let x = (1, z) and y = 2 in Print y"):
+        with pytest.raises(UndeclaredIdentifierError):
+            CSEMachine().evaluate(source)
+    # Names bound around the binding, and builtins, are still dropped.
+    machine = CSEMachine()
+    assert machine.evaluate("let f = 1 in let x = (f, Conc) in Print 1") == "1"
+    assert machine.statistics()["nodes_removed"] > 0
+
+
+def test_conditional_chains_dispatch_like_nested_conditionals():
+    source = ("let Kind x = Isinteger x -> 'int' | Isstring x -> 'str' "
+              "| Istruthvalue x -> 'bool' | Istuple x -> 'tuple' "
+              "| Isfunction x -> 'function' | Isdummy x -> 'dummy' "
+              "| 'other' in "
+              "let Name n = n eq 1 -> 'one' | n eq 'two' -> 'two' "
+              "| true eq n -> 'true' | 'none' in "
+              "Print (Kind 1, Kind 'a', Kind true, Kind nil, Kind Kind, "
+              "Kind Print, Kind dummy, Name 1, Name 'two', Name true, "
+              "Name false, Name (1, 2), Name Name)")
+    expected = ("(int, str, bool, tuple, function, function, dummy, one, two, "
+                "one, none, none, none)")
+    assert CSEMachine().evaluate(source) == expected
+
+
+def test_conditional_chains_compile_to_one_switch():
+    source = ("let Check Dom = Dom eq 'Num' -> 1 | Dom eq 'Bool' -> 2 | 3 "
+              "in Print (Check 'Bool')")
+    listing = disassemble(Compiler().compile(standardize(source)))
+    assert "SWITCH         'Num' to 2, 'Bool' to 4, else to 6" in listing
+    assert "JUMP_IF_FALSE" not in listing
+    assert CSEMachine().evaluate(source) == "2"
+
+
+@pytest.mark.parametrize("name", ["add"] + COMPARED_PROGRAMS)
+@pytest.mark.parametrize("letrec, fold", ENGINE_OPTIONS)
+def test_closure_engine_matches_the_cse_machine(name, letrec, fold):
+    expected = CSEMachine(letrec=letrec, fold=fold).evaluate(_source(name))
+    engine = ClosureEngine(letrec=letrec, fold=fold)
+    assert engine.evaluate(_source(name)) == expected
+
+
+def test_closure_engine_prints_closures_with_their_numbers():
+    for source in ("let f x y = x + y in Print (f 1)",
+                   "Print (Conc 'a', Conc 'a' 'b')"):
+        expected = CSEMachine().evaluate(source)
+        assert ClosureEngine().evaluate(source) == expected
+
+
+def test_closure_engine_runs_deep_recursion_and_long_loops():
+    deep = "let rec Sum N = N eq 0 -> 0 | N + Sum (N-1) in Print (Sum 20000)"
+    loop = ("let rec Loop N Acc = N eq 0 -> Acc | Loop (N-1) (Acc + N) "
+            "in Print (Loop 100000 0)")
+    limit = sys.getrecursionlimit()
+    engine = ClosureEngine()
+    assert engine.evaluate(deep) == "200010000"
+    assert engine.evaluate(loop) == "5000050000"
+    # The limit is raised only while the engine runs.
+    assert sys.getrecursionlimit() == limit
+
+
+def test_closure_engine_rejects_applying_a_non_function():
+    # The CSE machine drops such an application instead (see README).
+    with pytest.raises(TypeError, match="cannot apply 3"):
+        ClosureEngine().evaluate("Print (3 4)")
+
+
+@pytest.mark.parametrize("name", ["add"] + COMPARED_PROGRAMS)
+@pytest.mark.parametrize("letrec, fold", ENGINE_OPTIONS)
+def test_python_translation_matches_the_cse_machine(name, letrec, fold):
+    expected = CSEMachine(letrec=letrec, fold=fold).evaluate(_source(name))
+    engine = PythonEngine(letrec=letrec, fold=fold)
+    assert engine.evaluate(_source(name)) == expected
+
+
+def test_python_translation_is_cached_by_content(tmp_path, monkeypatch):
+    source = "let rec Sum N = N eq 0 -> 0 | N + Sum (N-1) in Print (Sum 5000)"
+    assert PythonEngine(cache_dir=str(tmp_path)).evaluate(source) == "12502500"
+    suffixes = sorted(path.suffix for path in tmp_path.iterdir())
+    assert suffixes == [".py", ".pyc"]
+
+    # A new process finds the .pyc and never translates the program again.
+    monkeypatch.setattr(transpiler, "_modules", {})
+    monkeypatch.setattr(transpiler, "translate", None)
+    engine = PythonEngine(cache_dir=str(tmp_path))
+    assert engine.evaluate(source) == "12502500"
+    monkeypatch.undo()
+    # Editing the program gives it a new key.
+    edited = source.replace("5000", "6000")
+    assert PythonEngine(cache_dir=str(tmp_path)).evaluate(edited) == "18003000"
+    assert len(list(tmp_path.iterdir())) == 4
+    # So does a change to the translator's own code.
+    key = transpiler.cache_key(source, False, False)
+    monkeypatch.setattr(transpiler, "_translator_digest", "edited")
+    assert transpiler.cache_key(source, False, False) != key
+
+
+def test_the_cache_key_covers_every_module_the_translation_uses():
+    directory = os.path.dirname(transpiler.__file__)
+    modules = {name[:-3] for name in os.listdir(directory)
+               if name.endswith(".py") and not name.startswith("__")}
+    assert modules - set(transpiler.TRANSLATOR_MODULES) == {"lazy_engine"}
+
+
+@pytest.mark.parametrize("name", ["add"] + COMPARED_PROGRAMS)
+@pytest.mark.parametrize("letrec, fold", ENGINE_OPTIONS)
+def test_lazy_evaluation_matches_the_cse_machine(name, letrec, fold):
+    expected = CSEMachine(letrec=letrec, fold=fold).evaluate(_source(name))
+    engine = LazyEngine(letrec=letrec, fold=fold)
+    assert engine.evaluate(_source(name)) == expected
+
+
+def test_lazy_evaluation_skips_what_is_never_used():
+    assert LazyEngine().evaluate("let x = 1/0 in Print 2") == "2"
+    assert LazyEngine().evaluate("let T = (1/0, 2) in Print (T 2)") == "2"
+    assert LazyEngine().evaluate("let a = 1/0 and b = 4 in Print b") == "4"
+    # A Print that is never needed never runs, so the program prints nothing.
+    assert CSEMachine().evaluate("let x = Print 3 in 5") == "5"
+    assert LazyEngine().evaluate("let x = Print 3 in 5") is None
+
+
+def test_lazy_bindings_are_evaluated_once():
+    calls = []
+
+    @builtin("Count")
+    def count(machine, argument):
+        calls.append(argument)
+        return argument
+    try:
+        source = ("let T = (Count 1, Count 2) in let x = T 1 "
+                  "in Print (x + x + T 1)")
+        assert LazyEngine().evaluate(source) == "3"
+        assert calls == [1]
+    finally:
+        del BUILTINS["Count"]
+
+
+@pytest.mark.parametrize("name", COMPARED_PROGRAMS)
+@pytest.mark.parametrize("letrec", [False, True])
+def test_memoization_matches_the_plain_machine(name, letrec):
+    expected = CSEMachine(letrec=letrec).evaluate(_source(name))
+    machine = CSEMachine(letrec=letrec, memo_size=100)
+    assert machine.evaluate(_source(name)) == expected
+
+
+@pytest.mark.parametrize("letrec", [False, True])
+def test_memoization_reuses_recursive_results(letrec):
+    source = ("let rec Fib N = N ls 2 -> N | Fib (N-1) + Fib (N-2) "
+              "in Print (Fib 25)")
+    plain = CSEMachine(letrec=letrec)
+    memo = CSEMachine(letrec=letrec, memo_size=100)
+    assert memo.evaluate(source) == plain.evaluate(source) == "75025"
+    statistics = memo.statistics()
+    assert (statistics["memo_misses"], statistics["memo_hits"]) == (26, 23)
+    assert statistics["steps"] * 1000 < plain.statistics()["steps"]
+
+
+def test_memoization_keeps_the_most_recently_used_results():
+    source = ("let rec Fib N = N ls 2 -> N | Fib (N-1) + Fib (N-2) "
+              "in Print (Fib 20, Fib 3, Fib 19)")
+    machine = CSEMachine(memo_size=2)
+    assert machine.evaluate(source) == "(6765, 2, 4181)"
+    assert len(machine.memo) == 2
+
+
+def test_memoization_skips_functions_that_can_print():
+    for source in ("let rec F n = n eq 0 -> 0 | (Print n, F (n-1)) in F 3",
+                   "let G x = Print x "
+                   "in let rec F n = n eq 0 -> 0 | (G n, F (n-1)) in F 3"):
+        machine = CSEMachine(memo_size=100)
+        assert machine.evaluate(source) == CSEMachine().evaluate(source)
+        assert machine.statistics()["memo_misses"] == 0
+
+
+def test_memoization_keys_arguments_by_value_and_type():
+    source = ("let rec F t = Order t ge 3 -> t | F (t aug 1) "
+              "in Print (F (nil aug true), F (nil aug 1), F (nil aug 1), "
+              "F (nil aug 'x'))")
+    machine = CSEMachine(memo_size=100)
+    assert machine.evaluate(source) == CSEMachine().evaluate(source)
+    assert machine.statistics()["memo_hits"] == 1
+
+
+@pytest.mark.parametrize("name", COMPARED_PROGRAMS)
+@pytest.mark.parametrize("letrec", [False, True])
+@pytest.mark.parametrize("memo_size", [0, 100])
+def test_quickening_matches_the_plain_machine(name, letrec, memo_size):
+    expected = CSEMachine(letrec=letrec).evaluate(_source(name))
+    machine = CSEMachine(letrec=letrec, memo_size=memo_size, quicken=True)
+    assert machine.evaluate(_source(name)) == expected
+
+
+@pytest.mark.parametrize("letrec", [False, True])
+def test_quickening_specializes_stable_instructions(letrec):
+    source = ("let rec Sum t n = n eq 0 -> 0 | t n + Sum t (n-1) "
+              "in Print (Sum (1,2,3,4,5,6,7,8,9,10,11,12) 12, "
+              "Sum Isinteger 3)")
+    plain = CSEMachine(letrec=letrec)
+    quick = CSEMachine(letrec=letrec, quicken=True)
+    assert quick.evaluate(source) == plain.evaluate(source)
+    statistics = quick.statistics()
+    assert statistics["steps"] == plain.statistics()["steps"]
+    assert statistics["specializations"] >= 4
+    assert statistics["deoptimizations"] == 0
+
+
+def test_quickening_deoptimizes_when_the_types_change():
+    # Same's eq is specialized to integers, then compares strings and booleans.
+    source = ("let rec Same x y = x eq y "
+              "in let rec Count n = n eq 0 -> 0 "
+              "| (Same n n -> 1 | 0) + Count (n-1) "
+              "in Print (Same true false, Same 'a' 'b', Count 20)")
+    machine = CSEMachine(quicken=True)
+    assert machine.evaluate(source) == "(false, false, 20)"
+    assert machine.statistics()["deoptimizations"] == 1